@@ -9,14 +9,22 @@ import numpy as np
 import gradio as gr
 from PIL import Image
 from typing import Tuple, Optional
-from upscaler import RealESRGANUpscaler, create_upscaler
+from backend.upscaler import BaseUpscaler, create_upscaler
 
 
 # Global upscaler instance (lazy loaded)
-_upscaler: Optional[RealESRGANUpscaler] = None
+_upscaler: Optional[BaseUpscaler] = None
 
+# Longest side of the images sent to the browser. The widgets are 350px tall,
+# so this leaves room for HiDPI screens and fullscreen view; the full-resolution
+# result is only written to the download file.
+PREVIEW_MAX_SIDE = 1280
 
-def get_upscaler() -> RealESRGANUpscaler:
+# Side of the 100% detail crop shown in the comparison section
+DETAIL_CROP_SIZE = 512
+
+
+def get_upscaler() -> BaseUpscaler:
     """Get or create the global upscaler instance."""
     global _upscaler
     if _upscaler is None:
@@ -46,6 +54,46 @@ def save_image_to_file(image: np.ndarray, output_format: str) -> str:
     return temp_path
 
 
+def make_preview(image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Resize an image to a (width, height) preview size."""
+    if (image.shape[1], image.shape[0]) == size:
+        return image
+    pil_image = Image.fromarray(image)
+    # reducing_gap shrinks large images in cheap integer steps before LANCZOS
+    return np.array(pil_image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0))
+
+
+def preview_size(width: int, height: int, max_side: int = PREVIEW_MAX_SIDE) -> Tuple[int, int]:
+    """Largest (width, height) with the same aspect ratio that fits in max_side."""
+    ratio = min(1.0, max_side / max(width, height))
+    return max(1, round(width * ratio)), max(1, round(height * ratio))
+
+
+def detail_crops(
+    original: np.ndarray,
+    output: np.ndarray,
+    size: int = DETAIL_CROP_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Matching crops from the centre of the original and the upscaled image.
+
+    The upscaled crop is at full resolution; the original crop covers the
+    same area and is enlarged to the same size, so the slider compares
+    detail that the display-size preview cannot show.
+    """
+    out_h, out_w = output.shape[:2]
+    scale_x = out_w / original.shape[1]
+    scale_y = out_h / original.shape[0]
+    crop_w, crop_h = min(size, out_w), min(size, out_h)
+    left, top = (out_w - crop_w) // 2, (out_h - crop_h) // 2
+    output_crop = output[top:top + crop_h, left:left + crop_w]
+
+    # Same area in original pixels
+    box = (left / scale_x, top / scale_y, (left + crop_w) / scale_x, (top + crop_h) / scale_y)
+    original_crop = Image.fromarray(original).resize((crop_w, crop_h), Image.Resampling.LANCZOS, box=box)
+    return np.array(original_crop), output_crop
+
+
 def upscale_image(
     input_image: np.ndarray,
     scale_factor: str,
@@ -321,27 +369,31 @@ def create_interface() -> gr.Blocks:
                 label="Drag to compare",
                 type="numpy",
             )
+            detail_comparison = gr.ImageSlider(
+                label="Detail at 100%",
+                type="numpy",
+            )
         
         # State to track download visibility
         def process_image(image, model, fmt):
             output, download_path, status = upscale_image(image, "4x", model, fmt)
             
             if output is not None and image is not None:
-                # Resize original to match upscaled for comparison
-                from PIL import Image as PILImage
-                original_pil = PILImage.fromarray(image)
-                original_resized = original_pil.resize(
-                    (output.shape[1], output.shape[0]),  # width, height
-                    PILImage.Resampling.LANCZOS
-                )
-                original_for_comparison = np.array(original_resized)
+                # The browser only gets display-size previews; the full
+                # resolution result is in the download file
+                size = preview_size(output.shape[1], output.shape[0])
+                output_preview = make_preview(output, size)
+                original_preview = make_preview(image, size)
+                if size != (output.shape[1], output.shape[0]):
+                    status += " (preview downscaled, download for full resolution)"
                 
                 return (
-                    output,
+                    output_preview,
                     status,
                     gr.update(visible=True),
                     download_path,
-                    (original_for_comparison, output),  # comparison slider - same size
+                    (original_preview, output_preview),  # comparison slider - same size
+                    detail_crops(image, output),
                 )
             else:
                 return (
@@ -350,6 +402,7 @@ def create_interface() -> gr.Blocks:
                     gr.update(visible=False),
                     None,
                     None,
+                    None,
                 )
         
         def clear_status():
@@ -362,7 +415,7 @@ def create_interface() -> gr.Blocks:
         ).then(
             fn=process_image,
             inputs=[input_image, model_choice, output_format],
-            outputs=[output_image, status_text, download_group, download_file, comparison],
+            outputs=[output_image, status_text, download_group, download_file, comparison, detail_comparison],
             show_progress="minimal",
         )
     
@@ -0,0 +1,195 @@
+"""
+NCNN Autotune
+Benchmarks realesrgan-ncnn-vulkan tile sizes, thread counts and devices on
+this host and saves the fastest combination as the profile RealESRGANUpscaler
+loads at startup.
+
+Usage (from the repository root):
+    python -m backend.autotune
+    python -m backend.autotune --image sample.png --gpus 0,1 --repeat 3
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from dataclasses import asdict, replace
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from backend.upscaler import NcnnSettings, RealESRGANUpscaler, _make_staging_dir
+
+
+DEFAULT_TILE_SIZES = "0,128,192,256,400,512"
+MODEL = "realesrgan-x4plus"
+
+
+def default_thread_candidates() -> List[str]:
+    """load:proc:save counts worth trying for this host's CPU count."""
+    cpus = os.cpu_count() or 2
+    candidates = ["", "1:2:2", "2:2:2", "1:4:2", "2:4:2"]
+    if cpus >= 8:
+        candidates += ["2:4:4", f"2:{min(8, cpus // 2)}:2"]
+    return list(dict.fromkeys(candidates))
+
+
+def _sample_image(width: int, height: int) -> np.ndarray:
+    """Synthetic photo-like input: gradients with noise, so no file is needed."""
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    image = np.stack([
+        127 + 127 * np.sin(x / 37.0),
+        255 * x / max(1, width - 1),
+        255 * y / max(1, height - 1),
+    ], axis=-1) + rng.normal(0, 6, (height, width, 3))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def measure(
+    upscaler: RealESRGANUpscaler,
+    settings: NcnnSettings,
+    input_path: Path,
+    output_path: Path,
+    repeat: int,
+) -> Optional[float]:
+    """
+    Median seconds per run with ``settings``.
+
+    Returns:
+        None if the binary fails with these settings (e.g. a tile size that
+        does not fit in GPU memory)
+    """
+    upscaler.settings = settings
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            upscaler._run_upscale(str(input_path), str(output_path), MODEL, 4)
+        except RuntimeError as e:
+            print(f"[Autotune]   failed: {e}", file=sys.stderr)
+            return None
+        samples.append(time.perf_counter() - start)
+        output_path.unlink(missing_ok=True)
+    return statistics.median(samples)
+
+
+def autotune(
+    upscaler: RealESRGANUpscaler,
+    input_path: Path,
+    output_path: Path,
+    gpus: List[str],
+    tile_sizes: List[int],
+    threads: List[str],
+    repeat: int,
+) -> Tuple[NcnnSettings, float, List[dict]]:
+    """
+    Tune one setting at a time, keeping the best value of each before
+    moving on: device, then tile size, then thread counts. This needs far
+    fewer runs than the full grid, and the settings interact little.
+
+    Returns:
+        The fastest settings, their median seconds per run, and every trial
+    """
+    best = NcnnSettings()
+    best_seconds: Optional[float] = None
+    trials: List[dict] = []
+    tried: Dict[Tuple, Optional[float]] = {}
+
+    steps = [
+        ("gpu_id", gpus),
+        ("tile_size", tile_sizes),
+        ("threads", threads),
+    ]
+    for field_name, values in steps:
+        step_best = best
+        for value in values:
+            candidate = replace(best, **{field_name: value})
+            key = tuple(asdict(candidate).values())
+            if key not in tried:
+                print(f"[Autotune] {asdict(candidate)}", file=sys.stderr)
+                tried[key] = measure(upscaler, candidate, input_path, output_path, repeat)
+                trials.append({**asdict(candidate), "seconds": tried[key]})
+            seconds = tried[key]
+            if seconds is not None and (best_seconds is None or seconds < best_seconds):
+                step_best, best_seconds = candidate, seconds
+        best = step_best
+
+    if best_seconds is None:
+        raise RuntimeError("Every candidate failed; is the Real-ESRGAN binary working?")
+    return best, best_seconds, trials
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Find the fastest realesrgan-ncnn-vulkan settings for this host")
+    parser.add_argument("--image", help="Representative input image (default: a synthetic 512x512 image)")
+    parser.add_argument("--size", type=int, default=512, help="Side of the synthetic input image")
+    parser.add_argument("--gpus", default="", help="Comma-separated -g values to try, e.g. 0,1,-1 (default: the binary's choice)")
+    parser.add_argument("--tile-sizes", default=DEFAULT_TILE_SIZES, help="Comma-separated -t values to try (0 = auto)")
+    parser.add_argument("--threads", default=None, help="Semicolon-separated -j values to try, e.g. '1:2:2;2:4:2'")
+    parser.add_argument("--repeat", type=int, default=2, help="Runs per candidate (the median is used)")
+    parser.add_argument("--models-dir", default=None, help="Directory holding the binary and models")
+    parser.add_argument("--profile", default=None, help="Where to write the profile (default: the one loaded at startup)")
+    parser.add_argument("--dry-run", action="store_true", help="Print the result without saving it")
+    args = parser.parse_args(argv)
+
+    gpus = [gpu.strip() for gpu in args.gpus.split(",")] if args.gpus else [""]
+    tile_sizes = [int(size) for size in args.tile_sizes.split(",") if size.strip()]
+    threads = [t.strip() for t in args.threads.split(";")] if args.threads else default_thread_candidates()
+    try:
+        for gpu_id in gpus:
+            NcnnSettings(gpu_id=gpu_id)
+        for tile_size in tile_sizes:
+            NcnnSettings(tile_size=tile_size)
+        for thread_counts in threads:
+            NcnnSettings(threads=thread_counts)
+    except ValueError as e:
+        parser.error(str(e))
+
+    upscaler = RealESRGANUpscaler(models_dir=args.models_dir, settings=NcnnSettings())
+    if args.profile:
+        upscaler.profile_path = Path(args.profile)
+
+    staging_dir = _make_staging_dir("autotune_")
+    input_path = staging_dir / "input.png"
+    output_path = staging_dir / "output.png"
+    try:
+        if args.image:
+            image = cv2.imread(args.image, cv2.IMREAD_COLOR)
+            if image is None:
+                parser.error(f"Could not read image: {args.image}")
+        else:
+            image = _sample_image(args.size, args.size)
+        cv2.imwrite(str(input_path), image)
+        height, width = image.shape[:2]
+
+        best, seconds, trials = autotune(upscaler, input_path, output_path, gpus, tile_sizes, threads, args.repeat)
+    finally:
+        for path in (input_path, output_path):
+            path.unlink(missing_ok=True)
+        staging_dir.rmdir()
+
+    print(f"{'tile':>6} {'threads':>10} {'gpu':>6} {'seconds':>9}")
+    for trial in trials:
+        shown = f"{trial['seconds']:.3f}" if trial["seconds"] is not None else "failed"
+        print(f"{trial['tile_size'] or 'auto':>6} {trial['threads'] or 'default':>10} {trial['gpu_id'] or 'auto':>6} {shown:>9}")
+    print(f"Best: {asdict(best)} ({seconds:.3f}s for {width}x{height})")
+
+    if not args.dry_run:
+        path = upscaler.save_settings(
+            best,
+            seconds=round(seconds, 4),
+            image_size=f"{width}x{height}",
+            model=MODEL,
+            tuned_at=datetime.now(timezone.utc).isoformat(),
+        )
+        print(f"[Autotune] Wrote {path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+Result Cache
+Content-addressed store of finished upscales, keyed by the SHA-256 of the input
+bytes plus every parameter that affects the output, so repeated submissions of
+the same image are served from disk instead of re-running inference.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from backend.locks import FileLock
+
+
+class ResultCache:
+    """
+    Disk-backed LRU cache with a byte budget and optional TTL.
+
+    Entries are written to a temporary name and renamed into place, so readers
+    never see a partially written file. File mtimes record last access, which
+    lets the LRU order survive restarts.
+
+    Several processes may share one cache directory. Each keeps its own
+    index, and a lookup that misses it checks the directory for an entry
+    another process has written. The byte budget and TTL apply to the
+    directory as a whole: every ``put`` sweeps it under a lock file shared
+    by all processes and refreshes the index from what it finds.
+
+    Since any process may evict an entry at any time, callers that serve a
+    cached file later take their own hard link to it (``get`` with
+    ``link_dir``, ``put`` without ``move``). Entries are never modified in
+    place, so the links stay valid after eviction.
+    """
+
+    TMP_SUFFIX = ".tmp"
+    LOCK_NAME = "cache.lock"
+
+    # Temporary files older than this are left over from a crash; younger
+    # ones may be another process's write in progress
+    STALE_TMP_SECONDS = 3600
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl: Optional[float] = None):
+        """
+        Initialize the cache and index any entries already on disk.
+
+        Args:
+            cache_dir: Directory holding cached results (auto-created)
+            max_bytes: Total size budget; 0 disables caching
+            ttl: Seconds since last access after which entries expire (None = never)
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # key -> (path, size), least recently used first
+        self._entries: "OrderedDict[str, Tuple[Path, int]]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        # Taken while holding _lock, since a FileLock is not shared between threads
+        self._dir_lock = FileLock(self.cache_dir / self.LOCK_NAME)
+
+        with self._lock:
+            self._sweep()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def hash_file(path: str, chunk_size: int = 1024 * 1024) -> str:
+        """SHA-256 of a file's contents."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, **params) -> str:
+        """
+        Build a cache key from the input hash and output-affecting parameters.
+
+        Args:
+            content_hash: SHA-256 hex digest of the input bytes
+            **params: Model, scale, output format and encoder settings
+        """
+        payload = json.dumps({"input": content_hash, **params}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _link(source: Path, dest: Path) -> None:
+        """Hard-link ``source`` to ``dest``, copying it across filesystems."""
+        try:
+            os.link(source, dest)
+        except OSError as e:
+            if isinstance(e, FileNotFoundError):
+                raise
+            shutil.copyfile(source, dest)
+
+    def get(self, key: str, link_dir: Optional[str] = None) -> Optional[str]:
+        """
+        Look up a cached result and mark it as recently used.
+
+        Args:
+            key: Cache key from ``make_key``
+            link_dir: Directory to link the result into. The returned file
+                then outlives the entry, which another process may evict
+                while the caller is still serving it
+
+        Returns:
+            Path to the cached file (or its link in ``link_dir``), or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._adopt(key)
+            if entry is not None and not entry[0].exists():
+                # Removed behind our back
+                self._forget(key)
+                entry = None
+            if entry is not None and self._is_expired(entry[0]):
+                self._remove(key)
+                entry = None
+
+            if entry is not None and link_dir is not None:
+                link_path = Path(link_dir) / entry[0].name
+                try:
+                    self._link(entry[0], link_path)
+                except FileNotFoundError:
+                    # Evicted by another process since it was found
+                    self._forget(key)
+                    entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            path = entry[0]
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return str(path if link_dir is None else link_path)
+
+    def put(self, key: str, source_path: str, move: bool = False) -> Optional[str]:
+        """
+        Store a result in the cache.
+
+        Args:
+            key: Cache key from ``make_key``
+            source_path: File to store
+            move: Move the file into the cache. Otherwise it is hard-linked
+                (copied across filesystems) and ``source_path`` stays valid
+                whatever the cache later evicts
+
+        Returns:
+            Path to the cached file, or None if the file was not cached
+            (caching disabled or the file alone exceeds the budget)
+        """
+        if not self.enabled:
+            return None
+
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return None
+
+        suffix = Path(source_path).suffix
+        final_path = self.cache_dir / f"{key}{suffix}"
+        tmp_path = self.cache_dir / f"{key}.{uuid.uuid4().hex}{self.TMP_SUFFIX}"
+
+        if move:
+            shutil.move(source_path, tmp_path)
+        else:
+            self._link(Path(source_path), tmp_path)
+        os.utime(tmp_path)
+        os.replace(tmp_path, final_path)
+
+        with self._lock:
+            self._sweep(keep=final_path)
+
+        return str(final_path)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters and current usage."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+    def _sweep(self, keep: Optional[Path] = None) -> None:
+        """
+        Expire and evict across every process sharing the directory, then
+        rebuild the index from what is left. Caller holds the lock.
+
+        Entries are ordered by mtime, which every lookup refreshes, so the
+        least recently used entry of any process goes first. ``keep``, the
+        entry just stored, is never evicted. Stale temporary files are
+        dropped too.
+        """
+        found = []
+        now = time.time()
+        with self._dir_lock:
+            for path in self.cache_dir.iterdir():
+                try:
+                    if not path.is_file() or path.name == self.LOCK_NAME:
+                        continue
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                if path.name.endswith(self.TMP_SUFFIX):
+                    if now - stat.st_mtime > self.STALE_TMP_SECONDS:
+                        path.unlink(missing_ok=True)
+                    continue
+                if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                    path.unlink(missing_ok=True)
+                    self.evictions += 1
+                    continue
+                found.append((stat.st_mtime, path.stem, path, stat.st_size))
+
+            total = sum(size for *_, size in found)
+            kept = []
+            for entry in sorted(found):
+                _, _, path, size = entry
+                if total > self.max_bytes and path != keep:
+                    path.unlink(missing_ok=True)
+                    total -= size
+                    self.evictions += 1
+                else:
+                    kept.append(entry)
+
+        self._entries = OrderedDict((key, (path, size)) for _, key, path, size in kept)
+        self._total_bytes = total
+
+    def _adopt(self, key: str) -> Optional[Tuple[Path, int]]:
+        """Index an entry written by another process, if there is one. Caller holds the lock."""
+        for path in self.cache_dir.glob(f"{key}.*"):
+            if path.name.endswith(self.TMP_SUFFIX):
+                continue
+            try:
+                size = path.stat().st_size
+            except FileNotFoundError:
+                continue
+            self._entries[key] = (path, size)
+            self._total_bytes += size
+            return self._entries[key]
+        return None
+
+    def _is_expired(self, path: Path) -> bool:
+        if self.ttl is None:
+            return False
+        try:
+            return time.time() - path.stat().st_mtime > self.ttl
+        except OSError:
+            return True
+
+    def _remove(self, key: str) -> None:
+        """Delete an entry and its file. Caller holds the lock."""
+        path, _ = self._entries[key]
+        self._forget(key)
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _forget(self, key: str) -> None:
+        """Drop an entry from the index. Caller holds the lock."""
+        _, size = self._entries.pop(key)
+        self._total_bytes -= size
@@ -0,0 +1,476 @@
+"""
+Cluster Mode
+Spreads inference over worker processes on other hosts. The API node runs a
+``Coordinator`` and a ``ClusterUpscaler`` in place of a local engine; workers
+(``python -m backend.worker``) register over HTTP, long-poll for tasks,
+heartbeat, and upload their results. Every engine pass (``_run_upscale``)
+becomes one task, so tiling, batching, multi-pass scales and clips work
+unchanged on top of it.
+"""
+
+import asyncio
+import os
+import shutil
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+
+from backend.upscaler import BaseUpscaler, CancelToken, UpscaleCancelled, _header_megapixels
+
+
+# Task states
+PENDING = "pending"
+ASSIGNED = "assigned"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def pack(path: str, archive_path: str) -> None:
+    """Store a file, or every file in a directory, in an uncompressed zip."""
+    source = Path(path)
+    files = sorted(entry for entry in source.iterdir() if entry.is_file()) if source.is_dir() else [source]
+    # Images are already compressed (or staged raw on purpose); deflating them costs more than it saves
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as archive:
+        for entry in files:
+            archive.write(entry, entry.name)
+
+
+def unpack(archive_path: str, directory: str) -> List[Path]:
+    """Extract a zip made by ``pack`` into ``directory`` and list the files."""
+    destination = Path(directory)
+    destination.mkdir(parents=True, exist_ok=True)
+    extracted = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            # Flat archives only: never follow a path out of the directory
+            name = os.path.basename(info.filename)
+            if not name or info.is_dir():
+                continue
+            target = destination / name
+            with archive.open(info) as source, open(target, "wb") as out:
+                shutil.copyfileobj(source, out)
+            extracted.append(target)
+    return extracted
+
+
+@dataclass
+class RemoteTask:
+    """One engine pass waiting for, or running on, a worker."""
+
+    archive_path: str
+    model: str
+    scale: int
+    output_format: Optional[str]
+    # Output file name for single-file passes, None for directory passes
+    output_name: Optional[str]
+    megapixels: float
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = PENDING
+    worker_id: Optional[str] = None
+    attempts: int = 0
+    progress: float = 0.0
+    message: str = "Waiting for a worker"
+    error: Optional[str] = None
+    result_path: Optional[str] = None
+    assigned_at: Optional[float] = None
+    done: threading.Event = field(default_factory=threading.Event)
+
+    def to_dict(self) -> dict:
+        """What a worker needs to run the task."""
+        return {
+            "id": self.id,
+            "model": self.model,
+            "scale": self.scale,
+            "output_format": self.output_format,
+            "output_name": self.output_name,
+            "megapixels": self.megapixels,
+        }
+
+
+@dataclass
+class RemoteWorker:
+    """A registered worker and what the coordinator knows about its speed."""
+
+    name: str
+    capacity: int
+    engine: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    registered_at: float = field(default_factory=time.time)
+    last_seen: float = field(default_factory=time.time)
+    tasks: Set[str] = field(default_factory=set)
+    # Assigned tasks the worker should stop, reported with the next heartbeat
+    cancelled: Set[str] = field(default_factory=set)
+    # Megapixels per second, smoothed over finished tasks (None until the first one)
+    throughput: Optional[float] = None
+    completed: int = 0
+    failed: int = 0
+
+    @property
+    def free(self) -> int:
+        return max(0, self.capacity - len(self.tasks))
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "engine": self.engine,
+            "capacity": self.capacity,
+            "running": len(self.tasks),
+            "throughput_mp_per_s": round(self.throughput, 4) if self.throughput is not None else None,
+            "completed": self.completed,
+            "failed": self.failed,
+            "registered_at": self.registered_at,
+            "last_seen": self.last_seen,
+        }
+
+
+class Coordinator:
+    """
+    Queue of engine passes and the registry of workers that run them.
+
+    Workers pull work. A task goes to the fastest waiting worker with a free
+    slot, by its measured throughput; workers that have not finished a task
+    yet are assumed to be as fast as the average. Workers that miss their
+    heartbeats are dropped and their tasks go back to the front of the queue.
+    """
+
+    def __init__(self, heartbeat_timeout: float = 15, max_attempts: int = 3, smoothing: float = 0.3):
+        """
+        Initialize the coordinator.
+
+        Args:
+            heartbeat_timeout: Seconds of silence after which a worker is considered lost
+            max_attempts: Times a task is handed out before it fails (worker losses only)
+            smoothing: Weight of the latest task in each worker's throughput average
+        """
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.smoothing = smoothing
+
+        self._workers: Dict[str, RemoteWorker] = {}
+        self._tasks: Dict[str, RemoteTask] = {}
+        self._pending: Deque[RemoteTask] = deque()
+        # Workers blocked in claim() right now
+        self._waiting: Set[str] = set()
+        self._cond = threading.Condition()
+
+    def register(self, name: str, capacity: int, engine: str) -> RemoteWorker:
+        worker = RemoteWorker(name=name, capacity=max(1, capacity), engine=engine)
+        with self._cond:
+            self._workers[worker.id] = worker
+            self._cond.notify_all()
+        print(f"[Cluster] Worker {name} registered ({capacity} slots, {engine})")
+        return worker
+
+    def deregister(self, worker_id: str) -> None:
+        """Remove a worker that is shutting down, re-queueing its tasks."""
+        with self._cond:
+            worker = self._workers.get(worker_id)
+            if worker is not None:
+                self._drop(worker, "Worker shut down")
+
+    def heartbeat(self, worker_id: str) -> List[str]:
+        """
+        Record that a worker is alive.
+
+        Returns:
+            Ids of its tasks that were cancelled and should be stopped
+
+        Raises:
+            KeyError: If the worker is unknown (e.g. it was dropped); it must register again
+        """
+        with self._cond:
+            worker = self._workers[worker_id]
+            worker.last_seen = time.time()
+            cancelled, worker.cancelled = sorted(worker.cancelled), set()
+            return cancelled
+
+    def submit(self, task: RemoteTask) -> RemoteTask:
+        with self._cond:
+            self._tasks[task.id] = task
+            self._pending.append(task)
+            self._cond.notify_all()
+        return task
+
+    def claim(self, worker_id: str, timeout: float) -> Optional[RemoteTask]:
+        """
+        Wait up to ``timeout`` seconds for a task this worker should run.
+
+        Raises:
+            KeyError: If the worker is unknown
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting.add(worker_id)
+            try:
+                while True:
+                    self._reap()
+                    worker = self._workers[worker_id]
+                    worker.last_seen = time.time()
+                    if self._pending and worker.free > 0 and self._is_best(worker):
+                        task = self._pending.popleft()
+                        task.status = ASSIGNED
+                        task.worker_id = worker.id
+                        task.attempts += 1
+                        task.assigned_at = time.time()
+                        task.message = f"Running on {worker.name}"
+                        worker.tasks.add(task.id)
+                        return task
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    # Wake up now and then to notice lost workers
+                    self._cond.wait(min(remaining, 1.0))
+            finally:
+                self._waiting.discard(worker_id)
+                # Another waiting worker may be next in line now
+                self._cond.notify_all()
+
+    def task_for(self, worker_id: str, task_id: str) -> RemoteTask:
+        """
+        A task assigned to this worker.
+
+        Raises:
+            KeyError: If the task is unknown or no longer assigned to the worker
+        """
+        with self._cond:
+            task = self._tasks[task_id]
+            if task.worker_id != worker_id or task.status != ASSIGNED:
+                raise KeyError(task_id)
+            return task
+
+    def update(self, worker_id: str, task_id: str, progress: float, message: str) -> bool:
+        """
+        Record a running task's progress.
+
+        Returns:
+            False if the task was cancelled (or reassigned) and should be stopped
+        """
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None or task.worker_id != worker_id or task.status != ASSIGNED:
+                return False
+            if worker_id in self._workers:
+                self._workers[worker_id].last_seen = time.time()
+            task.progress = max(task.progress, min(1.0, progress))
+            task.message = message
+            return True
+
+    def complete(self, worker_id: str, task_id: str, result_path: str) -> None:
+        """
+        Accept a task's result archive.
+
+        Raises:
+            KeyError: If the task is no longer assigned to this worker
+        """
+        with self._cond:
+            task = self.task_for(worker_id, task_id)
+            task.status = DONE
+            task.result_path = result_path
+            worker = self._workers.get(worker_id)
+            if worker is not None:
+                worker.tasks.discard(task_id)
+                worker.completed += 1
+                elapsed = max(1e-3, time.time() - task.assigned_at)
+                rate = max(task.megapixels, 1e-3) / elapsed
+                if worker.throughput is None:
+                    worker.throughput = rate
+                else:
+                    worker.throughput += self.smoothing * (rate - worker.throughput)
+            self._finish(task)
+
+    def fail(self, worker_id: str, task_id: str, error: str) -> None:
+        """Record an engine failure on a worker; the pass is not retried elsewhere."""
+        with self._cond:
+            task = self.task_for(worker_id, task_id)
+            worker = self._workers.get(worker_id)
+            if worker is not None:
+                worker.tasks.discard(task_id)
+                worker.failed += 1
+            task.status = FAILED
+            task.error = error
+            self._finish(task)
+
+    def cancel(self, task_id: str) -> None:
+        """Withdraw a task; a worker running it is told to stop at its next heartbeat."""
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None or task.done.is_set():
+                return
+            if task.status == PENDING:
+                self._pending.remove(task)
+            elif task.worker_id in self._workers:
+                worker = self._workers[task.worker_id]
+                worker.tasks.discard(task_id)
+                worker.cancelled.add(task_id)
+            task.status = CANCELLED
+            self._finish(task)
+
+    def forget(self, task_id: str) -> None:
+        """Drop a finished task once its result has been collected."""
+        with self._cond:
+            self._tasks.pop(task_id, None)
+
+    def workers(self) -> List[dict]:
+        with self._cond:
+            return [worker.to_dict() for worker in self._workers.values()]
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": len(self._workers),
+                "capacity": sum(worker.capacity for worker in self._workers.values()),
+                "running": sum(len(worker.tasks) for worker in self._workers.values()),
+                "pending": len(self._pending),
+            }
+
+    def reap(self) -> None:
+        """Drop workers that stopped sending heartbeats."""
+        with self._cond:
+            self._reap()
+
+    async def run_reaper(self, interval: float = 5) -> None:
+        """Reap lost workers periodically until cancelled."""
+        while True:
+            await asyncio.to_thread(self.reap)
+            await asyncio.sleep(interval)
+
+    def _is_best(self, worker: RemoteWorker) -> bool:
+        """Whether no other waiting worker with a free slot is expected to be faster. Caller holds the lock."""
+        known = [w.throughput for w in self._workers.values() if w.throughput is not None]
+        default = sum(known) / len(known) if known else 1.0
+
+        def speed(candidate: RemoteWorker) -> float:
+            return candidate.throughput if candidate.throughput is not None else default
+
+        rivals = [
+            self._workers[worker_id] for worker_id in self._waiting
+            if worker_id != worker.id and worker_id in self._workers and self._workers[worker_id].free > 0
+        ]
+        return all(speed(worker) >= speed(rival) for rival in rivals)
+
+    def _reap(self) -> None:
+        """Drop lost workers. Caller holds the lock."""
+        cutoff = time.time() - self.heartbeat_timeout
+        for worker in [w for w in self._workers.values() if w.last_seen < cutoff and w.id not in self._waiting]:
+            self._drop(worker, "Lost contact with worker")
+
+    def _drop(self, worker: RemoteWorker, reason: str) -> None:
+        """Forget a worker and re-queue its tasks at the front. Caller holds the lock."""
+        del self._workers[worker.id]
+        print(f"[Cluster] {reason}: {worker.name}")
+        for task_id in worker.tasks:
+            task = self._tasks.get(task_id)
+            if task is None or task.status != ASSIGNED:
+                continue
+            if task.attempts >= self.max_attempts:
+                task.status = FAILED
+                task.error = f"{reason} ({task.attempts} attempts)"
+                self._finish(task)
+                continue
+            task.status = PENDING
+            task.worker_id = None
+            task.progress = 0.0
+            task.message = "Waiting for a worker"
+            self._pending.appendleft(task)
+        self._cond.notify_all()
+
+    def _finish(self, task: RemoteTask) -> None:
+        """Wake the thread waiting on a task. Caller holds the lock."""
+        task.done.set()
+        self._cond.notify_all()
+
+
+class ClusterUpscaler(BaseUpscaler):
+    """
+    Engine that runs each pass on a cluster worker instead of in-process.
+
+    ``_run_pass`` packs its input into a task, waits for a worker to
+    upload the result, and reports the worker's progress as its own.
+    """
+
+    ENGINE = "cluster"
+
+    def __init__(self, coordinator: Coordinator, work_dir: str):
+        """
+        Initialize the upscaler.
+
+        Args:
+            coordinator: Coordinator the workers register with
+            work_dir: Directory for task archives (auto-created)
+        """
+        super().__init__()
+        self.coordinator = coordinator
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+
+    def _run_pass(
+        self,
+        input_path: str,
+        output_path: str,
+        model: str,
+        scale: int,
+        output_format: Optional[str] = None,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> None:
+        """Run a single upscale pass on whichever worker the coordinator picks."""
+        if cancel:
+            cancel.check()
+        source = Path(input_path)
+        is_dir = source.is_dir()
+        images = [p for p in source.iterdir() if p.suffix.lower() in self.IMAGE_EXTENSIONS] if is_dir else [source]
+
+        task_dir = self.work_dir / uuid.uuid4().hex
+        task_dir.mkdir()
+        task = None
+        try:
+            archive_path = task_dir / "input.zip"
+            pack(input_path, str(archive_path))
+            task = self.coordinator.submit(RemoteTask(
+                archive_path=str(archive_path),
+                model=model,
+                scale=scale,
+                output_format=output_format,
+                output_name=None if is_dir else Path(output_path).name,
+                megapixels=sum(_header_megapixels(path) for path in images),
+            ))
+
+            reported = None
+            while not task.done.wait(0.25):
+                try:
+                    if cancel:
+                        cancel.check()
+                except UpscaleCancelled:
+                    self.coordinator.cancel(task.id)
+                    raise
+                if progress_callback and (task.progress, task.message) != reported:
+                    reported = (task.progress, task.message)
+                    progress_callback(task.progress, task.message)
+
+            if task.status == CANCELLED:
+                raise UpscaleCancelled("Cancelled")
+            if task.status != DONE:
+                self.process_failures += 1
+                raise RuntimeError(f"Upscaling failed on worker: {task.error}")
+
+            if is_dir:
+                unpack(task.result_path, output_path)
+            else:
+                produced = unpack(task.result_path, str(task_dir / "output"))
+                if len(produced) != 1:
+                    raise RuntimeError(f"Worker returned {len(produced)} files for one image")
+                shutil.move(str(produced[0]), output_path)
+            if progress_callback:
+                progress_callback(1.0, "Complete!")
+        finally:
+            if task is not None:
+                self.coordinator.forget(task.id)
+            shutil.rmtree(task_dir, ignore_errors=True)
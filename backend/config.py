@@ -0,0 +1,174 @@
+"""
+Backend Configuration
+Runtime settings for the upscaler API, read from environment variables so the
+same code can be tuned per host without edits.
+"""
+
+import os
+import tempfile
+
+
+def _env_int(name: str, default: int) -> int:
+    """Read an integer setting from the environment."""
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise RuntimeError(f"{name} must be an integer. Got: {value!r}")
+
+
+def _host_memory_mb() -> int:
+    """Physical RAM, or the container's cgroup limit if lower (0 if unknown)."""
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):  # Windows
+        return 0
+    for limit_path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            total = min(total, int(limit))
+        break
+    return total // (1024 * 1024)
+
+
+# Inference engine: ncnn, onnx, or cluster to make this node a coordinator that
+# hands inference to workers started with `python -m backend.worker`. The
+# coordinator's state lives in memory, so it must run as a single process
+# (no uvicorn --workers); a second one on the host refuses to start.
+ENGINE = (os.environ.get("UPSCALER_ENGINE") or "ncnn").strip().lower()
+
+# Cluster mode: shared secret workers send as X-Cluster-Token (required),
+# seconds without a heartbeat before a worker's tasks are re-queued, and how
+# many times a task is handed out before it fails
+CLUSTER_TOKEN = os.environ.get("UPSCALER_CLUSTER_TOKEN", "")
+CLUSTER_HEARTBEAT_TIMEOUT = max(3, _env_int("UPSCALER_CLUSTER_HEARTBEAT_TIMEOUT", 15))
+CLUSTER_MAX_ATTEMPTS = max(1, _env_int("UPSCALER_CLUSTER_MAX_ATTEMPTS", 3))
+
+# Number of upscale jobs allowed to run at the same time
+MAX_CONCURRENT_JOBS = max(1, _env_int("UPSCALER_MAX_CONCURRENT_JOBS", 1))
+
+# Upscale jobs allowed to run at the same time across every worker process on
+# this host (uvicorn --workers N), coordinated through lock files in
+# HOST_LOCK_DIR. Keep HOST_LOCK_DIR on local disk: on shared storage the cap
+# would apply to all hosts together.
+HOST_MAX_CONCURRENT_JOBS = max(1, _env_int("UPSCALER_HOST_MAX_CONCURRENT_JOBS", MAX_CONCURRENT_JOBS))
+HOST_LOCK_DIR = os.path.abspath(
+    os.environ.get("UPSCALER_HOST_LOCK_DIR") or os.path.join(tempfile.gettempdir(), "upscaler-locks")
+)
+
+# RAM the upscales on this host may use together, shared by every worker
+# process through HOST_LOCK_DIR (default: 75% of physical or container memory;
+# 0 disables the budget). Jobs start only while their predicted peak memory
+# fits, and an image predicted to need more than its share of the budget
+# (MEMORY_BUDGET / HOST_MAX_CONCURRENT_JOBS) in one piece is upscaled in tiles.
+MEMORY_BUDGET_BYTES = max(0, _env_int("UPSCALER_MEMORY_BUDGET_MB", _host_memory_mb() * 3 // 4)) * 1024 * 1024
+
+# Number of jobs allowed to wait for a free slot before requests are rejected,
+# and how many of them one client (see CLIENT_API_KEYS) may hold
+# (0 = no per-client limit)
+MAX_QUEUED_JOBS = max(0, _env_int("UPSCALER_MAX_QUEUED_JOBS", 8))
+MAX_QUEUED_PER_CLIENT = max(0, _env_int("UPSCALER_MAX_QUEUED_PER_CLIENT", max(1, MAX_QUEUED_JOBS // 2)))
+
+def _env_set(name: str) -> frozenset:
+    """Read a comma-separated set of values from the environment."""
+    return frozenset(value.strip() for value in os.environ.get(name, "").split(",") if value.strip())
+
+
+# Queued jobs run shortest first, by predicted run time. Every second a job
+# waits takes SCHED_AGING_PERCENT of a second off its predicted time, so large
+# jobs still get their turn. One client may run at most MAX_JOBS_PER_CLIENT
+# jobs at once (0 = no cap), which leaves a slot for others. Keys in
+# PRIORITY_API_KEYS (comma-separated) skip ahead.
+SCHED_AGING_PERCENT = max(0, _env_int("UPSCALER_SCHED_AGING_PERCENT", 50))
+MAX_JOBS_PER_CLIENT = max(0, _env_int("UPSCALER_MAX_JOBS_PER_CLIENT", max(1, MAX_CONCURRENT_JOBS - 1)))
+PRIORITY_API_KEYS = _env_set("UPSCALER_PRIORITY_API_KEYS")
+
+# A client is its X-API-Key when the key is listed in CLIENT_API_KEYS or
+# PRIORITY_API_KEYS, and its address otherwise, so made-up keys cannot
+# dodge the per-client caps. Requests from TRUSTED_PROXIES (comma-separated
+# addresses) are counted against the address their proxy puts last in
+# X-Forwarded-For, skipping any trusted proxies; without it every user
+# behind the proxy would share its address and one set of caps.
+CLIENT_API_KEYS = _env_set("UPSCALER_CLIENT_API_KEYS") | PRIORITY_API_KEYS
+TRUSTED_PROXIES = _env_set("UPSCALER_TRUSTED_PROXIES")
+
+# Jobs predicted to wait longer than this for a free slot are rejected like a
+# full queue (0 = only the queue length limits admission)
+MAX_QUEUE_WAIT_SECONDS = max(0, _env_int("UPSCALER_MAX_QUEUE_WAIT", 600))
+
+# Seconds clients are told to wait (Retry-After) when the queue is full
+RETRY_AFTER_SECONDS = max(1, _env_int("UPSCALER_RETRY_AFTER", 10))
+
+# Seconds finished jobs and their result files are kept for GET /jobs/{id}/result
+JOB_RESULT_TTL_SECONDS = max(1, _env_int("UPSCALER_JOB_RESULT_TTL", 3600))
+
+# Directory, byte budget and TTL of the content-addressed result cache.
+# Set UPSCALER_CACHE_MAX_BYTES=0 to disable caching.
+CACHE_DIR = os.path.abspath(os.environ.get("UPSCALER_CACHE_DIR", "result_cache"))
+CACHE_MAX_BYTES = max(0, _env_int("UPSCALER_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+CACHE_TTL_SECONDS = max(0, _env_int("UPSCALER_CACHE_TTL", 7 * 24 * 3600)) or None
+
+# Maximum number of images accepted by POST /upscale/batch, and their largest
+# total size once extracted from any zip archives
+BATCH_MAX_FILES = max(1, _env_int("UPSCALER_BATCH_MAX_FILES", 64))
+BATCH_MAX_BYTES = max(1, _env_int("UPSCALER_BATCH_MAX_MB", 500)) * 1024 * 1024
+
+# Inputs above this many megapixels are upscaled in overlapping tiles so memory
+# stays bounded by the tile size instead of the image size
+TILE_THRESHOLD_MEGAPIXELS = max(0, _env_int("UPSCALER_TILE_THRESHOLD_MP", 8))
+TILE_SIZE = max(32, _env_int("UPSCALER_TILE_SIZE", 512))
+TILE_OVERLAP = max(0, _env_int("UPSCALER_TILE_OVERLAP", 32))
+
+# Largest accepted upload, and largest accepted image by header dimensions
+MAX_UPLOAD_BYTES = max(1, _env_int("UPSCALER_MAX_UPLOAD_MB", 50)) * 1024 * 1024
+MAX_INPUT_MEGAPIXELS = max(1, _env_int("UPSCALER_MAX_INPUT_MP", 40))
+
+# Largest output an upscale may produce (the default allows 4x of the largest input)
+MAX_OUTPUT_MEGAPIXELS = max(1, _env_int("UPSCALER_MAX_OUTPUT_MP", 640))
+
+# Animations and videos: most frames accepted, unique frames per engine run,
+# and the largest per-cell thumbnail difference (0-255) still treated as a
+# repeat of the previous frame (0 only skips exact duplicates)
+MAX_CLIP_FRAMES = max(1, _env_int("UPSCALER_MAX_CLIP_FRAMES", 1800))
+FRAME_BATCH_SIZE = max(1, _env_int("UPSCALER_FRAME_BATCH", 16))
+FRAME_DEDUPE_THRESHOLD = max(0, _env_int("UPSCALER_FRAME_DEDUPE_THRESHOLD", 2))
+
+# Edge length of the deep-zoom tiles served by GET /results/{id}/tiles
+PYRAMID_TILE_SIZE = max(64, _env_int("UPSCALER_PYRAMID_TILE", 256))
+
+# Number of outputs encoded (PNG/JPEG/WebP/AVIF) at the same time
+ENCODE_WORKERS = max(1, _env_int("UPSCALER_ENCODE_WORKERS", 2))
+
+# Per-request scratch space, shared by all worker processes (each works in its
+# own subdirectory). Inactive entries older than the TTL are swept,
+# and the oldest are dropped early when the directory exceeds its quota
+# (0 disables the quota). The TTL must outlive JOB_RESULT_TTL so job results
+# are not swept before they expire.
+WORKSPACE_DIR = os.path.abspath(os.environ.get("UPSCALER_WORKSPACE_DIR", "temp_uploads"))
+WORKSPACE_TTL_SECONDS = max(
+    JOB_RESULT_TTL_SECONDS + 600,
+    _env_int("UPSCALER_WORKSPACE_TTL", JOB_RESULT_TTL_SECONDS + 600),
+)
+WORKSPACE_MAX_BYTES = max(0, _env_int("UPSCALER_WORKSPACE_MAX_BYTES", 10 * 1024 ** 3))
+WORKSPACE_SWEEP_INTERVAL = max(1, _env_int("UPSCALER_WORKSPACE_SWEEP_INTERVAL", 60))
+
+# Run time predictions, learned from every engine pass and kept in
+# COST_MODEL_PATH (default: cost_model.json in the models directory), shared by
+# every process using the file. Until a model has a few runs, a pass is guessed
+# at COST_PRIOR_SECONDS_PER_MP seconds per input megapixel, times the model's
+# relative cost.
+COST_MODEL_PATH = os.environ.get("UPSCALER_COST_MODEL_PATH", "")
+COST_PRIOR_SECONDS_PER_MP = max(1, _env_int("UPSCALER_COST_PRIOR_SECONDS_PER_MP", 10))
+
+# Per-request inference time limit: a base allowance plus TIMEOUT_FACTOR times
+# the predicted run time, capped. Runs past their limit are killed and
+# answered with 504.
+TIMEOUT_BASE_SECONDS = max(1, _env_int("UPSCALER_TIMEOUT_BASE", 60))
+TIMEOUT_FACTOR = max(1, _env_int("UPSCALER_TIMEOUT_FACTOR", 6))
+TIMEOUT_MAX_SECONDS = max(1, _env_int("UPSCALER_TIMEOUT_MAX", 3600))
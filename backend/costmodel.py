@@ -0,0 +1,258 @@
+"""
+Inference Cost Model
+Learns how long each model takes from the engine passes the upscaler times,
+so queue order, ETAs, admission and time limits come from measured run times
+instead of fixed guesses. Fits are kept on disk and shared by every process
+using the same file.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Mapping, Optional
+
+from backend.locks import FileLock
+
+
+@dataclass
+class _Fit:
+    """
+    Exponentially weighted least-squares sums for seconds = a + b * megapixels.
+
+    Every observation first scales the sums by the decay factor, so older
+    runs fade out and the fit follows driver, hardware or setting changes.
+    """
+
+    weight: float = 0.0
+    sum_x: float = 0.0
+    sum_y: float = 0.0
+    sum_xx: float = 0.0
+    sum_xy: float = 0.0
+    # Undecayed number of observations, to tell a fit from a guess
+    count: int = 0
+
+    def add(self, x: float, y: float, decay: float) -> None:
+        self.scale(decay)
+        self.weight += 1.0
+        self.sum_x += x
+        self.sum_y += y
+        self.sum_xx += x * x
+        self.sum_xy += x * y
+        self.count += 1
+
+    def scale(self, factor: float) -> None:
+        self.weight *= factor
+        self.sum_x *= factor
+        self.sum_y *= factor
+        self.sum_xx *= factor
+        self.sum_xy *= factor
+
+    def merged(self, newer: "_Fit", decay: float) -> "_Fit":
+        """This fit followed by the ``newer.count`` observations summed in ``newer``."""
+        factor = decay ** newer.count
+        return _Fit(
+            weight=self.weight * factor + newer.weight,
+            sum_x=self.sum_x * factor + newer.sum_x,
+            sum_y=self.sum_y * factor + newer.sum_y,
+            sum_xx=self.sum_xx * factor + newer.sum_xx,
+            sum_xy=self.sum_xy * factor + newer.sum_xy,
+            count=self.count + newer.count,
+        )
+
+    def coefficients(self) -> Optional[tuple]:
+        """(overhead seconds, seconds per megapixel), or None without data."""
+        if self.weight <= 0 or self.sum_x <= 0:
+            return None
+        mean_x = self.sum_x / self.weight
+        mean_y = self.sum_y / self.weight
+        variance = self.sum_xx / self.weight - mean_x * mean_x
+        if variance > 1e-6 * max(mean_x * mean_x, 1e-6):
+            slope = (self.sum_xy / self.weight - mean_x * mean_y) / variance
+            intercept = mean_y - slope * mean_x
+            if slope > 0 and intercept >= 0:
+                return intercept, slope
+        # All runs the same size, or a fit that makes no physical sense:
+        # fall back to plain throughput
+        return 0.0, self.sum_y / self.sum_x
+
+
+class CostModel:
+    """
+    Online per-model run time predictions for the inference engine.
+
+    The upscaler reports every engine pass as (model, native scale, input
+    megapixels, seconds). Each model and scale gets its own linear fit of
+    seconds against megapixels: the intercept is start-up cost (process
+    launch, model load), the slope the engine's throughput. Until a model
+    has ``min_samples`` runs, predictions fall back to
+    ``prior_seconds_per_megapixel`` times the model's relative weight.
+
+    Fits are stored per engine profile (engine plus execution settings), so
+    changing the tile size or device starts a new fit instead of mixing
+    timings. Each process merges its new observations into the file under a
+    lock, so workers sharing a file share what they learn.
+    """
+
+    VERSION = 1
+
+    def __init__(
+        self,
+        path: Optional[str],
+        profile: str,
+        prior_seconds_per_megapixel: float,
+        weights: Optional[Mapping[str, float]] = None,
+        half_life: int = 200,
+        min_samples: int = 3,
+        save_interval: float = 30,
+    ):
+        """
+        Initialize the model and load any fits already on disk.
+
+        Args:
+            path: JSON file holding the fits (None keeps them in memory only)
+            profile: Engine and settings the timings belong to
+            prior_seconds_per_megapixel: Guess used before a model has data
+            weights: Relative cost of each model, applied to the guess
+            half_life: Observations after which a run counts half as much
+            min_samples: Runs needed before a fit replaces the guess
+            save_interval: Least seconds between writes to ``path``
+        """
+        self.path = Path(path) if path else None
+        self.profile = profile
+        self.prior_seconds_per_megapixel = prior_seconds_per_megapixel
+        self.weights = dict(weights or {})
+        self.decay = 0.5 ** (1.0 / max(1, half_life))
+        self.min_samples = max(1, min_samples)
+        self.save_interval = save_interval
+
+        self._fits: Dict[str, _Fit] = {}
+        # Observations since the last save, summed on their own for merging
+        self._unsaved: Dict[str, _Fit] = {}
+        self._last_save = time.monotonic()
+        self._lock = threading.Lock()
+
+        if self.path is not None:
+            self._fits = self._read().get(self.profile, {})
+
+    def observe(self, model: str, scale: int, megapixels: float, seconds: float) -> None:
+        """Record one engine pass; saved to disk at most every ``save_interval`` seconds."""
+        if megapixels <= 0 or seconds <= 0 or not math.isfinite(seconds):
+            return
+        key = self._key(model, scale)
+        with self._lock:
+            self._fits.setdefault(key, _Fit()).add(megapixels, seconds, self.decay)
+            self._unsaved.setdefault(key, _Fit()).add(megapixels, seconds, self.decay)
+            due = time.monotonic() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def predict(self, model: str, scale: int, megapixels: float) -> float:
+        """Predicted seconds for one engine pass over ``megapixels``."""
+        fit = self._fitted(self._key(model, scale))
+        if fit is None:
+            return megapixels * self.prior_seconds_per_megapixel * self.weights.get(model, 1.0)
+        intercept, slope = fit
+        return intercept + slope * megapixels
+
+    def is_fitted(self, model: str, scale: int) -> bool:
+        return self._fitted(self._key(model, scale)) is not None
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Current fits, for status endpoints."""
+        with self._lock:
+            fits = dict(self._fits)
+        report = {}
+        for key, fit in sorted(fits.items()):
+            coefficients = fit.coefficients()
+            if coefficients is None:
+                continue
+            intercept, slope = coefficients
+            report[key] = {
+                "runs": fit.count,
+                "fitted": fit.count >= self.min_samples,
+                "overhead_seconds": round(intercept, 3),
+                "megapixels_per_second": round(1.0 / slope, 4) if slope > 0 else None,
+            }
+        return report
+
+    def save(self) -> None:
+        """Merge this process's new observations into the file."""
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+            self._last_save = time.monotonic()
+        if self.path is None or not unsaved:
+            return
+
+        try:
+            with FileLock(self.path.with_name(f"{self.path.name}.lock")):
+                data = self._read()
+                stored = data.setdefault(self.profile, {})
+                for key, newer in unsaved.items():
+                    stored[key] = stored[key].merged(newer, self.decay) if key in stored else newer
+                self._write(data)
+        except OSError as e:
+            print(f"[CostModel] Could not save {self.path}: {e}")
+            # Keep the observations for the next attempt
+            with self._lock:
+                for key, newer in unsaved.items():
+                    pending = self._unsaved.get(key)
+                    self._unsaved[key] = newer.merged(pending, self.decay) if pending else newer
+            return
+
+        # Pick up what other processes learned meanwhile, plus anything
+        # observed here while the file was being written
+        with self._lock:
+            for key, fit in stored.items():
+                pending = self._unsaved.get(key)
+                self._fits[key] = fit.merged(pending, self.decay) if pending else fit
+
+    def _fitted(self, key: str) -> Optional[tuple]:
+        with self._lock:
+            fit = self._fits.get(key)
+            if fit is None or fit.count < self.min_samples:
+                return None
+            return fit.coefficients()
+
+    @staticmethod
+    def _key(model: str, scale: int) -> str:
+        return f"{model}@{int(scale)}x"
+
+    def _read(self) -> Dict[str, Dict[str, _Fit]]:
+        """All profiles' fits in the file; a missing or unreadable file is empty."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[CostModel] Ignoring unreadable {self.path}: {e}")
+            return {}
+        if data.get("version") != self.VERSION:
+            return {}
+        profiles = {}
+        for profile, fits in data.get("profiles", {}).items():
+            try:
+                profiles[profile] = {key: _Fit(**fit) for key, fit in fits.items()}
+            except TypeError:
+                continue
+        return profiles
+
+    def _write(self, profiles: Dict[str, Dict[str, _Fit]]) -> None:
+        """Atomically replace the file."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        data = {
+            "version": self.VERSION,
+            "profiles": {
+                profile: {key: asdict(fit) for key, fit in fits.items()}
+                for profile, fits in profiles.items()
+            },
+        }
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, self.path)
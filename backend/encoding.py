@@ -0,0 +1,238 @@
+"""
+Output Encoding
+Encodes upscaled images into the requested delivery format with per-format
+quality controls, on a worker pool separate from inference so encoding never
+holds an inference slot.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+import cv2
+from PIL import Image, features
+
+from backend.locks import HostBudget
+
+
+# Output format -> (PIL encoder, media type, file extension)
+FORMATS = {
+    "png": ("PNG", "image/png", "png"),
+    "jpg": ("JPEG", "image/jpeg", "jpg"),
+    "jpeg": ("JPEG", "image/jpeg", "jpg"),
+    "webp": ("WEBP", "image/webp", "webp"),
+    "avif": ("AVIF", "image/avif", "avif"),
+}
+
+# Longest side each format can store; Pillow refuses larger images when saving
+MAX_SIDE = {
+    "jpg": 65500,
+    "webp": 16383,
+    "gif": 65535,
+}
+
+
+def check_dimensions(format: str, width: int, height: int) -> None:
+    """
+    Check that a ``width`` x ``height`` image fits in ``format``.
+
+    Raises:
+        ValueError: If a side is longer than the format allows
+    """
+    limit = MAX_SIDE.get(format)
+    if limit is not None and max(width, height) > limit:
+        raise ValueError(
+            f"Output would be {width}x{height}, but {format.upper()} images are limited to "
+            f"{limit} pixels per side. Choose another format or a smaller scale"
+        )
+
+
+@dataclass(frozen=True)
+class EncodeOptions:
+    """
+    Encoder settings for one output.
+
+    Attributes:
+        format: Output format (png, jpg, webp or avif)
+        quality: Lossy quality 1-100 (jpg, webp, avif)
+        png_compression: zlib level 0-9 (png); lower is faster and larger.
+            None keeps the engine's PNG as it is, without re-encoding it
+        progressive: Progressive JPEG
+        optimize: Optimized Huffman tables (jpg) / extra PNG size search (png)
+        webp_method: WebP effort 0-6; higher is slower and smaller
+    """
+
+    format: str = "png"
+    quality: int = 90
+    png_compression: Optional[int] = None
+    progressive: bool = False
+    optimize: bool = False
+    webp_method: int = 4
+
+    def __post_init__(self):
+        fmt = self.format.lower()
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format: {self.format}. Available: {sorted(set(FORMATS) - {'jpeg'})}")
+        object.__setattr__(self, "format", FORMATS[fmt][2])
+
+        if not 1 <= self.quality <= 100:
+            raise ValueError(f"Quality must be between 1 and 100. Got: {self.quality}")
+        if self.png_compression is not None and not 0 <= self.png_compression <= 9:
+            raise ValueError(f"PNG compression must be between 0 and 9. Got: {self.png_compression}")
+        if not 0 <= self.webp_method <= 6:
+            raise ValueError(f"WebP method must be between 0 and 6. Got: {self.webp_method}")
+        if self.format == "avif" and not features.check("avif"):
+            raise ValueError("AVIF output is not supported by this Pillow build")
+
+    @property
+    def keeps_source(self) -> bool:
+        """Whether the lossless PNG from the engine is delivered as it is."""
+        return self.format == "png" and self.png_compression is None and not self.optimize
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format][2]
+
+    @property
+    def media_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    def cache_params(self) -> dict:
+        """Settings that affect the encoded bytes, for cache keys."""
+        params = asdict(self)
+        if self.format == "png":
+            del params["quality"], params["progressive"], params["webp_method"]
+        elif self.format == "jpg":
+            del params["png_compression"], params["webp_method"]
+        elif self.format == "webp":
+            del params["png_compression"], params["progressive"], params["optimize"]
+        else:
+            del params["png_compression"], params["progressive"], params["optimize"], params["webp_method"]
+        return params
+
+
+@dataclass
+class EncodeResult:
+    """An encoded output file."""
+
+    path: str
+    format: str
+    media_type: str
+    size: int
+    seconds: float
+
+
+def _read_output(path: str) -> Image.Image:
+    """
+    Decode an engine output for encoding.
+
+    The file is our own intermediate, already checked against the output size
+    limit, so it is decoded with OpenCV rather than Pillow, whose decompression
+    bomb guard rejects outputs over ~179 MP.
+    """
+    pixels = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if pixels is None:
+        raise ValueError(f"Could not decode image: {path}")
+    if pixels.dtype != "uint8":
+        pixels = (pixels >> 8).astype("uint8")
+    if pixels.ndim == 3:
+        code = cv2.COLOR_BGRA2RGBA if pixels.shape[2] == 4 else cv2.COLOR_BGR2RGB
+        cv2.cvtColor(pixels, code, dst=pixels)
+    return Image.fromarray(pixels)
+
+
+def encode_image(source_path: str, dest_path: str, options: EncodeOptions) -> EncodeResult:
+    """
+    Encode an image file into the format described by ``options``.
+
+    When ``options.keeps_source`` is set, the source is moved to
+    ``dest_path`` instead of being decoded and encoded again.
+
+    Args:
+        source_path: Lossless inference output (PNG)
+        dest_path: Where to write the encoded file
+        options: Encoder settings
+
+    Returns:
+        The encoded file, its size in bytes and the time spent encoding
+    """
+    start = time.perf_counter()
+    if options.keeps_source:
+        os.replace(source_path, dest_path)
+    else:
+        with _read_output(source_path) as image:
+            if options.format == "jpg" and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+
+            if options.format == "png":
+                compress_level = 6 if options.png_compression is None else options.png_compression
+                params = {"compress_level": compress_level, "optimize": options.optimize}
+            elif options.format == "jpg":
+                params = {
+                    "quality": options.quality,
+                    "progressive": options.progressive,
+                    "optimize": options.optimize,
+                }
+            elif options.format == "webp":
+                params = {"quality": options.quality, "method": options.webp_method}
+            else:
+                params = {"quality": options.quality}
+
+            image.save(dest_path, format=FORMATS[options.format][0], **params)
+
+    return EncodeResult(
+        path=dest_path,
+        format=options.format,
+        media_type=options.media_type,
+        size=os.path.getsize(dest_path),
+        seconds=time.perf_counter() - start,
+    )
+
+
+class Encoder:
+    """
+    Worker pool for output encoding, kept apart from the inference executor.
+
+    With a ``memory`` budget, each encode first reserves its predicted peak
+    memory from the budget the inference jobs share.
+    """
+
+    def __init__(self, max_workers: int = 2, memory: Optional[HostBudget] = None):
+        """
+        Initialize the encoder pool.
+
+        Args:
+            max_workers: Number of images encoded at the same time
+            memory: Host memory budget encodes reserve from
+        """
+        self.memory = memory
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="encoder")
+
+    def submit(self, source_path: str, dest_path: str, options: EncodeOptions, memory_bytes: int = 0) -> Future:
+        """Queue an encode of predicted peak ``memory_bytes``; the future resolves to an ``EncodeResult``."""
+        return self._pool.submit(self._encode, source_path, dest_path, options, memory_bytes)
+
+    async def encode(
+        self,
+        source_path: str,
+        dest_path: str,
+        options: EncodeOptions,
+        memory_bytes: int = 0,
+    ) -> EncodeResult:
+        """Encode from the event loop without blocking it."""
+        return await asyncio.wrap_future(self.submit(source_path, dest_path, options, memory_bytes))
+
+    def _encode(self, source_path: str, dest_path: str, options: EncodeOptions, memory_bytes: int) -> EncodeResult:
+        if self.memory is None or memory_bytes <= 0 or options.keeps_source:
+            return encode_image(source_path, dest_path, options)
+        reservation = self.memory.acquire(memory_bytes)
+        try:
+            return encode_image(source_path, dest_path, options)
+        finally:
+            self.memory.release(reservation)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,400 @@
+"""
+Inference Executor
+Runs blocking upscale calls on dedicated worker threads so the event loop stays
+responsive, with a bounded wait queue that rejects work instead of piling it up.
+Queued jobs are scheduled shortest-first by predicted run time, with aging so
+large jobs still run, a per-client cap on running jobs, a priority lane, and
+a host memory budget they must fit in.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.locks import FileLock, HostBudget, HostSemaphore
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the executor has no free slot and its wait queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Upscale queue is full, try again later")
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Ticket:
+    """Scheduling facts about a job, known before it runs."""
+
+    # Predicted run time in seconds
+    cost: float = 0.0
+    # Who submitted it (API key or address); "" is exempt from the per-client cap
+    client: str = ""
+    # Priority-lane jobs run before every other eligible job
+    priority: bool = False
+    # Predicted peak RAM in bytes, reserved from the memory budget while it runs
+    memory: int = 0
+
+
+@dataclass(eq=False)
+class _Entry:
+    future: Future
+    fn: Callable
+    args: tuple
+    kwargs: dict
+    ticket: Ticket
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: Optional[float] = None
+    # When the job was first passed over because its memory did not fit
+    blocked_since: Optional[float] = None
+    reservation: Optional[FileLock] = None
+
+
+class InferenceExecutor:
+    """
+    Fixed-size pool of worker threads with a bounded wait queue.
+
+    Jobs beyond ``max_concurrent`` wait in the queue; once ``max_queued`` jobs
+    are waiting, ``submit`` raises ``QueueFullError`` straight away so the API
+    can answer with a fast 503 instead of holding the connection open. Jobs
+    held back by their client's cap count as waiting even while a worker is
+    idle, and one client may have at most ``max_queued_per_client`` of them.
+
+    A free worker takes the waiting job with the lowest cost, less ``aging``
+    for every second it has waited, so a large upload cannot hold up a
+    stream of thumbnails but is not starved by them either. Priority-lane
+    jobs go first. A client already running ``max_per_client`` jobs is
+    skipped until one of them finishes. With ``max_wait``, a job predicted
+    to wait longer than that for a worker is rejected like a full queue.
+
+    With a ``memory`` budget, a job starts only once its predicted peak
+    memory can be reserved; jobs that fit may go ahead of one that does
+    not, until it has been passed over for ``MEMORY_PATIENCE`` seconds.
+    After that nothing else starts until enough memory frees up for it.
+    Jobs passed over for memory count as waiting. Reservations are made
+    outside the queue lock, so callers on the event loop never wait on the
+    budget's file locks.
+
+    With a ``host_slots`` semaphore, a worker also takes one of the host's
+    slots before running a job, so several worker processes together never
+    run more jobs than the host allows. A job waiting for a host slot can
+    still be cancelled through its future.
+    """
+
+    # Seconds a job may be passed over for lack of memory before it holds
+    # back the jobs behind it
+    MEMORY_PATIENCE = 30.0
+
+    def __init__(
+        self,
+        max_concurrent: int = 1,
+        max_queued: int = 8,
+        retry_after: int = 10,
+        host_slots: Optional[HostSemaphore] = None,
+        aging: float = 0.5,
+        max_per_client: int = 0,
+        max_wait: float = 0,
+        memory: Optional[HostBudget] = None,
+        max_queued_per_client: int = 0,
+    ):
+        """
+        Initialize the executor and start its worker threads.
+
+        Args:
+            max_concurrent: Number of jobs allowed to run at the same time
+            max_queued: Number of jobs allowed to wait for a free worker
+            retry_after: Seconds reported to rejected clients
+            host_slots: Cross-process cap shared with other workers on the host
+            aging: Cost forgiven per second of waiting (0 = pure shortest-job-first)
+            max_per_client: Jobs one client may run at the same time (0 = no cap)
+            max_wait: Longest predicted wait a new job is accepted with (0 = no limit)
+            memory: Host memory budget jobs reserve their ``Ticket.memory`` from
+            max_queued_per_client: Jobs one client may have waiting (0 = no cap)
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.host_slots = host_slots
+        self.aging = aging
+        self.max_per_client = max_per_client
+        self.max_wait = max_wait
+        self.memory = memory
+        self.max_queued_per_client = max_queued_per_client
+
+        self._pending: List[_Entry] = []
+        self._running: List[_Entry] = []
+        self._cond = threading.Condition()
+        # Serializes this process's workers while they reserve memory
+        self._reserving = threading.Lock()
+        self._in_flight = 0
+        self._running_per_client: Dict[str, int] = {}
+        self._shutdown = False
+
+        self._threads: List[threading.Thread] = []
+        for index in range(max_concurrent):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f"upscale-worker-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def queued(self) -> int:
+        """Number of jobs waiting for a worker."""
+        with self._cond:
+            return len(self._pending)
+
+    @property
+    def in_flight(self) -> int:
+        """Number of jobs currently running."""
+        with self._cond:
+            return self._in_flight
+
+    @property
+    def is_full(self) -> bool:
+        """Whether a new submission would be rejected right now."""
+        return self.is_full_for("")
+
+    def is_full_for(self, client: str) -> bool:
+        """Whether a new submission from ``client`` would be rejected right now."""
+        with self._cond:
+            return self._is_full() or self._client_is_full(client)
+
+    def predicted_wait(self, ticket: Optional[Ticket] = None) -> float:
+        """
+        Seconds a job with ``ticket`` would wait for a worker if submitted now,
+        from the predicted run time of the jobs running and queued ahead of it.
+        """
+        with self._cond:
+            return self._predicted_wait(ticket or Ticket())
+
+    def submit(self, fn: Callable[..., Any], *args: Any, ticket: Optional[Ticket] = None, **kwargs: Any) -> Future:
+        """
+        Queue a blocking call for execution on a worker thread.
+
+        Args:
+            fn: Blocking call, run as ``fn(*args, **kwargs)``
+            ticket: Cost, client and lane used to schedule it (default: cost 0, no client)
+
+        Returns:
+            Future resolved with the call's result
+
+        Raises:
+            QueueFullError: If the wait queue is already full, or the job
+                would wait longer than ``max_wait``
+        """
+        future: Future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("Executor has been shut down")
+            ticket = ticket or Ticket()
+            if self._is_full() or self._client_is_full(ticket.client):
+                raise QueueFullError(self.retry_after)
+            if self.max_wait > 0:
+                wait = self._predicted_wait(ticket)
+                if wait > self.max_wait:
+                    raise QueueFullError(max(self.retry_after, math.ceil(wait - self.max_wait)))
+            entry = _Entry(future, fn, args, kwargs, ticket)
+            self._pending.append(entry)
+            self._cond.notify()
+
+        # Drop cancelled entries right away so they stop counting against the queue
+        future.add_done_callback(lambda f: self._discard(entry) if f.cancelled() else None)
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args: Any, ticket: Optional[Ticket] = None, **kwargs: Any) -> Any:
+        """Submit a blocking call and await its result from the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, ticket=ticket, **kwargs))
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work, cancel queued jobs and stop the workers."""
+        with self._cond:
+            self._shutdown = True
+            pending = list(self._pending)
+            self._pending.clear()
+            self._cond.notify_all()
+
+        for entry in pending:
+            entry.future.cancel()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+    def _is_full(self) -> bool:
+        """
+        Check capacity; caller must hold the lock.
+
+        Queued jobs an idle worker is about to take are not waiting. Jobs no
+        idle worker can take, because their client is at its cap or they were
+        passed over for lack of memory, are.
+        """
+        idle = max(0, self.max_concurrent - self._in_flight)
+        startable = sum(
+            1 for entry in self._pending
+            if not self._capped(entry) and entry.blocked_since is None
+        )
+        waiting = len(self._pending) - min(idle, startable)
+        if waiting:
+            return waiting >= self.max_queued
+        # Without a queue, a new job is rejected unless a worker is left for it
+        return self.max_queued <= 0 and idle <= startable
+
+    def _client_is_full(self, client: str) -> bool:
+        """Whether ``client`` has its most jobs waiting; caller must hold the lock."""
+        if not client or self.max_queued_per_client <= 0:
+            return False
+        waiting = sum(1 for entry in self._pending if entry.ticket.client == client)
+        return waiting >= self.max_queued_per_client
+
+    def _capped(self, entry: _Entry) -> bool:
+        """Whether the entry's client already runs its most jobs; caller must hold the lock."""
+        client = entry.ticket.client
+        return bool(client) and 0 < self.max_per_client <= self._running_per_client.get(client, 0)
+
+    def _predicted_wait(self, ticket: Ticket) -> float:
+        """Predicted wait of a new job, ignoring aging; caller must hold the lock."""
+        ahead = [
+            entry for entry in self._pending
+            if entry.ticket.priority > ticket.priority
+            or (entry.ticket.priority == ticket.priority and entry.ticket.cost <= ticket.cost)
+        ]
+        if self._in_flight + len(ahead) < self.max_concurrent:
+            return 0.0
+        now = time.monotonic()
+        remaining = sum(max(0.0, entry.ticket.cost - (now - entry.started_at)) for entry in self._running)
+        return (remaining + sum(entry.ticket.cost for entry in ahead)) / self.max_concurrent
+
+    def _candidates(self) -> List[_Entry]:
+        """Queued jobs a worker may start, best first; caller must hold the lock."""
+        now = time.monotonic()
+        eligible = [
+            ((not entry.ticket.priority, entry.ticket.cost - self.aging * (now - entry.enqueued_at), entry.enqueued_at), entry)
+            for entry in self._pending
+            if not self._capped(entry)
+        ]
+        return [entry for _, entry in sorted(eligible, key=lambda item: item[0])]
+
+    def _reserve(self, candidates: List[_Entry]) -> Tuple[Optional[_Entry], Optional[FileLock]]:
+        """
+        Reserve memory for the first of ``candidates`` that fits.
+
+        Runs without the queue lock, since reserving takes file locks shared
+        with other processes; the event loop must never wait on those.
+
+        Returns:
+            The job and its reservation, or (None, None) if none fits
+        """
+        now = time.monotonic()
+        with self._reserving:
+            for entry in candidates:
+                if entry.ticket.memory <= 0:
+                    return entry, None
+                reservation = self.memory.try_acquire(entry.ticket.memory)
+                if reservation is not None:
+                    return entry, reservation
+                with self._cond:
+                    if entry.blocked_since is None:
+                        entry.blocked_since = now
+                    stale = now - entry.blocked_since > self.MEMORY_PATIENCE
+                if stale:
+                    # Let memory drain for this one instead of starving it
+                    break
+        return None, None
+
+    def _claim(self) -> Optional[_Entry]:
+        """
+        Wait for the next job, reserve its memory and take it off the queue.
+
+        Returns:
+            The job, now counted as running, or None once shut down
+        """
+        while True:
+            with self._cond:
+                candidates = self._candidates()
+                while not candidates:
+                    if self._shutdown:
+                        return None
+                    # Nothing queued, or only jobs of clients at their cap
+                    self._cond.wait()
+                    candidates = self._candidates()
+                if self._shutdown:
+                    return None
+                if self.memory is None:
+                    return self._start(candidates[0], None)
+
+            entry, reservation = self._reserve(candidates)
+
+            with self._cond:
+                # The job may have been cancelled, taken or capped meanwhile
+                if entry is not None and entry in self._pending and not self._capped(entry) and not self._shutdown:
+                    return self._start(entry, reservation)
+                if entry is None and not self._shutdown:
+                    # Only jobs that do not fit, until memory is freed here or
+                    # by another process
+                    self._cond.wait(self.memory.poll_interval)
+            if reservation is not None:
+                self.memory.release(reservation)
+
+    def _start(self, entry: _Entry, reservation: Optional[FileLock]) -> _Entry:
+        """Move a job from the queue to the running set; caller must hold the lock."""
+        self._pending.remove(entry)
+        client = entry.ticket.client
+        entry.reservation = reservation
+        entry.started_at = time.monotonic()
+        self._running.append(entry)
+        self._in_flight += 1
+        self._running_per_client[client] = self._running_per_client.get(client, 0) + 1
+        return entry
+
+    def _discard(self, entry: _Entry) -> None:
+        """Remove a cancelled entry from the wait queue."""
+        with self._cond:
+            try:
+                self._pending.remove(entry)
+            except ValueError:
+                pass
+
+    def _worker(self) -> None:
+        """Worker loop: take the next queued job and run it."""
+        while True:
+            entry = self._claim()
+            if entry is None:
+                return
+            future, fn, args, kwargs = entry.future, entry.fn, entry.args, entry.kwargs
+            client = entry.ticket.client
+
+            slot = None
+            try:
+                if self.host_slots is not None:
+                    slot = self.host_slots.acquire(abort=lambda: future.cancelled() or self._shutdown)
+                    if slot is None:
+                        future.cancel()
+                        continue
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            finally:
+                if slot is not None:
+                    self.host_slots.release(slot)
+                if entry.reservation is not None:
+                    self.memory.release(entry.reservation)
+                with self._cond:
+                    self._in_flight -= 1
+                    self._running.remove(entry)
+                    self._running_per_client[client] -= 1
+                    if not self._running_per_client[client]:
+                        del self._running_per_client[client]
+                    # A job held back by its client's cap may be eligible now
+                    self._cond.notify_all()
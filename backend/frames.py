@@ -0,0 +1,421 @@
+"""
+Animation and Video Frames
+Upscales animated GIF/WebP images and short video clips frame by frame.
+Frames are decoded as a stream, identical or near-identical frames are
+upscaled once, unique frames go through the engine in directory batches,
+and the output is reassembled with the original timing.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import GifImagePlugin, Image, ImageSequence, UnidentifiedImageError
+
+from backend.upscaler import BaseUpscaler, CancelToken, _resize_file, _resize_to
+
+
+ANIMATION_FORMATS = {"GIF": "gif", "WEBP": "webp"}
+VIDEO_EXTENSIONS = {".mp4", ".m4v", ".mov", ".webm", ".mkv", ".avi"}
+
+# Side of the grayscale thumbnails compared to find near-identical frames
+THUMBNAIL_SIZE = 64
+
+
+@dataclass
+class ClipInfo:
+    """What was learned about an animation or video without decoding it all."""
+
+    kind: str  # "animation" or "video"
+    format: str  # "gif", "webp" or "mp4" (the output container)
+    width: int
+    height: int
+    frame_count: int
+    fps: float = 0.0
+    loop: int = 0
+    has_alpha: bool = False
+
+    @property
+    def megapixels(self) -> float:
+        """Pixels across every frame, in megapixels."""
+        return self.width * self.height * self.frame_count / 1_000_000
+
+
+@dataclass
+class ClipResult:
+    """Outcome of upscaling a clip."""
+
+    output_path: str
+    frames: int
+    upscaled_frames: int
+
+
+def probe_clip(path: str) -> ClipInfo:
+    """
+    Read the size, frame count and timing of an animation or video.
+
+    Raises:
+        ValueError: If the file is neither an animated image nor a readable video
+    """
+    try:
+        with Image.open(path) as image:
+            image_format = ANIMATION_FORMATS.get(image.format or "")
+            frame_count = getattr(image, "n_frames", 1)
+            if image_format is None or frame_count < 2:
+                raise ValueError("Image is not animated; upscale it with POST /upscale")
+            return ClipInfo(
+                kind="animation",
+                format=image_format,
+                width=image.width,
+                height=image.height,
+                frame_count=frame_count,
+                loop=image.info.get("loop", 0),
+                has_alpha=image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info,
+            )
+    except (UnidentifiedImageError, OSError):
+        pass
+
+    if Path(path).suffix.lower() not in VIDEO_EXTENSIONS:
+        raise ValueError(f"Not an animation or video. Supported videos: {sorted(VIDEO_EXTENSIONS)}")
+    capture = cv2.VideoCapture(str(path))
+    try:
+        if not capture.isOpened():
+            raise ValueError("Video could not be decoded")
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+    finally:
+        capture.release()
+    if width <= 0 or height <= 0 or frame_count <= 0:
+        raise ValueError("Video has no frames")
+    return ClipInfo(kind="video", format="mp4", width=width, height=height, frame_count=frame_count, fps=fps)
+
+
+def iter_frames(path: str, info: ClipInfo) -> Iterator[Tuple[np.ndarray, float]]:
+    """
+    Decode frames one at a time as (BGR or BGRA array, duration in ms).
+
+    Only the current frame is held in memory, whatever the clip length.
+    """
+    if info.kind == "video":
+        capture = cv2.VideoCapture(str(path))
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield frame, 1000.0 / info.fps
+        finally:
+            capture.release()
+
+    mode, conversion = ("RGBA", cv2.COLOR_RGBA2BGRA) if info.has_alpha else ("RGB", cv2.COLOR_RGB2BGR)
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            # Decode first: WebP only reports a frame's duration once it is loaded
+            pixels = np.asarray(frame.convert(mode))
+            duration = frame.info.get("duration") or 100
+            yield cv2.cvtColor(pixels, conversion), float(duration)
+
+
+class FrameDeduplicator:
+    """
+    Assigns each frame a key; frames that share a key are upscaled once.
+
+    Identical frames anywhere in the clip share a content hash. A frame
+    whose downscaled thumbnail differs from the previous frame's by at most
+    ``threshold`` levels in every cell reuses the previous key as well, so
+    re-encoded or dithered still sections are not upscaled again. Comparing
+    the largest cell difference (not the mean) keeps small moving details,
+    like a blinking cursor, from being dropped.
+    """
+
+    def __init__(self, threshold: float = 2.0):
+        """
+        Args:
+            threshold: Largest per-cell difference (0-255) treated as the same
+                frame; 0 only merges exact duplicates
+        """
+        self.threshold = threshold
+        self._previous: Optional[Tuple[str, np.ndarray]] = None
+
+    def key_for(self, frame: np.ndarray) -> str:
+        thumbnail = cv2.resize(
+            cv2.cvtColor(frame, cv2.COLOR_BGRA2GRAY if frame.shape[2] == 4 else cv2.COLOR_BGR2GRAY),
+            (THUMBNAIL_SIZE, THUMBNAIL_SIZE),
+            interpolation=cv2.INTER_AREA,
+        ).astype(np.float32)
+
+        if self._previous is not None and self.threshold > 0:
+            previous_key, previous_thumbnail = self._previous
+            if np.abs(thumbnail - previous_thumbnail).max() <= self.threshold:
+                return previous_key
+
+        digest = hashlib.blake2b(frame.tobytes(), digest_size=16)
+        digest.update(str(frame.shape).encode())
+        key = digest.hexdigest()
+        self._previous = (key, thumbnail)
+        return key
+
+
+def _gif_frame(frame: Image.Image) -> Tuple[Image.Image, dict]:
+    """A frame reduced to its own 256-colour palette, and its transparency index if any."""
+    if frame.mode != "RGBA":
+        return frame.convert("RGB").convert("P", palette=Image.Palette.ADAPTIVE), {}
+    paletted = frame.convert("P", palette=Image.Palette.ADAPTIVE)
+    for color, index in paletted.palette.colors.items():
+        if color[3] == 0:
+            return paletted, {"transparency": index}
+    return paletted, {}
+
+
+class _AnimationWriter:
+    """
+    Collects upscaled frame files and writes the GIF/WebP when closed.
+
+    Frames are read back one at a time. WebP frames go straight into
+    libwebp's encoder, while Pillow's GIF writer would copy every frame
+    before writing any, so GIFs are written frame by frame here, each with
+    its own palette.
+    """
+
+    def __init__(self, output_path: str, info: ClipInfo):
+        self.output_path = output_path
+        self.info = info
+        self.frames: List[List] = []  # [frame path, duration ms]
+
+    def write(self, frame_path: Path, duration: float) -> None:
+        # Repeated frames become one longer frame, which is both smaller and identical on screen
+        if self.frames and self.frames[-1][0] == frame_path:
+            self.frames[-1][1] += duration
+        else:
+            self.frames.append([frame_path, duration])
+
+    def release(self, frame_path: Path) -> None:
+        """Frames stay on disk until the animation is assembled."""
+
+    def close(self) -> None:
+        if self.info.format == "gif":
+            self._write_gif()
+            return
+
+        def rest() -> Iterator[Image.Image]:
+            for frame_path, _ in self.frames[1:]:
+                with Image.open(frame_path) as frame:
+                    frame.load()
+                    yield frame
+
+        with Image.open(self.frames[0][0]) as first:
+            first.save(
+                self.output_path,
+                format="WEBP",
+                save_all=True,
+                append_images=rest(),
+                duration=[round(duration) for _, duration in self.frames],
+                loop=self.info.loop,
+                quality=90,
+            )
+
+    def _write_gif(self) -> None:
+        with open(self.output_path, "wb") as f:
+            for index, (frame_path, duration) in enumerate(self.frames):
+                with Image.open(frame_path) as frame:
+                    paletted, transparency = _gif_frame(frame)
+                # Also normalises the frame's palette, so run it for every frame
+                header, _ = GifImagePlugin.getheader(paletted, info={"loop": self.info.loop, **transparency})
+                if index == 0:
+                    f.writelines(header)
+                f.writelines(
+                    GifImagePlugin.getdata(
+                        paletted,
+                        include_color_table=True,
+                        duration=round(duration),
+                        disposal=2,
+                        **transparency,
+                    )
+                )
+            f.write(b";")
+
+
+class _VideoWriter:
+    """Streams upscaled frames into an MP4 at the source frame rate."""
+
+    def __init__(self, output_path: str, info: ClipInfo, size: Tuple[int, int]):
+        self.writer = cv2.VideoWriter(str(output_path), cv2.VideoWriter_fourcc(*"mp4v"), info.fps, size)
+        if not self.writer.isOpened():
+            raise RuntimeError("Could not open the video encoder")
+
+    def write(self, frame_path: Path, duration: float) -> None:
+        frame = cv2.imread(str(frame_path), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise RuntimeError(f"Upscaling failed: could not decode {frame_path}")
+        self.writer.write(frame)
+
+    def release(self, frame_path: Path) -> None:
+        frame_path.unlink()
+
+    def close(self) -> None:
+        self.writer.release()
+
+
+def upscale_clip(
+    upscaler: BaseUpscaler,
+    input_path: str,
+    output_path: str,
+    scale: float = 4,
+    model: str = "realesrgan-x4plus",
+    progress_callback: Optional[Callable[[float, str], None]] = None,
+    cancel: Optional[CancelToken] = None,
+    work_dir: Optional[str] = None,
+    batch_size: int = 16,
+    dedupe_threshold: float = 2.0,
+    recent_frames: int = 64,
+    max_frames: Optional[int] = None,
+) -> ClipResult:
+    """
+    Upscale an animated GIF/WebP or a video clip.
+
+    Frames are read one at a time. Each new unique frame is staged into a
+    batch directory, and a batch is upscaled with one engine run once it
+    holds ``batch_size`` frames; the frames waiting on it are then written
+    out in order. Only the ``recent_frames`` most recently used upscaled
+    frames are kept for reuse (all of them for animations, which are
+    assembled at the end), so memory and scratch space stay bounded for
+    long videos. Video audio is not carried over.
+
+    Args:
+        upscaler: Engine used for the frames
+        input_path: Animated image or video
+        output_path: Output file, in the container of ``probe_clip(input_path).format``
+        scale: Scale factor up to the model's largest native scale
+        model: Model name to use
+        progress_callback: Optional callback for progress updates (progress, message)
+        cancel: Optional token that stops the upscale between and during batches
+        work_dir: Directory for staged frames (default: the system temp directory)
+        batch_size: Unique frames per engine run
+        dedupe_threshold: See ``FrameDeduplicator``
+        recent_frames: Upscaled frames kept for reuse by later duplicates
+        max_frames: Fail clips with more frames than this
+
+    Returns:
+        Frame counts and the output path
+
+    Raises:
+        ValueError: If the input is not a clip, or the scale needs several passes
+    """
+    info = probe_clip(input_path)
+    plan = upscaler.plan_scale(info.width, info.height, model, scale)
+    if len(plan.passes) > 1:
+        raise ValueError(f"Animations and videos can be upscaled up to {max(upscaler.MODELS[model]['scales'])}x")
+    if max_frames and info.frame_count > max_frames:
+        raise ValueError(f"Clip has {info.frame_count} frames, the limit is {max_frames}")
+
+    if cancel:
+        cancel.start()
+
+    staging_dir = Path(tempfile.mkdtemp(prefix="frames_", dir=work_dir))
+    in_dir, out_dir, store_dir = staging_dir / "in", staging_dir / "out", staging_dir / "frames"
+    for directory in (in_dir, out_dir, store_dir):
+        directory.mkdir()
+
+    if info.kind == "video":
+        writer = _VideoWriter(output_path, info, plan.output_size)
+        keep = recent_frames
+    else:
+        writer = _AnimationWriter(output_path, info)
+        keep = None
+
+    deduplicator = FrameDeduplicator(dedupe_threshold)
+    upscaled: "OrderedDict[str, Path]" = OrderedDict()  # key -> upscaled frame file
+    batch: Dict[str, str] = {}  # key -> staged frame name
+    pending: List[Tuple[str, float]] = []  # frames waiting for the current batch, in order
+    counts = {"frames": 0, "upscaled": 0}
+
+    def report(message: str, batch_progress: float = 0.0) -> None:
+        if progress_callback:
+            done = counts["frames"] - len(pending) + batch_progress * len(pending)
+            progress_callback(min(0.99, done / max(info.frame_count, counts["frames"])), message)
+
+    def flush() -> None:
+        if batch:
+            def on_batch_progress(progress: float, message: str) -> None:
+                report(f"Upscaling frames ({counts['frames']}/{info.frame_count} read)...", progress)
+
+            upscaler._run_upscale(
+                str(in_dir), str(out_dir), plan.models[0], plan.passes[0], "png", on_batch_progress, cancel
+            )
+            for key, name in batch.items():
+                produced = out_dir / f"{name}.png"
+                if not produced.exists():
+                    raise RuntimeError(f"Upscaling failed: no output for frame {name}")
+                stored = store_dir / f"{name}.png"
+                if plan.resize_output:
+                    _resize_file(str(produced), str(stored), plan.output_size)
+                    produced.unlink()
+                else:
+                    os.replace(produced, stored)
+                (in_dir / f"{name}.png").unlink()
+                upscaled[key] = stored
+            counts["upscaled"] += len(batch)
+            batch.clear()
+
+        for key, duration in pending:
+            upscaled.move_to_end(key)
+            writer.write(upscaled[key], duration)
+        pending.clear()
+        report(f"Upscaled {counts['frames']}/{info.frame_count} frames")
+
+        while keep is not None and len(upscaled) > keep:
+            _, evicted = upscaled.popitem(last=False)
+            writer.release(evicted)
+
+    try:
+        for frame, duration in iter_frames(input_path, info):
+            if cancel:
+                cancel.check()
+            counts["frames"] += 1
+            if max_frames and counts["frames"] > max_frames:
+                raise ValueError(f"Clip has more than {max_frames} frames")
+
+            key = deduplicator.key_for(frame)
+            if key not in upscaled and key not in batch:
+                name = f"{counts['frames']:06d}"
+                cv2.imwrite(
+                    str(in_dir / f"{name}.png"),
+                    _resize_to(frame, plan.pass_size),
+                    [cv2.IMWRITE_PNG_COMPRESSION, 0],
+                )
+                batch[key] = name
+            pending.append((key, duration))
+
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+
+        if counts["frames"] == 0:
+            raise RuntimeError("Upscaling failed: no frames could be decoded")
+        writer.close()
+    except BaseException:
+        if isinstance(writer, _VideoWriter):
+            writer.close()
+        if os.path.exists(output_path):
+            os.unlink(output_path)
+        raise
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if progress_callback:
+        progress_callback(1.0, "Complete!")
+
+    return ClipResult(
+        output_path=output_path,
+        frames=counts["frames"],
+        upscaled_frames=counts["upscaled"],
+    )
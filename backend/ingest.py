@@ -0,0 +1,400 @@
+"""
+Upload Ingestion
+Parses multipart uploads straight off the request stream, writing the file to
+disk in chunks while hashing it, enforcing byte and pixel limits, and reading
+image dimensions from the header only, so oversized or malformed files are
+rejected before any decoding or inference happens.
+"""
+
+import hashlib
+import os
+from dataclasses import dataclass, field
+from typing import AsyncIterator, BinaryIO, Callable, Dict, List, Optional, Tuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image, UnidentifiedImageError
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+CHUNK_SIZE = 1024 * 1024
+
+# Bytes of an upload received before its header is probed for its
+# dimensions, so an image with too many pixels is refused mid-upload
+PROBE_BYTES = 256 * 1024
+
+# Largest text field, and most parts, accepted in an upload form
+MAX_FIELD_BYTES = 64 * 1024
+MAX_FORM_PARTS = 32
+
+# Room a request body may take beyond its files' byte limit, for multipart
+# boundaries, part headers and form fields
+FORM_OVERHEAD_BYTES = MAX_FORM_PARTS * (MAX_FIELD_BYTES + 1024)
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails validation; carries the HTTP status to return."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class IngestedUpload:
+    """An upload written to disk along with what was learned while reading it."""
+
+    path: str
+    size: int
+    sha256: str
+    width: int
+    height: int
+    mode: str
+    format: str
+
+    @property
+    def pixels(self) -> int:
+        return self.width * self.height
+
+    @property
+    def megapixels(self) -> float:
+        return self.pixels / 1_000_000
+
+
+def probe_image(path: str) -> Tuple[int, int, str, str]:
+    """
+    Read width, height, mode and format from an image header.
+
+    PIL opens images lazily, so no pixel data is decoded here.
+
+    Raises:
+        UploadRejected: If the file is not a readable image
+    """
+    try:
+        with Image.open(path) as image:
+            return image.width, image.height, image.mode, image.format or ""
+    except Image.DecompressionBombError as e:
+        raise UploadRejected(413, str(e))
+    except (UnidentifiedImageError, OSError):
+        raise UploadRejected(415, "Uploaded file is not a supported image")
+
+
+def _check_size(size: int, max_bytes: int, overhead: int = 0) -> None:
+    if size > max_bytes + overhead:
+        raise UploadRejected(413, f"Upload exceeds the {max_bytes // (1024 * 1024)} MB limit")
+
+
+def _too_many_pixels(width: int, height: int, max_pixels: int) -> UploadRejected:
+    return UploadRejected(
+        413,
+        f"Image is {width}x{height} ({width * height / 1_000_000:.1f} MP), "
+        f"the limit is {max_pixels / 1_000_000:.0f} MP",
+    )
+
+
+def _probe_stored(
+    dest_path: str,
+    size: int,
+    digest,
+    max_pixels: int,
+    probe: Callable[[str], Tuple[int, int, str, str]],
+) -> IngestedUpload:
+    """Probe a fully written upload and check its pixel count."""
+    if size == 0:
+        raise UploadRejected(400, "Uploaded file is empty")
+
+    width, height, mode, image_format = probe(dest_path)
+    if width * height > max_pixels:
+        raise _too_many_pixels(width, height, max_pixels)
+    return IngestedUpload(
+        path=dest_path,
+        size=size,
+        sha256=digest.hexdigest(),
+        width=width,
+        height=height,
+        mode=mode,
+        format=image_format,
+    )
+
+
+def check_content_length(request: Request, max_bytes: int) -> None:
+    """
+    Refuse a request whose declared body is larger than ``max_bytes`` of
+    files plus ``FORM_OVERHEAD_BYTES``, before any of it is read.
+
+    Raises:
+        UploadRejected: 413 for an oversized body, 400 for a malformed header
+    """
+    length = request.headers.get("content-length")
+    if length is None:
+        # Chunked bodies are bounded as they are read instead
+        return
+    try:
+        declared = int(length)
+    except ValueError:
+        raise UploadRejected(400, "Invalid Content-Length header")
+    _check_size(declared, max_bytes, FORM_OVERHEAD_BYTES)
+
+
+async def bounded_stream(request: Request, max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    Request body chunks, refusing a body that grows past ``max_bytes`` plus
+    ``FORM_OVERHEAD_BYTES``, for bodies sent without a Content-Length.
+
+    Raises:
+        UploadRejected: 413 once the body is over the limit
+    """
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        _check_size(received, max_bytes, FORM_OVERHEAD_BYTES)
+        yield chunk
+
+
+class UploadSink:
+    """
+    Destination of one file streamed from a request body.
+
+    Chunks are hashed and size-checked as they arrive and written to disk
+    in ``CHUNK_SIZE`` pieces off the event loop. Once ``PROBE_BYTES`` have
+    arrived the image header is probed, so an image with too many pixels is
+    refused without receiving the rest of it.
+    """
+
+    def __init__(
+        self,
+        dest_path: str,
+        max_bytes: int,
+        max_pixels: int,
+        probe: Callable[[str], Tuple[int, int, str, str]] = probe_image,
+    ):
+        """
+        Open the destination file.
+
+        Args:
+            dest_path: Where to write the upload
+            max_bytes: Largest accepted upload in bytes
+            max_pixels: Largest accepted image in pixels (width * height)
+            probe: Reads (width, height, mode, format) from the stored file,
+                raising ``UploadRejected`` for unsupported files
+        """
+        self.path = dest_path
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.probe = probe
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._buffer = bytearray()
+        self._probed = False
+        self._file = open(dest_path, "wb")
+
+    async def write(self, data: bytes) -> None:
+        """
+        Add a chunk of the upload.
+
+        Raises:
+            UploadRejected: If the upload is now over its byte limit, or its
+                header shows too many pixels
+        """
+        self.size += len(data)
+        _check_size(self.size, self.max_bytes)
+        self._digest.update(data)
+        self._buffer += data
+        probe_now = not self._probed and self.size >= PROBE_BYTES
+        if len(self._buffer) >= CHUNK_SIZE or probe_now:
+            await self._flush()
+        if probe_now:
+            self._probed = True
+            await run_in_threadpool(self._check_header)
+
+    async def finish(self) -> IngestedUpload:
+        """
+        Complete the upload and probe it.
+
+        Returns:
+            The stored upload with its hash and header dimensions
+
+        Raises:
+            UploadRejected: If the upload is empty, not supported by the
+                probe, or has too many pixels. The file is removed.
+        """
+        try:
+            await self._flush()
+            self._file.close()
+            return await run_in_threadpool(_probe_stored, self.path, self.size, self._digest, self.max_pixels, self.probe)
+        except BaseException:
+            self.discard()
+            raise
+
+    def discard(self) -> None:
+        """Close and remove whatever has been written."""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    async def _flush(self) -> None:
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            await run_in_threadpool(self._file.write, data)
+
+    def _check_header(self) -> None:
+        """Refuse an image whose header, already on disk, shows too many pixels."""
+        self._file.flush()
+        try:
+            width, height, _, _ = probe_image(self.path)
+        except UploadRejected as e:
+            if e.status_code == 413:
+                raise
+            # Not an image, or the header is not complete yet; the full probe decides
+            return
+        if width * height > self.max_pixels:
+            raise _too_many_pixels(width, height, self.max_pixels)
+
+
+@dataclass
+class UploadForm:
+    """A multipart form read by ``read_form``: its text fields and its one file."""
+
+    upload: IngestedUpload
+    filename: str
+    fields: Dict[str, str] = field(default_factory=dict)
+
+
+async def read_form(
+    request: Request,
+    open_upload: Callable[[str], UploadSink],
+    max_bytes: int,
+    file_field: str = "file",
+) -> UploadForm:
+    """
+    Parse a multipart form as its body arrives, streaming its file to disk.
+
+    Nothing is spooled: the ``file_field`` part is written to the sink that
+    ``open_upload`` returns for the client's filename, chunk by chunk as it
+    is received, and the other parts are read as text fields. Any other
+    file part is refused, as is a body over ``max_bytes`` plus
+    ``FORM_OVERHEAD_BYTES``.
+
+    Raises:
+        UploadRejected: For malformed forms, a missing or unexpected file,
+            oversized fields, and uploads that fail the sink's checks.
+            Anything written is removed.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected a multipart/form-data body")
+
+    # The parser's callbacks run synchronously inside write(); they queue
+    # events that are then handled with the awaits the file writes need
+    events: List[Tuple[str, bytes]] = []
+    header: Dict[str, bytearray] = {"name": bytearray(), "value": bytearray()}
+    part = {"disposition": b""}
+
+    def on_part_begin() -> None:
+        part["disposition"] = b""
+        events.append(("begin", b""))
+
+    def on_header_end() -> None:
+        if bytes(header["name"]).strip().lower() == b"content-disposition":
+            part["disposition"] = bytes(header["value"])
+        header["name"].clear()
+        header["value"].clear()
+
+    callbacks = {
+        "on_part_begin": on_part_begin,
+        "on_header_field": lambda data, start, end: header["name"].extend(data[start:end]),
+        "on_header_value": lambda data, start, end: header["value"].extend(data[start:end]),
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers", part["disposition"])),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", b"")),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    fields: Dict[str, str] = {}
+    sink: Optional[UploadSink] = None
+    upload: Optional[IngestedUpload] = None
+    filename = ""
+    field_name: Optional[str] = None
+    value = bytearray()
+    parts = 0
+    try:
+        async for chunk in bounded_stream(request, max_bytes):
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise UploadRejected(400, f"Malformed form data: {e}")
+            for kind, data in events:
+                if kind == "begin":
+                    parts += 1
+                    if parts > MAX_FORM_PARTS:
+                        raise UploadRejected(400, f"Form has more than {MAX_FORM_PARTS} parts")
+                elif kind == "headers":
+                    _, options = parse_options_header(data)
+                    name = options.get(b"name", b"").decode("utf-8", "replace")
+                    if b"filename" not in options:
+                        field_name, value = name, bytearray()
+                    elif name != file_field or sink is not None:
+                        raise UploadRejected(400, f"Unexpected file in form field {name!r}")
+                    else:
+                        field_name = None
+                        filename = os.path.basename(options[b"filename"].decode("utf-8", "replace"))
+                        sink = open_upload(filename)
+                elif kind == "data":
+                    if field_name is None:
+                        await sink.write(data)
+                    else:
+                        value += data
+                        if len(value) > MAX_FIELD_BYTES:
+                            raise UploadRejected(413, f"Form field {field_name!r} is too long")
+                elif field_name is None:
+                    upload = await sink.finish()
+                else:
+                    fields[field_name] = value.decode("utf-8", "replace")
+            events.clear()
+        parser.finalize()
+    except BaseException:
+        if sink is not None:
+            sink.discard()
+        raise
+
+    if upload is None:
+        if sink is not None:
+            sink.discard()
+        raise UploadRejected(400, f"Form has no complete {file_field!r} file")
+    return UploadForm(upload=upload, filename=filename, fields=fields)
+
+
+def ingest_file(
+    source: BinaryIO,
+    dest_path: str,
+    max_bytes: int,
+    max_pixels: int,
+    probe: Callable[[str], Tuple[int, int, str, str]] = probe_image,
+) -> IngestedUpload:
+    """
+    Blocking counterpart of ``UploadSink`` for a file object already at
+    hand, such as a batch upload's spooled file or a zip archive member.
+    Call it from a worker thread.
+    """
+    digest = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(dest_path, "wb") as f:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                _check_size(size, max_bytes)
+                digest.update(chunk)
+                f.write(chunk)
+
+        return _probe_stored(dest_path, size, digest, max_pixels, probe)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.unlink(dest_path)
+        raise
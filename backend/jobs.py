@@ -0,0 +1,408 @@
+"""
+Asynchronous Upscale Jobs
+Tracks submitted upscale jobs so clients can submit, poll and fetch results
+without holding a connection open, and streams progress to subscribers.
+"""
+
+import asyncio
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from concurrent.futures import Future
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from backend import metrics
+from backend.cache import ResultCache
+from backend.encoding import EncodeOptions, EncodeResult, Encoder
+from backend.executor import InferenceExecutor, Ticket
+from backend.tiles import TileStore
+from backend.upscaler import BaseUpscaler, CancelToken, UpscaleCancelled, UpscaleTimeout
+from backend.workspace import Workspace
+
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+TERMINAL_STATES = (COMPLETED, FAILED, CANCELLED)
+
+
+@dataclass
+class Job:
+    """A single upscale request and its current state."""
+
+    workdir: str
+    input_path: str
+    output_path: str
+    model: str
+    scale: float
+    encode: EncodeOptions = field(default_factory=EncodeOptions)
+    cache_key: Optional[str] = None
+    tile_size: Optional[int] = None
+    tile_overlap: int = 32
+    megapixels: float = 0.0
+    timeout: Optional[float] = None
+    target_width: Optional[int] = None
+    target_height: Optional[int] = None
+    ticket: Ticket = field(default_factory=Ticket)
+    # Predicted seconds before a worker picks the job up, as of submission
+    predicted_wait: Optional[float] = None
+    # Predicted peak RAM of encoding the result (inference's is in the ticket)
+    encode_memory: int = 0
+    # Predicted peak RAM of cutting the result into a tile pyramid
+    pyramid_memory: int = 0
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = QUEUED
+    progress: float = 0.0
+    message: str = "Queued"
+    error: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    cache_hit: bool = False
+    encoded_size: Optional[int] = None
+
+    @property
+    def format(self) -> str:
+        return self.encode.format
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def eta_seconds(self) -> Optional[float]:
+        """
+        Estimate the seconds until the job finishes.
+
+        Queued jobs add their predicted wait to the predicted run time
+        (``ticket.cost``). Running jobs blend the prediction with the progress
+        rate so far, trusting the rate more as progress grows.
+        """
+        predicted = self.ticket.cost or None
+        now = time.time()
+        if self.status == QUEUED:
+            if predicted is None or self.predicted_wait is None:
+                return None
+            return max(0.0, self.predicted_wait - (now - self.created_at)) + predicted
+        if self.status != RUNNING or self.started_at is None:
+            return None
+
+        elapsed = now - self.started_at
+        from_model = max(0.0, predicted - elapsed) if predicted is not None else None
+        if self.progress <= 0:
+            return from_model
+        from_rate = elapsed * (1.0 - self.progress) / self.progress
+        if from_model is None:
+            return max(0.0, from_rate)
+        return max(0.0, (1.0 - self.progress) * from_model + self.progress * from_rate)
+
+    def to_dict(self) -> dict:
+        """Public view of the job for API responses."""
+        return {
+            "id": self.id,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "message": self.message,
+            "error": self.error,
+            "model": self.model,
+            "scale": round(self.scale, 4),
+            "target_width": self.target_width,
+            "target_height": self.target_height,
+            "format": self.format,
+            "encoded_size": self.encoded_size,
+            "cache_hit": self.cache_hit,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "eta_seconds": self.eta_seconds(),
+        }
+
+
+class JobManager:
+    """
+    Registry of upscale jobs backed by an ``InferenceExecutor``.
+
+    Progress reported by the upscaler is recorded on the job and pushed to
+    every subscribed event loop queue, so HTTP handlers can stream it.
+    """
+
+    def __init__(
+        self,
+        upscaler: BaseUpscaler,
+        executor: InferenceExecutor,
+        encoder: Encoder,
+        workspace: Workspace,
+        result_ttl: float = 3600,
+        cache: Optional[ResultCache] = None,
+        tiles: Optional[TileStore] = None,
+    ):
+        """
+        Initialize the job manager.
+
+        Args:
+            upscaler: Upscaler used to run jobs
+            executor: Executor that bounds concurrency and queue depth
+            encoder: Pool that encodes outputs once inference finishes
+            workspace: Owner of each job's scratch directory
+            result_ttl: Seconds finished jobs (and their result files) are kept
+            cache: Optional result cache consulted before and filled after each run
+            tiles: Optional store of result pyramids, forgotten as their jobs expire
+        """
+        self.upscaler = upscaler
+        self.executor = executor
+        self.encoder = encoder
+        self.workspace = workspace
+        self.result_ttl = result_ttl
+        self.cache = cache
+        self.tiles = tiles
+
+        self._jobs: Dict[str, Job] = {}
+        # Executor future and cancel token of every job that has not finished
+        self._controls: Dict[str, Tuple[Future, CancelToken]] = {}
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job: Job) -> Job:
+        """
+        Register a job and queue it for execution.
+
+        Jobs whose ``cache_key`` is already cached complete immediately
+        without touching the executor.
+
+        Raises:
+            QueueFullError: If the executor cannot accept more work
+        """
+        self._prune()
+
+        # Linked into the job's directory, so the result outlives an eviction
+        cached_path = self.cache.get(job.cache_key, job.workdir) if self.cache and job.cache_key else None
+        if cached_path is not None:
+            now = time.time()
+            job.output_path = cached_path
+            job.cache_hit = True
+            job.encoded_size = os.path.getsize(cached_path)
+            job.status = COMPLETED
+            job.progress = 1.0
+            job.message = "Complete! (cached)"
+            job.started_at = job.finished_at = now
+            metrics.UPSCALES.labels(job.model, "cached").inc()
+            # Keep the linked result; the upload is no longer needed
+            if os.path.exists(job.input_path):
+                os.unlink(job.input_path)
+            self.workspace.release(Path(job.workdir))
+            with self._lock:
+                self._jobs[job.id] = job
+            return job
+
+        token = CancelToken(job.timeout)
+        with self._lock:
+            self._jobs[job.id] = job
+            job.predicted_wait = self.executor.predicted_wait(job.ticket)
+            try:
+                future = self.executor.submit(self._run, job, token, ticket=job.ticket)
+            except Exception:
+                del self._jobs[job.id]
+                raise
+            self._controls[job.id] = (future, token)
+        return job
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Cancel a job that has not finished yet.
+
+        A queued job is dropped from the executor queue right away; a running
+        job has its engine process killed and frees its slot as soon as the
+        process exits.
+
+        Returns:
+            The job, or None if it is unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            control = self._controls.get(job_id)
+        if job is None or control is None:
+            return job
+
+        future, token = control
+        token.cancel("Cancelled by client")
+        if future.cancel():
+            # Never started, so _run will not clean up after it
+            self._cancelled(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by id."""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[dict]:
+        """
+        Yield job snapshots as they change, ending once the job finishes.
+
+        The current state is always yielded first.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        entry = (loop, queue)
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(entry)
+
+        try:
+            snapshot = job.to_dict()
+            yield snapshot
+            while snapshot["status"] not in TERMINAL_STATES:
+                snapshot = await queue.get()
+                yield snapshot
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(job_id, [])
+                if entry in subscribers:
+                    subscribers.remove(entry)
+                if not subscribers:
+                    self._subscribers.pop(job_id, None)
+
+    def _update(self, job: Job, **changes) -> None:
+        """Apply changes to a job and notify subscribers."""
+        with self._lock:
+            for key, value in changes.items():
+                setattr(job, key, value)
+            snapshot = job.to_dict()
+            subscribers = list(self._subscribers.get(job.id, []))
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+            except RuntimeError:
+                # Subscriber's loop has already closed
+                pass
+
+    def _run(self, job: Job, token: CancelToken) -> None:
+        """
+        Run inference for a job on an executor worker thread.
+
+        Encoding is handed to the encoder pool, so the inference slot is
+        released as soon as the upscaled pixels exist.
+        """
+        self._update(job, status=RUNNING, started_at=time.time(), message="Starting...")
+        metrics.observe_stage("queue", job.model, job.started_at - job.created_at)
+
+        def on_progress(progress: float, message: str) -> None:
+            # Inference covers the first 90%, encoding the rest
+            progress = max(job.progress, min(progress, 1.0) * 0.9)
+            self._update(job, progress=progress, message=message)
+
+        raw_path = f"{job.output_path}.raw.png"
+        try:
+            with metrics.time_stage("inference", job.model):
+                self.upscaler.upscale(
+                    input_path=job.input_path,
+                    output_path=raw_path,
+                    scale=job.scale,
+                    model=job.model,
+                    progress_callback=on_progress,
+                    tile_size=job.tile_size,
+                    tile_overlap=job.tile_overlap,
+                    cancel=token,
+                    target_width=job.target_width,
+                    target_height=job.target_height,
+                )
+        except UpscaleTimeout as e:
+            metrics.UPSCALES.labels(job.model, "timed_out").inc()
+            self._fail(job, str(e))
+            return
+        except UpscaleCancelled:
+            self._cancelled(job)
+            return
+        except Exception as e:
+            metrics.UPSCALES.labels(job.model, "failed").inc()
+            self._fail(job, str(e))
+            return
+        finally:
+            # The input is not needed once inference has run
+            if os.path.exists(job.input_path):
+                os.unlink(job.input_path)
+
+        metrics.observe_size(job.model, job.megapixels, job.scale)
+        self._update(job, progress=0.9, message=f"Encoding {job.format.upper()}...")
+        future = self.encoder.submit(raw_path, job.output_path, job.encode, job.encode_memory)
+        future.add_done_callback(lambda f: self._finish(job, token, raw_path, f))
+
+    def _finish(self, job: Job, token: CancelToken, raw_path: str, future: Future) -> None:
+        """Record the outcome of a job's encode step."""
+        if os.path.exists(raw_path):
+            os.unlink(raw_path)
+
+        if token.cancelled:
+            # Cancelled while encoding; nobody wants the result
+            self._cancelled(job)
+            return
+
+        try:
+            result: EncodeResult = future.result()
+        except Exception as e:
+            metrics.UPSCALES.labels(job.model, "failed").inc()
+            self._fail(job, str(e))
+            return
+
+        metrics.observe_stage("encode", job.model, result.seconds)
+        metrics.UPSCALES.labels(job.model, "completed").inc()
+        if self.cache and job.cache_key:
+            # The cache keeps its own link, so evicting it leaves the job's result
+            self.cache.put(job.cache_key, job.output_path)
+        self.workspace.release(Path(job.workdir))
+        with self._lock:
+            self._controls.pop(job.id, None)
+        self._update(
+            job,
+            status=COMPLETED,
+            progress=1.0,
+            message="Complete!",
+            encoded_size=result.size,
+            finished_at=time.time(),
+        )
+
+    def _fail(self, job: Job, error: str) -> None:
+        """Mark a job failed and delete its scratch directory."""
+        with self._lock:
+            self._controls.pop(job.id, None)
+        self.workspace.remove(Path(job.workdir))
+        self._update(job, status=FAILED, error=error, message="Failed", finished_at=time.time())
+
+    def _cancelled(self, job: Job) -> None:
+        """Mark a job cancelled and delete its scratch directory."""
+        with self._lock:
+            self._controls.pop(job.id, None)
+        metrics.UPSCALES.labels(job.model, "cancelled").inc()
+        self.workspace.remove(Path(job.workdir))
+        self._update(job, status=CANCELLED, message="Cancelled", finished_at=time.time())
+
+    def _prune(self) -> None:
+        """
+        Forget finished jobs older than the result TTL and delete their
+        scratch directories, and the pyramids no remaining job shares.
+        """
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.is_finished and job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job in expired:
+                del self._jobs[job.id]
+            # Jobs with the same cache key share one pyramid
+            live_keys = {job.cache_key or job.id for job in self._jobs.values()}
+
+        for job in expired:
+            self.workspace.remove(Path(job.workdir))
+            if self.tiles is not None and (job.cache_key or job.id) not in live_keys:
+                self.tiles.forget(job.cache_key or job.id)
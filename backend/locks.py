@@ -0,0 +1,265 @@
+"""
+Cross-Process Locks
+File locks that coordinate the uvicorn worker processes (and any other
+process) sharing a host: an exclusive lock, a counting semaphore built
+from a directory of lock files, and a budget of some quantity (RAM) that
+processes reserve parts of. Locks are advisory ``flock``/``msvcrt``
+locks, so the OS releases them when their process dies and a crashed
+worker can never leave a slot taken.
+"""
+
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _try_lock(fd: int) -> bool:
+    """Take an exclusive lock on an open file without waiting."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class FileLock:
+    """
+    Exclusive lock on a file, held by one process at a time.
+
+    Not reentrant, and not meant to be shared between threads of one
+    process; use a ``threading.Lock`` in front of it for that.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 0.1):
+        """
+        Initialize the lock (the lock file is created on first acquire).
+
+        Args:
+            path: Lock file; its parent directory is created if needed
+            poll_interval: Seconds between attempts while waiting
+        """
+        self.path = Path(path)
+        self.poll_interval = poll_interval
+        self._fd: Optional[int] = None
+
+    @property
+    def locked(self) -> bool:
+        """Whether this object holds the lock."""
+        return self._fd is not None
+
+    def acquire(
+        self,
+        blocking: bool = True,
+        timeout: Optional[float] = None,
+        abort: Optional[Callable[[], bool]] = None,
+    ) -> bool:
+        """
+        Take the lock.
+
+        Args:
+            blocking: Wait for the lock instead of failing straight away
+            timeout: Give up after this many seconds (None waits forever)
+            abort: Checked while waiting; returning True gives up
+
+        Returns:
+            Whether the lock was taken
+        """
+        if self._fd is not None:
+            raise RuntimeError(f"{self.path} is already locked by this object")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not _try_lock(fd):
+            gave_up = (
+                not blocking
+                or (deadline is not None and time.monotonic() >= deadline)
+                or (abort is not None and abort())
+            )
+            if gave_up:
+                os.close(fd)
+                return False
+            time.sleep(self.poll_interval)
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        """Give the lock up. The lock file stays, so waiters never race on a new inode."""
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class HostSemaphore:
+    """
+    Counting semaphore shared by every process that uses the same directory.
+
+    Each of the ``slots`` permits is a lock file; taking a permit means
+    locking any free one. Point every worker on a host at the same local
+    directory to cap the host's total inference load.
+    """
+
+    def __init__(self, directory: str, slots: int, poll_interval: float = 0.1):
+        """
+        Initialize the semaphore.
+
+        Args:
+            directory: Directory holding the slot files (auto-created)
+            slots: Number of permits across all processes
+            poll_interval: Seconds between attempts while waiting
+        """
+        self.directory = Path(directory)
+        self.slots = slots
+        self.poll_interval = poll_interval
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def acquire(self, abort: Optional[Callable[[], bool]] = None) -> Optional[FileLock]:
+        """
+        Wait for a free permit.
+
+        Args:
+            abort: Checked while waiting; returning True gives up
+
+        Returns:
+            The held slot, to pass to ``release``, or None if aborted
+        """
+        # Start at a different slot per process so they do not all contend for slot 0
+        start = os.getpid() % self.slots
+        while True:
+            for offset in range(self.slots):
+                slot = FileLock(self.directory / f"slot-{(start + offset) % self.slots}.lock")
+                if slot.acquire(blocking=False):
+                    return slot
+            if abort is not None and abort():
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, slot: FileLock) -> None:
+        slot.release()
+
+    def in_use(self) -> int:
+        """Permits currently held by any process (a snapshot)."""
+        busy = 0
+        for index in range(self.slots):
+            probe = FileLock(self.directory / f"slot-{index}.lock")
+            if probe.acquire(blocking=False):
+                probe.release()
+            else:
+                busy += 1
+        return busy
+
+
+class HostBudget:
+    """
+    Amount of a resource (e.g. bytes of RAM) shared by every process using
+    the same directory.
+
+    Each reservation is a lock file named after its amount, locked for as
+    long as the reservation is held, so the reservations of a process that
+    dies free themselves. Reservations are checked and taken under one
+    directory-wide lock.
+    """
+
+    PREFIX = "reserved-"
+
+    def __init__(self, directory: str, capacity: int, poll_interval: float = 0.25):
+        """
+        Initialize the budget.
+
+        Args:
+            directory: Directory holding the reservation files (auto-created)
+            capacity: Total amount across all processes
+            poll_interval: Seconds between attempts while waiting
+        """
+        self.directory = Path(directory)
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._guard = self.directory / "budget.lock"
+
+    def try_acquire(self, amount: int) -> Optional[FileLock]:
+        """
+        Reserve ``amount`` if it fits in what is left right now.
+
+        An amount larger than the whole budget is granted while nothing else
+        is reserved, so it runs alone instead of never.
+
+        Returns:
+            The held reservation, to pass to ``release``, or None if it does not fit
+        """
+        with FileLock(self._guard, self.poll_interval):
+            used = self._in_use()
+            if used and used + amount > self.capacity:
+                return None
+            reservation = FileLock(self.directory / f"{self.PREFIX}{amount}-{os.getpid()}-{uuid.uuid4().hex}")
+            reservation.acquire(blocking=False)
+            return reservation
+
+    def acquire(self, amount: int, abort: Optional[Callable[[], bool]] = None) -> Optional[FileLock]:
+        """
+        Wait until ``amount`` fits, then reserve it.
+
+        Args:
+            abort: Checked while waiting; returning True gives up
+
+        Returns:
+            The held reservation, or None if aborted
+        """
+        while True:
+            reservation = self.try_acquire(amount)
+            if reservation is not None:
+                return reservation
+            if abort is not None and abort():
+                return None
+            time.sleep(self.poll_interval)
+
+    def release(self, reservation: FileLock) -> None:
+        reservation.path.unlink(missing_ok=True)
+        reservation.release()
+
+    def in_use(self) -> int:
+        """Amount currently reserved by any process (a snapshot)."""
+        with FileLock(self._guard, self.poll_interval):
+            return self._in_use()
+
+    def _in_use(self) -> int:
+        """Sum of live reservations, removing dead ones; caller holds the guard."""
+        used = 0
+        for path in self.directory.glob(f"{self.PREFIX}*"):
+            probe = FileLock(path)
+            if probe.acquire(blocking=False):
+                # Left behind by a process that exited, or being released
+                path.unlink(missing_ok=True)
+                probe.release()
+                continue
+            used += int(path.name[len(self.PREFIX):].split("-", 1)[0])
+        return used
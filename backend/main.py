@@ -1,15 +1,64 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import Depends, FastAPI, UploadFile, Form, Header, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
+from fastapi.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask, BackgroundTasks
+from starlette.datastructures import FormData
+from starlette.formparsers import MultiPartException, MultiPartParser
+import asyncio
+import hmac
+import json
+import re
 import os
 import time
-from typing import Optional
-from backend.upscaler import RealESRGANUpscaler
+import zipfile
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from backend import config, memory, metrics
+from backend.cache import ResultCache
+from backend.cluster import ClusterUpscaler, Coordinator
+from backend.costmodel import CostModel
+from backend.encoding import EncodeOptions, Encoder, check_dimensions
+from backend.executor import InferenceExecutor, QueueFullError, Ticket
+from backend.frames import probe_clip, upscale_clip
+from backend.ingest import (
+    MAX_FORM_PARTS,
+    IngestedUpload,
+    UploadForm,
+    UploadRejected,
+    UploadSink,
+    bounded_stream,
+    check_content_length,
+    ingest_file,
+    probe_image,
+    read_form,
+)
+from backend.jobs import COMPLETED, Job, JobManager
+from backend.locks import FileLock, HostBudget, HostSemaphore
+from backend.tiles import TileStore
+from backend.upscaler import CancelToken, ScalePlan, UpscaleTimeout, create_upscaler
+from backend.workspace import Workspace
 import cv2
 import numpy as np
 
-app = FastAPI(title="Image Upscaler Pro API")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Sweep leftovers from previous runs now, then periodically
+    sweeper = asyncio.create_task(workspace.run_sweeper(config.WORKSPACE_SWEEP_INTERVAL))
+    reaper = asyncio.create_task(coordinator.run_reaper()) if coordinator else None
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        if reaper:
+            reaper.cancel()
+        cost_model.save()
+        workspace.close()
+        coordinator_lock.release()
+
+
+app = FastAPI(title="Image Upscaler Pro API", lifespan=lifespan)
 
 # Enable CORS for frontend
 app.add_middleware(
@@ -20,50 +69,1162 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize Upscaler
-upscaler = RealESRGANUpscaler()
+# Every request gets its own scratch directory under temp_uploads/proc-<host>-<pid>
+workspace = Workspace(
+    config.WORKSPACE_DIR,
+    ttl=config.WORKSPACE_TTL_SECONDS,
+    max_bytes=config.WORKSPACE_MAX_BYTES,
+)
+
+# Initialize Upscaler (engine selected by UPSCALER_ENGINE). In cluster mode
+# this node only coordinates and inference runs on registered workers.
+coordinator: Optional[Coordinator] = None
+# Held by the one process on this host that may coordinate
+coordinator_lock = FileLock(os.path.join(config.HOST_LOCK_DIR, "coordinator.lock"))
+if config.ENGINE == ClusterUpscaler.ENGINE:
+    # Workers receive user images and return results, so they must authenticate
+    if not config.CLUSTER_TOKEN:
+        raise RuntimeError("UPSCALER_ENGINE=cluster needs UPSCALER_CLUSTER_TOKEN, shared with every worker")
+    # Workers, tasks and claims live in this process's memory, so a second
+    # process would hand out tasks its workers never registered with
+    if not coordinator_lock.acquire(blocking=False):
+        raise RuntimeError(
+            "UPSCALER_ENGINE=cluster runs as a single process, and another coordinator "
+            f"already holds {coordinator_lock.path}. Start it without --workers"
+        )
+    coordinator = Coordinator(
+        heartbeat_timeout=config.CLUSTER_HEARTBEAT_TIMEOUT,
+        max_attempts=config.CLUSTER_MAX_ATTEMPTS,
+    )
+    upscaler = ClusterUpscaler(coordinator, work_dir=str(workspace.create("cluster")))
+else:
+    upscaler = create_upscaler(config.ENGINE)
+
+# Run time predictions, refined by every pass the engine runs
+cost_model = CostModel(
+    config.COST_MODEL_PATH or str(upscaler.models_dir / "cost_model.json"),
+    profile=upscaler.cost_profile,
+    prior_seconds_per_megapixel=config.COST_PRIOR_SECONDS_PER_MP,
+    weights={name: info.get("cost", 1.0) for name, info in upscaler.MODELS.items()},
+)
+upscaler.pass_observer = cost_model.observe
+
+# Host RAM shared by inference and encoding in every worker process. In cluster
+# mode inference runs elsewhere, so only encoding draws on it.
+memory_budget: Optional[HostBudget] = None
+if config.MEMORY_BUDGET_BYTES > 0:
+    memory_budget = HostBudget(os.path.join(config.HOST_LOCK_DIR, "memory"), config.MEMORY_BUDGET_BYTES)
+
+# Inference runs on dedicated worker threads so the event loop stays free.
+# Every worker process on the host shares the host's slots. In cluster mode
+# there are no host slots, but MAX_CONCURRENT_JOBS still caps the passes in
+# flight, so set it to about the workers' total capacity. Short jobs are
+# scheduled ahead of long ones (see _ticket).
+executor = InferenceExecutor(
+    max_concurrent=config.MAX_CONCURRENT_JOBS,
+    max_queued=config.MAX_QUEUED_JOBS,
+    retry_after=config.RETRY_AFTER_SECONDS,
+    host_slots=None if coordinator else HostSemaphore(config.HOST_LOCK_DIR, config.HOST_MAX_CONCURRENT_JOBS),
+    aging=config.SCHED_AGING_PERCENT / 100,
+    max_per_client=config.MAX_JOBS_PER_CLIENT,
+    max_wait=config.MAX_QUEUE_WAIT_SECONDS,
+    memory=None if coordinator else memory_budget,
+    max_queued_per_client=config.MAX_QUEUED_PER_CLIENT,
+)
+
+# Finished results keyed by input hash and output parameters
+cache = ResultCache(
+    config.CACHE_DIR,
+    max_bytes=config.CACHE_MAX_BYTES,
+    ttl=config.CACHE_TTL_SECONDS,
+)
+
+# Output encoding runs on its own pool so it never holds an inference slot
+encoder = Encoder(max_workers=config.ENCODE_WORKERS, memory=memory_budget)
+
+# Deep-zoom pyramids of job results, built on first view
+tiles = TileStore(workspace, tile_size=config.PYRAMID_TILE_SIZE, memory=memory_budget)
+
+# Background jobs share the same executor as synchronous requests
+jobs = JobManager(
+    upscaler,
+    executor,
+    encoder,
+    workspace,
+    result_ttl=config.JOB_RESULT_TTL_SECONDS,
+    cache=cache,
+    tiles=tiles,
+)
+
+# Live queue, cache and engine state for GET /metrics
+metrics.register_service(upscaler, executor, cache, workspace)
+
+
+def _queue_full_error(retry_after: int) -> HTTPException:
+    """503 response telling the client when to retry."""
+    return HTTPException(
+        status_code=503,
+        detail="Upscale queue is full, try again later",
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+# Form defaults of the upload endpoints
+DEFAULT_MODEL = "realesrgan-x4plus"
+DEFAULT_SCALE = "4x"
+
+
+async def _read_upload(request: Request, dest_path_for: Callable[[str], str], probe=probe_image) -> UploadForm:
+    """
+    Read an upload form off the request stream, writing its ``file`` to
+    ``dest_path_for(filename)``, turning validation failures into HTTP errors.
+    """
+    def open_upload(filename: str) -> UploadSink:
+        return UploadSink(
+            dest_path_for(filename),
+            max_bytes=config.MAX_UPLOAD_BYTES,
+            max_pixels=config.MAX_INPUT_MEGAPIXELS * 1_000_000,
+            probe=probe,
+        )
+
+    try:
+        return await read_form(request, open_upload, config.MAX_UPLOAD_BYTES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+async def _read_batch_form(request: Request) -> FormData:
+    """
+    Form of a batch request. Its files are spooled, since zip archives are
+    read by seeking, but the body is refused once it grows past
+    ``BATCH_MAX_BYTES`` plus the form's overhead.
+    """
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data body")
+    parser = MultiPartParser(
+        request.headers,
+        bounded_stream(request, config.BATCH_MAX_BYTES),
+        max_files=config.BATCH_MAX_FILES,
+        max_fields=MAX_FORM_PARTS,
+    )
+    try:
+        return await parser.parse()
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+
+def _probe_clip_upload(path: str) -> Tuple[int, int, str, str]:
+    """Ingest probe for POST /upscale/animation: frame size of an animation or video."""
+    try:
+        info = probe_clip(path)
+    except ValueError as e:
+        raise UploadRejected(415, str(e))
+    if info.frame_count > config.MAX_CLIP_FRAMES:
+        raise UploadRejected(413, f"Clip has {info.frame_count} frames, the limit is {config.MAX_CLIP_FRAMES}")
+    return info.width, info.height, info.kind, info.format
+
+
+def _form_int(fields: Dict[str, str], name: str, default: Optional[int] = None) -> Optional[int]:
+    """Integer form field, ``default`` when it is missing or blank."""
+    value = fields.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}: {value!r}. Expected a whole number")
+
+
+def _form_bool(fields: Dict[str, str], name: str, default: bool = False) -> bool:
+    """Boolean form field such as ``true``, ``1`` or ``off``, ``default`` when it is missing or blank."""
+    value = fields.get(name, "").strip().lower()
+    if not value:
+        return default
+    if value in ("1", "true", "yes", "on"):
+        return True
+    if value in ("0", "false", "no", "off"):
+        return False
+    raise HTTPException(status_code=400, detail=f"Invalid {name}: {value!r}. Expected true or false")
+
+
+def _encode_options(fields: Dict[str, str]) -> EncodeOptions:
+    """Output encoding settings from the request form."""
+    try:
+        return EncodeOptions(
+            format=fields.get("format", "png"),
+            quality=_form_int(fields, "quality", 90),
+            png_compression=_form_int(fields, "png_compression"),
+            progressive=_form_bool(fields, "progressive"),
+            optimize=_form_bool(fields, "optimize"),
+            webp_method=_form_int(fields, "webp_method", 4),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _check_model(model: str) -> None:
+    """
+    Reject unknown models before anything is recorded for them, so client
+    input never becomes a metrics label.
+    """
+    if model not in upscaler.MODELS:
+        raise HTTPException(status_code=400, detail=f"Unknown model: {model}. Available: {list(upscaler.MODELS)}")
+
+
+# Formats the engine writes itself, for batch outputs
+BATCH_FORMATS = ("png", "jpg", "webp")
+
+
+def _batch_format(format: str) -> str:
+    """Batch output format from the request form, normalised to its file extension."""
+    fmt = format.strip().lower()
+    fmt = "jpg" if fmt == "jpeg" else fmt
+    if fmt not in BATCH_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}. Available: {list(BATCH_FORMATS)}")
+    return fmt
+
+
+def _parse_scale(scale: str) -> float:
+    """Scale factor from a form value such as ``4x``, ``2`` or ``1.5x``."""
+    try:
+        return float(scale.strip().lower().rstrip("x"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid scale: {scale!r}. Expected e.g. 2x or 1.5x")
+
+
+def _plan_for(
+    upload: IngestedUpload,
+    model: str,
+    scale: float,
+    target_width: Optional[int],
+    target_height: Optional[int],
+    output_format: str,
+) -> ScalePlan:
+    """
+    Output size and model passes for an upload, rejecting unsupported requests,
+    including outputs too large for ``output_format``.
+    """
+    try:
+        plan = upscaler.plan_scale(upload.width, upload.height, model, scale, target_width, target_height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    width, height = plan.output_size
+    if width * height > config.MAX_OUTPUT_MEGAPIXELS * 1_000_000:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Output would be {width}x{height} ({width * height / 1_000_000:.0f} MP), "
+                   f"over the {config.MAX_OUTPUT_MEGAPIXELS} MP limit",
+        )
+    try:
+        check_dimensions(output_format, width, height)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return plan
+
+
+def _cache_key(upload: IngestedUpload, model: str, plan: ScalePlan, encode: EncodeOptions) -> str:
+    """Cache key for an upload and the parameters that shape its output."""
+    width, height = plan.output_size
+    return ResultCache.make_key(upload.sha256, model=model, size=f"{width}x{height}", **encode.cache_params())
+
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+
+CLIP_MEDIA_TYPES = {"gif": "image/gif", "webp": "image/webp", "mp4": "video/mp4"}
+
+
+def _stage_batch_inputs(files: List[UploadFile], input_dir: str) -> Tuple[List[IngestedUpload], List[Tuple[int, dict]]]:
+    """
+    Ingest batch uploads into ``input_dir``, expanding zip archives.
+
+    Every image, including each zip member, goes through the same size,
+    pixel and header checks as a single upload. One that fails them is
+    reported instead of staged. An archive is refused outright when its
+    members would take the batch past ``BATCH_MAX_FILES`` images or
+    ``BATCH_MAX_BYTES`` bytes, before anything is extracted.
+
+    Returns:
+        The staged images, and the position and manifest entry of each
+        rejected one, both in upload order
+    """
+    staged: List[IngestedUpload] = []
+    rejected: List[Tuple[int, dict]] = []
+    count = 0
+    total_bytes = 0
+
+    def check_limits(files_added: int, bytes_added: int) -> None:
+        if count + files_added > config.BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Batch is limited to {config.BATCH_MAX_FILES} images")
+        if total_bytes + bytes_added > config.BATCH_MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch is limited to {config.BATCH_MAX_BYTES // (1024 * 1024)} MB of images",
+            )
+
+    def stage(source, name: str) -> None:
+        nonlocal count, total_bytes
+        # The index prefix keeps names unique and maps outputs back to inputs
+        position = count
+        dest = os.path.join(input_dir, f"{position:04d}_{name}")
+        count += 1
+        try:
+            upload = ingest_file(
+                source,
+                dest,
+                max_bytes=config.MAX_UPLOAD_BYTES,
+                max_pixels=config.MAX_INPUT_MEGAPIXELS * 1_000_000,
+            )
+        except UploadRejected as e:
+            rejected.append((position, {"input": name, "ok": False, "error": e.detail}))
+            return
+        total_bytes += upload.size
+        check_limits(0, 0)
+        staged.append(upload)
+
+    for index, upload in enumerate(files):
+        name = os.path.basename(upload.filename or f"upload_{index}")
+        if not name.lower().endswith(".zip"):
+            check_limits(1, 0)
+            stage(upload.file, name)
+            continue
+
+        with zipfile.ZipFile(upload.file) as archive:
+            members = [
+                member for member in archive.infolist()
+                if not member.is_dir()
+                and os.path.splitext(member.filename)[1].lower() in IMAGE_EXTENSIONS
+            ]
+            # Members are read no further than their declared size, so
+            # checking the declared sizes bounds what extraction writes
+            check_limits(len(members), sum(member.file_size for member in members))
+            for member in members:
+                with archive.open(member) as source:
+                    stage(source, os.path.basename(member.filename))
+    return staged, rejected
+
+
+def _unique_name(name: str, taken: Set[str]) -> str:
+    """``name``, or ``name`` with a ``_2``, ``_3``... suffix if it is taken; the result is added to ``taken``."""
+    stem, extension = os.path.splitext(name)
+    candidate = name
+    number = 1
+    while candidate in taken:
+        number += 1
+        candidate = f"{stem}_{number}{extension}"
+    taken.add(candidate)
+    return candidate
+
+
+# Absolute paths in engine and decoder messages, to keep server paths out of
+# what clients see
+_PATH_PATTERN = re.compile(r"(?<![\w.])(?:[A-Za-z]:)?[\\/](?:[^\s'\"\\/]+[\\/])*([^\s'\"\\/]+)")
+
+
+def _client_error(error: str, input_path: str, name: str) -> str:
+    """A batch item's error with its staged path replaced by the client's filename."""
+    error = error.replace(input_path, name)
+    return _PATH_PATTERN.sub(lambda match: match.group(1), error)
+
+
+def _tile_size_for(upload: IngestedUpload, plan: ScalePlan) -> Optional[int]:
+    """Tile size to use for an upload, or None when it fits in one pass."""
+    budget_bytes = memory_budget.capacity if memory_budget is not None else 0
+    return memory.tile_size_for(plan, upload.mode, upscaler.ENGINE, budget_bytes)
+
+
+def _inference_memory(upload: IngestedUpload, plan: ScalePlan, tile_size: Optional[int]) -> int:
+    """Predicted peak RAM of upscaling an upload."""
+    return memory.inference_bytes(plan, upload.mode, upscaler.ENGINE, tile_size, config.TILE_OVERLAP)
+
+
+def _timed_inference(fn, model: str, submitted_at: float, *args, **kwargs):
+    """Run ``fn`` on an executor worker, recording its queue wait and run time."""
+    metrics.observe_since("queue", model, submitted_at)
+    with metrics.time_stage("inference", model):
+        return fn(*args, model=model, **kwargs)
+
+
+def _predicted_seconds(plan: ScalePlan, repeat: float = 1) -> float:
+    """Predicted engine time for ``plan``, with every pass's input ``repeat`` times as large."""
+    return sum(
+        cost_model.predict(model, scale, megapixels * repeat)
+        for model, scale, megapixels in zip(plan.models, plan.passes, plan.pass_megapixels)
+    )
+
+
+def _client_address(request: Request) -> str:
+    """
+    Address a request came from. Behind a trusted proxy this is the last
+    X-Forwarded-For entry that is not itself a trusted proxy.
+    """
+    address = request.client.host if request.client else ""
+    if address not in config.TRUSTED_PROXIES:
+        return address
+    forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(forwarded):
+        address = hop
+        if hop not in config.TRUSTED_PROXIES:
+            break
+    return address
+
+
+def _client(request: Request) -> str:
+    """
+    Who a request counts against: its X-API-Key header if the key is a
+    configured one, and its address otherwise.
+    """
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in config.CLIENT_API_KEYS:
+        return f"key:{api_key}"
+    address = _client_address(request)
+    return f"addr:{address}" if address else ""
+
+
+def _check_request(request: Request, max_bytes: int) -> None:
+    """
+    Reject a request before any of its body is read: when there is no room
+    to run it, or when it declares a body larger than ``max_bytes`` of
+    uploads allows.
+    """
+    if executor.is_full_for(_client(request)):
+        raise _queue_full_error(executor.retry_after)
+    try:
+        check_content_length(request, max_bytes)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+def _ticket(request: Request, seconds: float, memory_bytes: int = 0) -> Ticket:
+    """
+    Scheduling ticket for a request: its cost is the predicted run time, its
+    memory the predicted peak RAM, and its client that of ``_client``.
+    """
+    api_key = request.headers.get("x-api-key")
+    return Ticket(
+        cost=seconds,
+        client=_client(request),
+        memory=memory_bytes,
+        priority=bool(api_key) and api_key in config.PRIORITY_API_KEYS,
+    )
+
+
+def _timeout_for(seconds: float) -> float:
+    """Inference time limit for a job predicted to run for ``seconds``."""
+    timeout = config.TIMEOUT_BASE_SECONDS + config.TIMEOUT_FACTOR * seconds
+    return min(config.TIMEOUT_MAX_SECONDS, timeout)
+
+
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.5
+
+
+async def _run_inference(request: Request, token: CancelToken, ticket: Ticket, fn, model: str, *args, **kwargs):
+    """
+    Run ``fn`` on the inference executor, stopping it if the client disconnects.
+    ``ticket`` places the job in the executor's queue.
+
+    On disconnect the job is dropped from the queue, or its engine process is
+    killed, and this waits for the worker to let go of the request's files
+    before raising, so the caller can delete them safely.
+
+    Raises:
+        HTTPException: 499 if the client disconnected
+    """
+    future = executor.submit(_timed_inference, fn, model, time.perf_counter(), *args, ticket=ticket, cancel=token, **kwargs)
+    waiter = asyncio.wrap_future(future)
+    try:
+        while True:
+            done, _ = await asyncio.wait({waiter}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return waiter.result()
+            if await request.is_disconnected():
+                break
+    except asyncio.CancelledError:
+        token.cancel("Request was cancelled")
+        future.cancel()
+        raise
+
+    token.cancel("Client disconnected")
+    future.cancel()
+    try:
+        await waiter
+    except (Exception, asyncio.CancelledError):
+        pass
+    metrics.UPSCALES.labels(model, "cancelled").inc()
+    raise HTTPException(status_code=499, detail="Client closed request")
+
+
+def _after_response(model: str, cleanup: Optional[BackgroundTask] = None) -> BackgroundTasks:
+    """Background tasks that time the response stream, then run ``cleanup``."""
+    tasks = [BackgroundTask(metrics.observe_since, "stream", model, time.perf_counter())]
+    if cleanup is not None:
+        tasks.append(cleanup)
+    return BackgroundTasks(tasks)
+
+
+def _get_job_or_404(job_id: str) -> Job:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
+
+def _completed_output(job: Job) -> str:
+    """Output path of a completed job whose result still exists."""
+    if job.status != COMPLETED:
+        detail = job.error if job.error else f"Job is {job.status}"
+        raise HTTPException(status_code=409, detail=detail)
+    if not os.path.exists(job.output_path):
+        raise HTTPException(status_code=410, detail="Job result has expired")
+    return job.output_path
+
+
+async def _pyramid_for(result_id: str):
+    """Tile pyramid of a job's result, built on first use."""
+    job = _get_job_or_404(result_id)
+    output_path = _completed_output(job)
+    try:
+        # Cached results share a pyramid across jobs
+        return await run_in_threadpool(tiles.get, job.cache_key or job.id, output_path, job.pyramid_memory)
+    except ValueError as e:
+        raise HTTPException(status_code=415, detail=str(e))
 
-# Ensure temp directory exists
-TEMP_DIR = os.path.abspath("temp_uploads")
-os.makedirs(TEMP_DIR, exist_ok=True)
 
 @app.get("/")
 def read_root():
-    return {"status": "online", "model": "Real-ESRGAN"}
+    return {
+        "status": "online",
+        "model": "Real-ESRGAN",
+        "engine": upscaler.ENGINE,
+        "in_flight": executor.in_flight,
+        "queued": executor.queued,
+        "cache": cache.stats(),
+        "workspace": workspace.usage(),
+        "cluster": coordinator.stats() if coordinator else None,
+        "cost_model": cost_model.snapshot(),
+    }
 
 @app.post("/upscale")
-async def upscale_image(
-    file: UploadFile = File(...),
-    scale: str = Form("4x"), # kept as str to match old interface but currently only 4x supported
-    model: str = Form("realesrgan-x4plus"),
-    format: str = Form("png")
-):
+async def upscale_image(request: Request):
+    """
+    Upscale one image by ``scale`` (e.g. ``2x``, ``1.5x``) or to a target
+    width and/or height, keeping the aspect ratio.
+
+    Form fields: ``file``, ``scale``, ``model``, ``target_width``,
+    ``target_height`` and the encoding settings of ``_encode_options``.
+    """
+    _check_request(request, config.MAX_UPLOAD_BYTES)
+
+    scratch = workspace.create("upscale")
+    cleanup = BackgroundTask(workspace.remove, scratch)
+
+    # The form is validated before the model is used as a metrics label
     try:
-        # Save uploaded file
-        input_path = os.path.join(TEMP_DIR, f"input_{int(time.time())}_{file.filename}")
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        started = time.perf_counter()
+        form = await _read_upload(request, lambda name: str(scratch / f"input_{name or 'upload'}"))
+        model = form.fields.get("model", DEFAULT_MODEL)
+        _check_model(model)
+        metrics.observe_since("upload", model, started)
+        scale_factor = _parse_scale(form.fields.get("scale", DEFAULT_SCALE))
+        target_width = _form_int(form.fields, "target_width")
+        target_height = _form_int(form.fields, "target_height")
+        encode = _encode_options(form.fields)
+    except Exception:
+        await cleanup()
+        raise
+    upload = form.upload
+    input_path = upload.path
+
+    try:
+        plan = _plan_for(upload, model, scale_factor, target_width, target_height, encode.format)
+        output_size = f"{plan.output_size[0]}x{plan.output_size[1]}"
+
+        # Serve repeated submissions straight from the cache
+        cache_key = _cache_key(upload, model, plan, encode)
+        # Linked into the scratch directory, so an eviction cannot pull it mid-response
+        cached_path = await run_in_threadpool(cache.get, cache_key, str(scratch))
+        if cached_path is not None:
+            metrics.UPSCALES.labels(model, "cached").inc()
+            return FileResponse(
+                cached_path,
+                media_type=encode.media_type,
+                filename=f"upscaled_{cache_key[:12]}.{encode.extension}",
+                headers={"X-Cache": "HIT", "X-Encoded-Size": str(os.path.getsize(cached_path)), "X-Output-Size": output_size},
+                background=_after_response(model, cleanup),
+            )
             
         # Prepare output path
-        output_filename = f"upscaled_{int(time.time())}.{format}"
-        output_path = os.path.join(TEMP_DIR, output_filename)
+        output_filename = f"upscaled_{cache_key[:12]}.{encode.extension}"
+        output_path = str(scratch / output_filename)
+        raw_path = f"{output_path}.raw.png"
         
         # Run Upscaling
-        # upscaler.upscale takes (input_path, output_path, scale, model, callback)
-        result_path = upscaler.upscale(
-            input_path=input_path,
-            output_path=output_path,
-            scale=4, # Hardcoded 4x as per standard
-            model=model
-        )
+        try:
+            predicted = _predicted_seconds(plan)
+            tile_size = _tile_size_for(upload, plan)
+            result_path = await _run_inference(
+                request,
+                CancelToken(_timeout_for(predicted)),
+                _ticket(request, predicted, _inference_memory(upload, plan, tile_size)),
+                upscaler.upscale,
+                model,
+                input_path=input_path,
+                output_path=raw_path,
+                scale=scale_factor,
+                tile_size=tile_size,
+                tile_overlap=config.TILE_OVERLAP,
+                target_width=target_width,
+                target_height=target_height,
+            )
+        finally:
+            # The input is not needed once inference has run
+            os.unlink(input_path)
         
-        if result_path and os.path.exists(result_path):
-            return FileResponse(result_path, media_type=f"image/{format}", filename=os.path.basename(result_path))
-        else:
-            raise HTTPException(status_code=500, detail="Upscaling returned no output")
+        if not (result_path and os.path.exists(result_path)):
+            raise RuntimeError("Upscaling returned no output")
+        metrics.observe_size(model, upload.megapixels, plan.scale)
+
+        # Encode off the inference executor, then drop the lossless intermediate
+        try:
+            encoded = await encoder.encode(
+                result_path, output_path, encode, memory.encode_bytes(plan.output_size, upload.mode, encode.format)
+            )
+        finally:
+            # Already gone when the lossless output was delivered as it is
+            if os.path.exists(result_path):
+                os.unlink(result_path)
+        metrics.observe_stage("encode", model, encoded.seconds)
+        metrics.UPSCALES.labels(model, "completed").inc()
+
+        # Served from the scratch directory, which goes once the response has
+        # been streamed; the cache keeps its own link
+        await run_in_threadpool(cache.put, cache_key, encoded.path)
+        return FileResponse(
+            encoded.path,
+            media_type=encoded.media_type,
+            filename=output_filename,
+            headers={"X-Cache": "MISS", "X-Encoded-Size": str(encoded.size), "X-Output-Size": output_size},
+            background=_after_response(model, cleanup),
+        )
 
+    except QueueFullError as e:
+        await cleanup()
+        raise _queue_full_error(e.retry_after)
+    except HTTPException:
+        await cleanup()
+        raise
+    except UpscaleTimeout as e:
+        await cleanup()
+        metrics.UPSCALES.labels(model, "timed_out").inc()
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
+        await cleanup()
+        metrics.UPSCALES.labels(model, "failed").inc()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        # Cleanup input? Maybe keep for debugging for now or clean up later.
-        pass
+
+
+@app.post("/upscale/batch")
+async def upscale_batch(request: Request):
+    """
+    Upscale several images (or a zip of images) with one binary run per model.
+
+    Every image gets the same ``scale`` or target size. Returns a zip
+    holding every successful output plus ``manifest.json`` describing the
+    result of each input file.
+
+    Form fields: ``files`` (repeated), ``scale``, ``model``, ``format``,
+    ``target_width`` and ``target_height``.
+    """
+    _check_request(request, config.BATCH_MAX_BYTES)
+
+    batch_dir = workspace.create("batch")
+    input_dir = os.path.join(batch_dir, "inputs")
+    output_dir = os.path.join(batch_dir, "outputs")
+    os.makedirs(input_dir)
+    cleanup = BackgroundTask(workspace.remove, batch_dir)
+
+    # The form is validated before the model is used as a metrics label
+    try:
+        started = time.perf_counter()
+        form = await _read_batch_form(request)
+        try:
+            fields = {name: value for name, value in form.multi_items() if isinstance(value, str)}
+            model = fields.get("model", DEFAULT_MODEL)
+            _check_model(model)
+            scale_factor = _parse_scale(fields.get("scale", DEFAULT_SCALE))
+            output_format = _batch_format(fields.get("format", "png"))
+            target_width = _form_int(fields, "target_width")
+            target_height = _form_int(fields, "target_height")
+            files = [value for value in form.getlist("files") if not isinstance(value, str)]
+            staged, rejected = await run_in_threadpool(_stage_batch_inputs, files, input_dir)
+        finally:
+            await form.close()
+        metrics.observe_since("upload", model, started)
+    except zipfile.BadZipFile:
+        await cleanup()
+        raise HTTPException(status_code=400, detail="Uploaded zip archive is invalid")
+    except Exception:
+        await cleanup()
+        raise
+
+    try:
+        if not staged and not rejected:
+            raise HTTPException(status_code=400, detail="No images found in upload")
+
+        megapixels = sum(upload.megapixels for upload in staged)
+        predicted = cost_model.predict(model, upscaler.MODELS[model].get("scale", 4), megapixels)
+        # The largest image sets the batch's peak memory
+        memory_bytes = 0
+        if staged:
+            largest = max(staged, key=lambda upload: upload.pixels)
+            try:
+                plan = upscaler.plan_scale(largest.width, largest.height, model, scale_factor, target_width, target_height)
+                memory_bytes = memory.directory_bytes(plan, largest.mode, upscaler.ENGINE)
+            except ValueError:
+                pass
+        if target_width is None and target_height is None:
+            # Multi-pass scales run later passes on upscaled images; a
+            # one-megapixel plan scaled up to the batch allows for them
+            try:
+                predicted = _predicted_seconds(upscaler.plan_scale(1000, 1000, model, scale_factor), megapixels)
+            except ValueError:
+                pass
+        results = []
+        if staged:
+            results = await _run_inference(
+                request,
+                CancelToken(_timeout_for(predicted)),
+                _ticket(request, predicted, memory_bytes),
+                upscaler.upscale_batch,
+                model,
+                [upload.path for upload in staged],
+                output_dir,
+                scale=scale_factor,
+                output_format=output_format,
+                target_width=target_width,
+                target_height=target_height,
+                max_output_pixels=config.MAX_OUTPUT_MEGAPIXELS * 1_000_000,
+            )
+
+        archive_path = os.path.join(batch_dir, "upscaled.zip")
+        entries = list(rejected)
+        # Outputs are named after their inputs, in upload order so suffixes are stable
+        taken = {"manifest.json"}
+        with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            for result in sorted(results, key=lambda result: int(os.path.basename(result.input_path).split("_", 1)[0])):
+                # Split off the staging index prefix to report the original name
+                position, original_name = os.path.basename(result.input_path).split("_", 1)
+                error = _client_error(result.error, result.input_path, original_name) if result.error else None
+                entry = {"input": original_name, "ok": result.ok, "error": error}
+                if result.ok:
+                    extension = os.path.splitext(result.output_path)[1]
+                    entry["output"] = _unique_name(os.path.splitext(original_name)[0] + extension, taken)
+                    archive.write(result.output_path, arcname=entry["output"])
+                entries.append((int(position), entry))
+            manifest = [entry for _, entry in sorted(entries, key=lambda item: item[0])]
+            archive.writestr("manifest.json", json.dumps(manifest, indent=2))
+
+        # Counted per image, like single upscales; rejected uploads never ran
+        for result in results:
+            metrics.UPSCALES.labels(model, "completed" if result.ok else "failed").inc()
+        succeeded = sum(1 for entry in manifest if entry["ok"])
+        return FileResponse(
+            archive_path,
+            media_type="application/zip",
+            filename="upscaled.zip",
+            headers={"X-Batch-Succeeded": str(succeeded), "X-Batch-Failed": str(len(manifest) - succeeded)},
+            background=_after_response(model, cleanup),
+        )
+
+    except QueueFullError as e:
+        await cleanup()
+        raise _queue_full_error(e.retry_after)
+    except HTTPException:
+        await cleanup()
+        raise
+    except zipfile.BadZipFile:
+        await cleanup()
+        raise HTTPException(status_code=400, detail="Uploaded zip archive is invalid")
+    except UpscaleTimeout as e:
+        await cleanup()
+        metrics.UPSCALES.labels(model, "timed_out").inc(len(staged))
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        await cleanup()
+        metrics.UPSCALES.labels(model, "failed").inc(len(staged))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/upscale/animation")
+async def upscale_animation(request: Request):
+    """
+    Upscale an animated GIF/WebP or a short video clip.
+
+    Returns the same kind of animation (an MP4 for videos, without audio)
+    with the original frame timing. Repeated frames are upscaled once.
+
+    Form fields: ``file``, ``scale`` and ``model``.
+    """
+    _check_request(request, config.MAX_UPLOAD_BYTES)
+
+    scratch = workspace.create("clip")
+    cleanup = BackgroundTask(workspace.remove, scratch)
+
+    # The form is validated before the model is used as a metrics label
+    try:
+        started = time.perf_counter()
+        # Videos are recognised by their extension, so keep it
+        form = await _read_upload(
+            request,
+            lambda name: str(scratch / f"input{os.path.splitext(name)[1].lower()}"),
+            probe=_probe_clip_upload,
+        )
+        model = form.fields.get("model", DEFAULT_MODEL)
+        _check_model(model)
+        metrics.observe_since("upload", model, started)
+        scale_factor = _parse_scale(form.fields.get("scale", DEFAULT_SCALE))
+    except Exception:
+        await cleanup()
+        raise
+    upload = form.upload
+    input_path = upload.path
+
+    try:
+        info = await run_in_threadpool(probe_clip, input_path)
+        plan = _plan_for(upload, model, scale_factor, None, None, info.format)
+        if len(plan.passes) > 1:
+            raise HTTPException(status_code=400, detail="Animations and videos can be upscaled up to 4x")
+
+        width, height = plan.output_size
+        cache_key = ResultCache.make_key(upload.sha256, model=model, size=f"{width}x{height}", clip=info.format)
+        media_type = CLIP_MEDIA_TYPES[info.format]
+        output_filename = f"upscaled_{cache_key[:12]}.{info.format}"
+        cached_path = await run_in_threadpool(cache.get, cache_key, str(scratch))
+        if cached_path is not None:
+            metrics.UPSCALES.labels(model, "cached").inc()
+            return FileResponse(
+                cached_path,
+                media_type=media_type,
+                filename=output_filename,
+                headers={"X-Cache": "HIT", "X-Output-Size": f"{width}x{height}"},
+                background=_after_response(model, cleanup),
+            )
+
+        output_path = str(scratch / output_filename)
+        # Worst case: every frame is unique
+        predicted = _predicted_seconds(plan, info.frame_count)
+        memory_bytes = memory.directory_bytes(plan, "RGBA" if info.has_alpha else "RGB", upscaler.ENGINE)
+        try:
+            result = await _run_inference(
+                request,
+                CancelToken(_timeout_for(predicted)),
+                _ticket(request, predicted, memory_bytes),
+                upscale_clip,
+                model,
+                upscaler,
+                input_path,
+                output_path,
+                scale=scale_factor,
+                work_dir=str(scratch),
+                batch_size=config.FRAME_BATCH_SIZE,
+                dedupe_threshold=config.FRAME_DEDUPE_THRESHOLD,
+                max_frames=config.MAX_CLIP_FRAMES,
+            )
+        finally:
+            os.unlink(input_path)
+        metrics.observe_size(model, upload.megapixels * result.upscaled_frames, plan.scale)
+        metrics.UPSCALES.labels(model, "completed").inc()
+
+        await run_in_threadpool(cache.put, cache_key, result.output_path)
+        return FileResponse(
+            result.output_path,
+            media_type=media_type,
+            filename=output_filename,
+            headers={
+                "X-Cache": "MISS",
+                "X-Output-Size": f"{width}x{height}",
+                "X-Frames": str(result.frames),
+                "X-Upscaled-Frames": str(result.upscaled_frames),
+            },
+            background=_after_response(model, cleanup),
+        )
+
+    except QueueFullError as e:
+        await cleanup()
+        raise _queue_full_error(e.retry_after)
+    except HTTPException:
+        await cleanup()
+        raise
+    except UpscaleTimeout as e:
+        await cleanup()
+        metrics.UPSCALES.labels(model, "timed_out").inc()
+        raise HTTPException(status_code=504, detail=str(e))
+    except ValueError as e:
+        await cleanup()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await cleanup()
+        metrics.UPSCALES.labels(model, "failed").inc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    """
+    Queue an upscale and return its job id without waiting for the result.
+
+    Takes the same form fields as ``POST /upscale``.
+    """
+    _check_request(request, config.MAX_UPLOAD_BYTES)
+
+    workdir = workspace.create("job")
+    try:
+        started = time.perf_counter()
+        form = await _read_upload(request, lambda name: str(workdir / f"input_{name or 'upload'}"))
+        model = form.fields.get("model", DEFAULT_MODEL)
+        _check_model(model)
+        metrics.observe_since("upload", model, started)
+        scale_factor = _parse_scale(form.fields.get("scale", DEFAULT_SCALE))
+        target_width = _form_int(form.fields, "target_width")
+        target_height = _form_int(form.fields, "target_height")
+        encode = _encode_options(form.fields)
+        upload = form.upload
+        input_path = upload.path
+        plan = _plan_for(upload, model, scale_factor, target_width, target_height, encode.format)
+    except Exception:
+        workspace.remove(workdir)
+        raise
+
+    job = Job(
+        workdir=str(workdir),
+        input_path=input_path,
+        output_path="",
+        model=model,
+        # Requested factor, or the one a target size works out to
+        scale=scale_factor if target_width is None and target_height is None else plan.scale,
+        encode=encode,
+        cache_key=_cache_key(upload, model, plan, encode),
+        tile_size=_tile_size_for(upload, plan),
+        tile_overlap=config.TILE_OVERLAP,
+        megapixels=upload.megapixels,
+        timeout=_timeout_for(_predicted_seconds(plan)),
+        target_width=target_width,
+        target_height=target_height,
+        encode_memory=memory.encode_bytes(plan.output_size, upload.mode, encode.format),
+        pyramid_memory=memory.pyramid_bytes(plan.output_size, upload.mode),
+    )
+    job.ticket = _ticket(request, _predicted_seconds(plan), _inference_memory(upload, plan, job.tile_size))
+    job.output_path = str(workdir / f"upscaled_{job.id}.{encode.extension}")
+
+    try:
+        # A cache lookup may scan the shared cache directory
+        await run_in_threadpool(jobs.submit, job)
+    except QueueFullError as e:
+        workspace.remove(workdir)
+        raise _queue_full_error(e.retry_after)
+
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Current status, progress and ETA of a job."""
+    return _get_job_or_404(job_id).to_dict()
+
+
+@app.delete("/jobs/{job_id}", status_code=202)
+def cancel_job(job_id: str):
+    """Cancel a queued or running job; its status becomes ``cancelled`` once it has stopped."""
+    job = _get_job_or_404(job_id)
+    if job.is_finished:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+    jobs.cancel(job_id)
+    return job.to_dict()
+
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Stream job progress as Server-Sent Events until the job finishes."""
+    _get_job_or_404(job_id)
+
+    async def event_stream():
+        async for snapshot in jobs.subscribe(job_id):
+            yield f"event: {snapshot['status']}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: str):
+    """Download the output of a completed job."""
+    job = _get_job_or_404(job_id)
+    return FileResponse(
+        _completed_output(job),
+        media_type=job.encode.media_type,
+        filename=f"upscaled_{job.id}.{job.format}",
+        headers={
+            "X-Cache": "HIT" if job.cache_hit else "MISS",
+            "X-Encoded-Size": str(job.encoded_size),
+        },
+        background=_after_response(job.model),
+    )
+
+
+@app.get("/results/{result_id}/tiles")
+async def get_result_tiles(result_id: str):
+    """
+    Deep-zoom layout of a completed job's result.
+
+    Level ``max_level`` is full resolution and each level below halves it.
+    Tiles are fetched from ``/results/{id}/tiles/{level}/{x}_{y}``.
+    """
+    _, info = await _pyramid_for(result_id)
+    return {
+        **info.to_dict(),
+        "levels": [
+            {"level": level, "size": info.level_size(level), "tiles": info.tile_count(level)}
+            for level in range(info.max_level + 1)
+        ],
+    }
+
+
+@app.get("/results/{result_id}/tiles/{level:int}/{x:int}_{y:int}")
+async def get_result_tile(result_id: str, level: int, x: int, y: int):
+    """One tile of a result's deep-zoom pyramid."""
+    root, info = await _pyramid_for(result_id)
+    columns, rows = info.tile_count(level) if 0 <= level <= info.max_level else (0, 0)
+    if not (x < columns and y < rows):
+        raise HTTPException(status_code=404, detail=f"No tile {level}/{x}_{y}")
+    return FileResponse(
+        info.tile_path(root, level, x, y),
+        media_type="image/png" if info.format == "png" else "image/jpeg",
+        # A result id always names the same pixels
+        headers={"Cache-Control": f"private, max-age={config.JOB_RESULT_TTL_SECONDS}, immutable"},
+    )
+
+
+def _cluster(x_cluster_token: Optional[str] = Header(None)) -> Coordinator:
+    """The coordinator, for requests from workers that present the cluster token."""
+    if coordinator is None:
+        raise HTTPException(status_code=404, detail="Cluster mode is off (set UPSCALER_ENGINE=cluster)")
+    if not hmac.compare_digest(x_cluster_token or "", config.CLUSTER_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid cluster token")
+    return coordinator
+
+
+@app.post("/cluster/workers")
+def register_worker(
+    name: str = Form(...),
+    capacity: int = Form(1),
+    engine: str = Form(""),
+    cluster: Coordinator = Depends(_cluster),
+):
+    """Register a worker; it should heartbeat every ``heartbeat_interval`` seconds."""
+    worker = cluster.register(name, capacity, engine)
+    return {"id": worker.id, "heartbeat_interval": config.CLUSTER_HEARTBEAT_TIMEOUT / 3}
+
+
+@app.get("/cluster/workers")
+def list_workers(cluster: Coordinator = Depends(_cluster)):
+    """Registered workers with their capacity and measured throughput."""
+    return {**cluster.stats(), "workers": cluster.workers()}
+
+
+@app.delete("/cluster/workers/{worker_id}", status_code=204)
+def deregister_worker(worker_id: str, cluster: Coordinator = Depends(_cluster)):
+    """Remove a worker that is shutting down; its running tasks are re-queued."""
+    cluster.deregister(worker_id)
+
+
+@app.post("/cluster/workers/{worker_id}/heartbeat")
+def worker_heartbeat(worker_id: str, cluster: Coordinator = Depends(_cluster)):
+    """Keep a worker registered; returns its tasks that were cancelled."""
+    try:
+        return {"cancelled": cluster.heartbeat(worker_id)}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown worker, register again")
+
+
+@app.post("/cluster/workers/{worker_id}/claim")
+async def claim_task(worker_id: str, wait: float = Form(20), cluster: Coordinator = Depends(_cluster)):
+    """Wait up to ``wait`` seconds for a task; 204 if none was assigned."""
+    try:
+        task = await run_in_threadpool(cluster.claim, worker_id, min(max(wait, 0), 60))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown worker, register again")
+    if task is None:
+        return Response(status_code=204)
+    return task.to_dict()
+
+
+def _assigned_task(cluster: Coordinator, task_id: str, worker_id: str):
+    try:
+        return cluster.task_for(worker_id, task_id)
+    except KeyError:
+        raise HTTPException(status_code=409, detail="Task is not assigned to this worker")
+
+
+@app.get("/cluster/tasks/{task_id}/input")
+def get_task_input(task_id: str, worker_id: str, cluster: Coordinator = Depends(_cluster)):
+    """Input images of a task as a zip."""
+    task = _assigned_task(cluster, task_id, worker_id)
+    return FileResponse(task.archive_path, media_type="application/zip")
+
+
+@app.post("/cluster/tasks/{task_id}/progress")
+def report_task_progress(
+    task_id: str,
+    worker_id: str = Form(...),
+    progress: float = Form(...),
+    message: str = Form(""),
+    cluster: Coordinator = Depends(_cluster),
+):
+    """Record progress; ``wanted`` is false once the task should be stopped."""
+    return {"wanted": cluster.update(worker_id, task_id, progress, message)}
+
+
+@app.put("/cluster/tasks/{task_id}/result", status_code=204)
+async def upload_task_result(task_id: str, worker_id: str, request: Request, cluster: Coordinator = Depends(_cluster)):
+    """Upload a task's output images as a zip."""
+    task = _assigned_task(cluster, task_id, worker_id)
+    result_path = os.path.join(os.path.dirname(task.archive_path), "result.zip")
+    tmp_path = f"{result_path}.{worker_id}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                f.write(chunk)
+    except FileNotFoundError:
+        # Withdrawn while uploading; its directory is already gone
+        raise HTTPException(status_code=409, detail="Task is not assigned to this worker")
+    os.replace(tmp_path, result_path)
+    try:
+        cluster.complete(worker_id, task_id, result_path)
+    except KeyError:
+        raise HTTPException(status_code=409, detail="Task is not assigned to this worker")
+
+
+@app.post("/cluster/tasks/{task_id}/failure", status_code=204)
+def report_task_failure(
+    task_id: str,
+    worker_id: str = Form(...),
+    error: str = Form(...),
+    cluster: Coordinator = Depends(_cluster),
+):
+    """Report that the worker's engine failed on a task."""
+    try:
+        cluster.fail(worker_id, task_id, error)
+    except KeyError:
+        raise HTTPException(status_code=409, detail="Task is not assigned to this worker")
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics: per-stage latency, image sizes, queue and cache state."""
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE_LATEST)
@@ -0,0 +1,154 @@
+"""
+Memory Estimates
+Predicts the peak RAM of an upscale from what is known before it runs: header
+dimensions, channels, the scale plan, tiling and the output format. The
+executor, encoder and tile pyramid builder reserve these amounts from a host memory budget, so
+concurrent jobs cannot together run the host out of memory.
+
+The figures are deliberately simple upper bounds built from the buffers each
+code path holds at once, not measurements.
+"""
+
+from typing import Optional, Tuple
+
+from backend import config
+from backend.upscaler import ScalePlan
+
+
+MB = 1024 ** 2
+
+# Engine process, model weights and interpreter overhead of one inference run
+INFERENCE_BASE_BYTES = 300 * MB
+
+# Overhead of one encode, beyond the decoded image
+ENCODE_BASE_BYTES = 32 * MB
+
+# Working memory the engine needs per output pixel beyond the 8-bit buffers:
+# the ONNX engine runs whole images as float32 input and output tensors
+ENGINE_BYTES_PER_OUTPUT_PIXEL = {"onnx": 24}
+
+# The output is decoded with OpenCV, then copied into a Pillow image, which
+# stores RGB and RGBA at four bytes per pixel
+PILLOW_BYTES_PER_PIXEL = 4
+
+# Bytes per output pixel an encoder holds beyond the decoded image: JPEG
+# copies images with alpha to RGB, WebP builds an ARGB picture, AVIF
+# converts to YUV
+ENCODE_BYTES_PER_PIXEL = {"png": 0, "jpg": 4, "webp": 4, "avif": 6}
+
+# Images the ncnn binary holds at once when it works through a directory
+# (its load, process and save threads each have one)
+DIRECTORY_IMAGES_IN_FLIGHT = 3
+
+
+def image_layout(mode: str) -> Tuple[int, int]:
+    """
+    Channels and bytes per sample the engine sees for a PIL image mode.
+
+    Palette images count as having alpha, since their transparency only
+    shows once decoded.
+    """
+    channels = 4 if "A" in mode or mode == "P" else 3
+    sample_bytes = 2 if ";16" in mode or mode in ("I", "F") else 1
+    return channels, sample_bytes
+
+
+def _bytes(size: Tuple[int, int], channels: int) -> int:
+    return size[0] * size[1] * channels
+
+
+def _model_size(plan: ScalePlan) -> Tuple[int, int]:
+    """Size of the last pass's output, before any final resize."""
+    return plan.pass_size[0] * plan.model_scale, plan.pass_size[1] * plan.model_scale
+
+
+def inference_bytes(
+    plan: ScalePlan,
+    mode: str,
+    engine: str = "",
+    tile_size: Optional[int] = None,
+    tile_overlap: int = 0,
+) -> int:
+    """
+    Peak RAM of upscaling one image.
+
+    Untiled, the engine holds the decoded input and the full-size output,
+    and the output is decoded once more to resize it or feed the next pass.
+    Tiled, the output is written to a memory-mapped file the kernel can page
+    out, and only one row of tiles (staged on tmpfs, then decoded) is held.
+    """
+    channels, sample_bytes = image_layout(mode)
+    # Decoded at its own depth, then normalized to 8 bits
+    input_bytes = _bytes(plan.input_size, channels) * (sample_bytes + 1)
+    model_size = _model_size(plan)
+    model_bytes = _bytes(model_size, channels)
+    resize_bytes = _bytes(plan.output_size, channels) if plan.resize_output else 0
+    engine_bytes = ENGINE_BYTES_PER_OUTPUT_PIXEL.get(engine, 0)
+
+    if not tile_size:
+        pixels = model_size[0] * model_size[1]
+        return INFERENCE_BASE_BYTES + input_bytes + 2 * model_bytes + resize_bytes + engine_bytes * pixels
+
+    # The last pass is the largest: its rows span the whole model output width
+    last_scale = plan.passes[-1]
+    row_height = (tile_size + 2 * tile_overlap) * last_scale
+    row_bytes = row_height * model_size[0] * channels
+    tile_pixels = ((tile_size + 2 * tile_overlap) * last_scale) ** 2
+    # Feather blending works on float32 copies of a tile and its region
+    blend_bytes = 2 * tile_pixels * channels * 4
+    tiled = INFERENCE_BASE_BYTES + input_bytes + 2 * row_bytes + blend_bytes + engine_bytes * tile_pixels
+    if plan.resize_output:
+        # The final resize decodes the whole model output
+        tiled += model_bytes + resize_bytes
+    return tiled
+
+
+def tile_size_for(plan: ScalePlan, mode: str, engine: str = "", budget_bytes: int = 0) -> Optional[int]:
+    """
+    Tile size to upscale an image with, or None when it runs in one piece.
+
+    Inputs over ``TILE_THRESHOLD_MEGAPIXELS`` are tiled, and so are images
+    predicted to need more than their share of ``budget_bytes`` (the host
+    memory budget split over ``HOST_MAX_CONCURRENT_JOBS``) in one piece.
+    """
+    width, height = plan.input_size
+    if config.TILE_THRESHOLD_MEGAPIXELS > 0 and width * height > config.TILE_THRESHOLD_MEGAPIXELS * 1_000_000:
+        return config.TILE_SIZE
+    if budget_bytes > 0:
+        share = budget_bytes // config.HOST_MAX_CONCURRENT_JOBS
+        if inference_bytes(plan, mode, engine) > share:
+            return config.TILE_SIZE
+    return None
+
+
+def directory_bytes(plan: ScalePlan, mode: str, engine: str = "") -> int:
+    """
+    Peak RAM of a directory run (a batch, or a clip's frames) whose largest
+    image follows ``plan``.
+    """
+    channels, sample_bytes = image_layout(mode)
+    model_size = _model_size(plan)
+    per_image = _bytes(plan.input_size, channels) * sample_bytes + _bytes(model_size, channels)
+    per_image += ENGINE_BYTES_PER_OUTPUT_PIXEL.get(engine, 0) * model_size[0] * model_size[1]
+    # Outputs are decoded again to place, resize or reassemble them
+    placing = _bytes(model_size, channels) + _bytes(plan.output_size, channels)
+    return INFERENCE_BASE_BYTES + DIRECTORY_IMAGES_IN_FLIGHT * per_image + placing
+
+
+def pyramid_bytes(output_size: Tuple[int, int], mode: str) -> int:
+    """
+    Peak RAM of cutting an output of ``output_size`` into a tile pyramid:
+    the decoded image, a converted copy of it (Pillow-decoded, 16-bit or
+    grey outputs), and the first half-size level.
+    """
+    channels, _ = image_layout(mode)
+    full = _bytes(output_size, channels)
+    return ENCODE_BASE_BYTES + 2 * full + full // 4
+
+
+def encode_bytes(output_size: Tuple[int, int], mode: str, format: str) -> int:
+    """Peak RAM of encoding an output of ``output_size`` as ``format``."""
+    channels, _ = image_layout(mode)
+    pixels = output_size[0] * output_size[1]
+    per_pixel = channels + PILLOW_BYTES_PER_PIXEL + ENCODE_BYTES_PER_PIXEL.get(format, 4)
+    return ENCODE_BASE_BYTES + pixels * per_pixel
@@ -0,0 +1,221 @@
+"""
+Service Metrics
+Prometheus instruments for the upscale pipeline: per-stage and per-model
+latency histograms, image sizes, and live queue, cache and engine state for
+the GET /metrics endpoint.
+
+With several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory before starting them. Histograms and counters are then summed over
+all processes on every scrape, and live state that belongs to one process is
+labelled with its pid.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+# Pipeline stages timed per model:
+#   upload    - streaming the upload to disk, hashing it and probing its header
+#   queue     - waiting for a free inference slot
+#   inference - decoding and upscaling (inside the binary for the ncnn engine)
+#   encode    - encoding the lossless output into the requested format
+#   stream    - sending the result back to the client
+STAGES = ("upload", "queue", "inference", "encode", "stream")
+
+# Where prometheus_client shares values between processes (None = this process only)
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or None
+
+REGISTRY = CollectorRegistry()
+
+STAGE_SECONDS = Histogram(
+    "upscaler_stage_seconds",
+    "Time spent in each stage of the upscale pipeline",
+    ["stage", "model"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320, 640),
+    registry=REGISTRY,
+)
+
+INPUT_MEGAPIXELS = Histogram(
+    "upscaler_input_megapixels",
+    "Size of upscaled inputs in megapixels",
+    ["model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 12, 16, 24, 32, 40),
+    registry=REGISTRY,
+)
+
+OUTPUT_MEGAPIXELS = Histogram(
+    "upscaler_output_megapixels",
+    "Size of upscaled outputs in megapixels",
+    ["model"],
+    buckets=(1, 4, 8, 16, 32, 64, 128, 192, 256, 384, 512, 640),
+    registry=REGISTRY,
+)
+
+UPSCALES = Counter(
+    "upscaler_upscales_total",
+    "Finished upscales, one per image of a batch, by model and outcome (completed, cached, failed, timed_out or cancelled)",
+    ["model", "outcome"],
+    registry=REGISTRY,
+)
+
+
+@contextmanager
+def time_stage(stage: str, model: str) -> Iterator[None]:
+    """
+    Observe the duration of the enclosed block as ``stage`` for ``model``.
+
+    Blocks that raise are not recorded, so fast failures do not drag the
+    latency distribution down.
+    """
+    start = time.perf_counter()
+    yield
+    STAGE_SECONDS.labels(stage, model).observe(time.perf_counter() - start)
+
+
+def observe_stage(stage: str, model: str, seconds: float) -> None:
+    """Record a stage duration measured elsewhere."""
+    STAGE_SECONDS.labels(stage, model).observe(max(0.0, seconds))
+
+
+def observe_since(stage: str, model: str, start: float) -> None:
+    """Record a stage that began at ``start`` (a ``time.perf_counter`` value)."""
+    observe_stage(stage, model, time.perf_counter() - start)
+
+
+def observe_size(model: str, megapixels: float, scale: int) -> None:
+    """Record the input and output size of one upscale."""
+    INPUT_MEGAPIXELS.labels(model).observe(megapixels)
+    OUTPUT_MEGAPIXELS.labels(model).observe(megapixels * scale * scale)
+
+
+class ServiceCollector:
+    """
+    Reports live service state at scrape time.
+
+    Queue depth, in-flight jobs, cache counters, scratch usage and engine
+    process failures are read from the objects that already track them, so
+    the numbers can never drift from what the API reports. In multiprocess
+    mode those series carry a ``pid`` label; host-wide slot and memory
+    usage do not.
+    """
+
+    def __init__(self, upscaler, executor, cache, workspace):
+        self.upscaler = upscaler
+        self.executor = executor
+        self.cache = cache
+        self.workspace = workspace
+        self._labels = ["pid"] if MULTIPROC_DIR else []
+
+    def _gauge(self, name: str, documentation: str, value: float) -> GaugeMetricFamily:
+        """A gauge of this process's state."""
+        family = GaugeMetricFamily(name, documentation, labels=self._labels)
+        family.add_metric(self._label_values(), value)
+        return family
+
+    def _counter(self, name: str, documentation: str, labels=()) -> CounterMetricFamily:
+        """A counter family of this process's state; fill it with ``add_metric``."""
+        return CounterMetricFamily(name, documentation, labels=list(labels) + self._labels)
+
+    def _label_values(self, *values: str) -> list:
+        return list(values) + ([str(os.getpid())] if self._labels else [])
+
+    def collect(self):
+        yield self._gauge(
+            "upscaler_queue_depth",
+            "Upscales waiting for a free inference slot",
+            self.executor.queued,
+        )
+        yield self._gauge(
+            "upscaler_in_flight_jobs",
+            "Upscales currently running",
+            self.executor.in_flight,
+        )
+
+        if self.executor.host_slots is not None:
+            yield GaugeMetricFamily(
+                "upscaler_host_slots_in_use",
+                "Upscales running on this host across all worker processes",
+                value=self.executor.host_slots.in_use(),
+            )
+
+        if self.executor.memory is not None:
+            yield GaugeMetricFamily(
+                "upscaler_memory_reserved_bytes",
+                "Predicted peak memory of the upscales and encodes running on this host",
+                value=self.executor.memory.in_use(),
+            )
+            yield GaugeMetricFamily(
+                "upscaler_memory_budget_bytes",
+                "Memory the upscales on this host may use together",
+                value=self.executor.memory.capacity,
+            )
+
+        failures = self._counter(
+            "upscaler_process_failures",
+            "Engine runs that failed (non-zero exit of the upscaler binary)",
+            labels=["engine"],
+        )
+        failures.add_metric(self._label_values(self.upscaler.ENGINE), self.upscaler.process_failures)
+        yield failures
+
+        stats = self.cache.stats()
+        lookups = self._counter(
+            "upscaler_cache_lookups",
+            "Result cache lookups by outcome",
+            labels=["outcome"],
+        )
+        lookups.add_metric(self._label_values("hit"), stats["hits"])
+        lookups.add_metric(self._label_values("miss"), stats["misses"])
+        yield lookups
+        evictions = self._counter(
+            "upscaler_cache_evictions",
+            "Result cache entries evicted for size or age",
+        )
+        evictions.add_metric(self._label_values(), stats["evictions"])
+        yield evictions
+        yield self._gauge(
+            "upscaler_cache_hit_ratio",
+            "Fraction of result cache lookups that were hits since startup",
+            stats["hit_rate"],
+        )
+        yield self._gauge(
+            "upscaler_cache_bytes",
+            "Bytes stored in the result cache",
+            stats["bytes"],
+        )
+
+        usage = self.workspace.usage()
+        yield self._gauge(
+            "upscaler_workspace_bytes",
+            "Bytes stored in per-request scratch directories",
+            usage["bytes"],
+        )
+
+
+_service: Optional[ServiceCollector] = None
+
+
+def register_service(upscaler, executor, cache, workspace) -> None:
+    """Expose live state of the service objects on the metrics registry."""
+    global _service
+    _service = ServiceCollector(upscaler, executor, cache, workspace)
+    REGISTRY.register(_service)
+
+
+def render() -> bytes:
+    """
+    Current metrics in the Prometheus text format; in multiprocess mode,
+    histograms and counters of every process plus this process's live state.
+    """
+    if not MULTIPROC_DIR:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    if _service is not None:
+        registry.register(_service)
+    return generate_latest(registry)
@@ -0,0 +1,228 @@
+"""
+Deep-Zoom Tile Pyramids
+Cuts finished results into a multi-resolution pyramid of small tiles (the
+Deep Zoom layout) so viewers can show a huge upscale by loading only the
+tiles visible at the current zoom instead of the whole file.
+"""
+
+import json
+import math
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from backend.locks import HostBudget
+from backend.workspace import Workspace
+
+
+@dataclass(frozen=True)
+class PyramidInfo:
+    """
+    Layout of a tile pyramid.
+
+    Level ``max_level`` is the full-resolution image; every level below
+    halves both sides (rounding up) down to level 0, a single pixel.
+    """
+
+    width: int
+    height: int
+    tile_size: int
+    max_level: int
+    format: str
+
+    MANIFEST = "pyramid.json"
+
+    def level_size(self, level: int) -> Tuple[int, int]:
+        """(width, height) of a level in pixels."""
+        factor = 2 ** (self.max_level - level)
+        return math.ceil(self.width / factor), math.ceil(self.height / factor)
+
+    def tile_count(self, level: int) -> Tuple[int, int]:
+        """(columns, rows) of tiles in a level."""
+        width, height = self.level_size(level)
+        return math.ceil(width / self.tile_size), math.ceil(height / self.tile_size)
+
+    def tile_path(self, root: Path, level: int, x: int, y: int) -> Path:
+        return root / str(level) / f"{x}_{y}.{self.format}"
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def load(cls, root: Path) -> Optional["PyramidInfo"]:
+        """The manifest of a finished pyramid, or None while it is missing."""
+        try:
+            data = json.loads((root / cls.MANIFEST).read_text())
+        except (OSError, ValueError):
+            return None
+        return cls(**data)
+
+
+def _read_image(path: str) -> np.ndarray:
+    """Decode an image to 8-bit BGR/BGRA, falling back to Pillow (e.g. for AVIF)."""
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        try:
+            with Image.open(path) as pil_image:
+                pil_image = pil_image.convert("RGBA" if pil_image.mode in ("RGBA", "LA", "P") else "RGB")
+                image = np.asarray(pil_image)
+        except OSError:
+            raise ValueError(f"Could not decode image: {path}")
+        code = cv2.COLOR_RGBA2BGRA if image.shape[2] == 4 else cv2.COLOR_RGB2BGR
+        image = cv2.cvtColor(image, code)
+    if image.dtype != np.uint8:
+        image = (image / 257).astype(np.uint8)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def build_pyramid(image_path: str, root: Path, tile_size: int = 256, quality: int = 85) -> PyramidInfo:
+    """
+    Cut an image into a tile pyramid under ``root``.
+
+    Each level is made by halving the one above it, so the full-resolution
+    image is decoded once and every level after it costs a quarter as much.
+    Tiles are JPEG, or PNG when the image has an alpha channel. The manifest
+    is written last, so a pyramid with a manifest is complete.
+
+    Args:
+        image_path: Finished result to tile
+        root: Empty directory to write ``{level}/{x}_{y}.{format}`` tiles into
+        tile_size: Tile edge length in pixels
+        quality: JPEG quality of the tiles
+    """
+    image = _read_image(image_path)
+    height, width = image.shape[:2]
+    has_alpha = image.shape[2] == 4
+    info = PyramidInfo(
+        width=width,
+        height=height,
+        tile_size=tile_size,
+        max_level=math.ceil(math.log2(max(width, height, 1))),
+        format="png" if has_alpha else "jpg",
+    )
+    params = [] if has_alpha else [cv2.IMWRITE_JPEG_QUALITY, quality]
+
+    for level in range(info.max_level, -1, -1):
+        level_width, level_height = info.level_size(level)
+        if (image.shape[1], image.shape[0]) != (level_width, level_height):
+            image = cv2.resize(image, (level_width, level_height), interpolation=cv2.INTER_AREA)
+
+        (root / str(level)).mkdir(parents=True, exist_ok=True)
+        columns, rows = info.tile_count(level)
+        for y in range(rows):
+            for x in range(columns):
+                tile = image[y * tile_size:(y + 1) * tile_size, x * tile_size:(x + 1) * tile_size]
+                if not cv2.imwrite(str(info.tile_path(root, level, x, y)), tile, params):
+                    raise RuntimeError(f"Failed to write tile {level}/{x}_{y}")
+
+    manifest = root / f"{PyramidInfo.MANIFEST}.tmp"
+    manifest.write_text(json.dumps(info.to_dict()))
+    manifest.replace(root / PyramidInfo.MANIFEST)
+    return info
+
+
+class TileStore:
+    """
+    Lazily built pyramids of finished results, one workspace directory each.
+
+    A pyramid is built the first time it is asked for, once even when many
+    tile requests arrive together, and then released to the workspace, whose
+    sweeper deletes it after the workspace TTL or when over quota. Asking for
+    a swept pyramid builds it again. Swept pyramids are forgotten at the
+    next build, and ``forget`` deletes one whose result has expired.
+
+    Building decodes the whole result, so with a ``memory`` budget each build
+    first reserves its predicted peak memory from the budget the inference
+    jobs and encodes share.
+    """
+
+    def __init__(self, workspace: Workspace, tile_size: int = 256, memory: Optional[HostBudget] = None):
+        """
+        Initialize the store.
+
+        Args:
+            workspace: Owner of the pyramid directories
+            tile_size: Tile edge length in pixels
+            memory: Host memory budget builds reserve from
+        """
+        self.workspace = workspace
+        self.tile_size = tile_size
+        self.memory = memory
+
+        self._roots: Dict[str, Path] = {}
+        # Build lock of each key being asked for, and how many callers hold or wait on it
+        self._building: Dict[str, Tuple[threading.Lock, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, image_path: str, memory_bytes: int = 0) -> Tuple[Path, PyramidInfo]:
+        """
+        The pyramid of ``image_path``, building it if needed.
+
+        Args:
+            key: Identifies the image; the same key must always mean the same pixels
+            image_path: Image to tile if the pyramid does not exist yet
+            memory_bytes: Predicted peak memory of building the pyramid
+
+        Returns:
+            The pyramid directory and its layout
+
+        Raises:
+            ValueError: If the image cannot be decoded
+        """
+        with self._lock:
+            build_lock, users = self._building.get(key, (None, 0))
+            build_lock = build_lock or threading.Lock()
+            self._building[key] = (build_lock, users + 1)
+
+        try:
+            with build_lock:
+                return self._get(key, image_path, memory_bytes)
+        finally:
+            with self._lock:
+                build_lock, users = self._building[key]
+                if users > 1:
+                    self._building[key] = (build_lock, users - 1)
+                else:
+                    del self._building[key]
+
+    def forget(self, key: str) -> None:
+        """Delete the pyramid of ``key``, if there is one, e.g. once its result has expired."""
+        with self._lock:
+            root = self._roots.pop(key, None)
+        if root is not None:
+            self.workspace.remove(root)
+
+    def _get(self, key: str, image_path: str, memory_bytes: int) -> Tuple[Path, PyramidInfo]:
+        """``get`` under the key's build lock."""
+        with self._lock:
+            root = self._roots.get(key)
+        info = PyramidInfo.load(root) if root is not None else None
+        if info is not None:
+            return root, info
+
+        reservation = None
+        if self.memory is not None and memory_bytes > 0:
+            reservation = self.memory.acquire(memory_bytes)
+        root = self.workspace.create("tiles")
+        try:
+            info = build_pyramid(image_path, root, self.tile_size)
+        except Exception:
+            self.workspace.remove(root)
+            raise
+        finally:
+            if reservation is not None:
+                self.memory.release(reservation)
+        self.workspace.release(root)
+        with self._lock:
+            # Forget pyramids the workspace sweeper has deleted since the last build
+            for swept in [name for name, path in self._roots.items() if not path.is_dir()]:
+                del self._roots[swept]
+            self._roots[key] = root
+        return root, info
@@ -6,23 +6,1282 @@ while maintaining the same Real-ESRGAN model quality.
 """
 
 import os
+import re
+import json
+import math
 import sys
 import stat
 import shutil
+import signal
 import platform
 import subprocess
 import tempfile
+import threading
+import time
 import zipfile
+import itertools
 import requests
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
 from pathlib import Path
-from typing import Optional, Callable
+from typing import Dict, Iterator, List, Optional, Callable, Sequence, Tuple
 
 import cv2
 import numpy as np
 from PIL import Image
 
+try:
+    import fcntl
+except ImportError:  # Windows: setup is not guarded against concurrent processes
+    fcntl = None
 
-class RealESRGANUpscaler:
+
+def _make_staging_dir(prefix: str) -> Path:
+    """
+    Create a scratch directory for intermediate images.
+    
+    Prefers RAM-backed tmpfs (``/dev/shm``) so intermediates never touch the
+    disk; UPSCALER_STAGING_DIR overrides the location.
+    """
+    root = os.environ.get("UPSCALER_STAGING_DIR")
+    if root is None and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        root = "/dev/shm"
+    return Path(tempfile.mkdtemp(prefix=prefix, dir=root))
+
+
+@contextmanager
+def _exclusive(lock_path: Path) -> Iterator[None]:
+    """
+    Hold an exclusive lock file for the enclosed block.
+    
+    Serializes one-time setup between processes sharing a models directory
+    (e.g. uvicorn workers), so only one of them downloads the binary.
+    """
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _tile_spans(length: int, tile_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """
+    Split ``[0, length)`` into spans of at most ``tile_size`` that overlap by
+    at least ``overlap``. The last span is aligned to the end.
+    """
+    if length <= tile_size:
+        return [(0, length)]
+    
+    step = max(1, tile_size - overlap)
+    spans = []
+    start = 0
+    while True:
+        end = min(start + tile_size, length)
+        spans.append((end - tile_size, end) if end == length else (start, end))
+        if end == length:
+            return spans
+        start += step
+
+
+def _feather_ramp(length: int, blend: int) -> np.ndarray:
+    """Weights rising linearly from 0 to 1 over the first ``blend`` samples."""
+    ramp = np.ones(length, dtype=np.float32)
+    if blend > 0:
+        ramp[:blend] = (np.arange(blend, dtype=np.float32) + 0.5) / blend
+    return ramp
+
+
+def _normalize_image(image: np.ndarray) -> np.ndarray:
+    """Convert a decoded image to 8-bit BGR or BGRA."""
+    if image.dtype == np.uint16:
+        image = (image >> 8).astype(np.uint8)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def _header_size(path: Path) -> Optional[Tuple[int, int]]:
+    """Width and height from the file header, without decoding it (None if unreadable)."""
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except (OSError, Image.DecompressionBombError):
+        return None
+
+
+def _header_megapixels(path: Path) -> float:
+    """Image size from the file header, without decoding it (0 if unreadable)."""
+    size = _header_size(path)
+    return size[0] * size[1] / 1_000_000 if size else 0.0
+
+
+@dataclass
+class BatchResult:
+    """Outcome of upscaling one file in a batch."""
+
+    input_path: str
+    model: str
+    output_path: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.output_path is not None
+
+
+@dataclass
+class ScalePlan:
+    """
+    How to produce an output of a requested size with models' native scales.
+    
+    The input is reduced to ``pass_size`` (when smaller than the input), each
+    pass runs ``models[i]`` at ``passes[i]``, and the result is reduced to
+    ``output_size`` when the passes overshoot it.
+    """
+
+    input_size: Tuple[int, int]
+    output_size: Tuple[int, int]
+    passes: Tuple[int, ...]
+    pass_size: Tuple[int, int]
+    models: Tuple[str, ...]
+
+    @property
+    def scale(self) -> float:
+        """Effective scale factor of the whole upscale."""
+        return self.output_size[0] / self.input_size[0]
+
+    @property
+    def model_scale(self) -> int:
+        """Combined scale factor of all passes."""
+        return math.prod(self.passes)
+
+    @property
+    def pass_megapixels(self) -> List[float]:
+        """Input megapixels of each pass, a proxy for its inference cost."""
+        pixels = self.pass_size[0] * self.pass_size[1] / 1_000_000
+        sizes = []
+        for pass_scale in self.passes:
+            sizes.append(pixels)
+            pixels *= pass_scale * pass_scale
+        return sizes
+
+    @property
+    def resize_input(self) -> bool:
+        return self.pass_size != self.input_size
+
+    @property
+    def resize_output(self) -> bool:
+        return self.output_size != (self.pass_size[0] * self.model_scale, self.pass_size[1] * self.model_scale)
+
+
+def _resize_to(image: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    """Resize to (width, height), using area averaging when shrinking."""
+    if (image.shape[1], image.shape[0]) == size:
+        return image
+    shrinking = size[0] * size[1] < image.shape[0] * image.shape[1]
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_CUBIC)
+
+
+def _resize_file(input_path: str, output_path: str, size: Tuple[int, int]) -> None:
+    """Resize an image file to (width, height)."""
+    image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise RuntimeError(f"Upscaling failed: could not decode {input_path}")
+    if not cv2.imwrite(str(output_path), _resize_to(image, size)):
+        raise RuntimeError(f"Upscaling failed: could not write {output_path}")
+
+
+class UpscaleCancelled(RuntimeError):
+    """Raised when an upscale is cancelled before it finishes."""
+
+
+class UpscaleTimeout(UpscaleCancelled):
+    """Raised when an upscale runs past its deadline."""
+
+
+class CancelToken:
+    """
+    Cancellation flag and optional time limit shared with a running upscale.
+    
+    The time limit counts from ``start`` (called when the upscale begins
+    running, not when it was queued). Engines poll ``check`` between units of
+    work and kill their subprocess as soon as it raises.
+    """
+    
+    def __init__(self, timeout: Optional[float] = None):
+        """
+        Args:
+            timeout: Seconds the upscale may run for (None = no limit)
+        """
+        self.timeout = timeout
+        self.deadline: Optional[float] = None
+        self.reason = "Upscaling was cancelled"
+        self._event = threading.Event()
+    
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+    
+    def start(self) -> None:
+        """Start the clock; later calls keep the first deadline."""
+        if self.timeout and self.deadline is None:
+            self.deadline = time.monotonic() + self.timeout
+    
+    def cancel(self, reason: Optional[str] = None) -> None:
+        """Ask the upscale to stop as soon as possible."""
+        if reason:
+            self.reason = reason
+        self._event.set()
+    
+    def check(self) -> None:
+        """
+        Raises:
+            UpscaleCancelled: If ``cancel`` has been called
+            UpscaleTimeout: If the deadline has passed
+        """
+        if self._event.is_set():
+            raise UpscaleCancelled(self.reason)
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise UpscaleTimeout(f"Upscaling timed out after {self.timeout:.0f}s")
+
+
+class _ProgressMonitor:
+    """
+    Turns the percentage lines printed by the upscaler binary into progress.
+    
+    The binary reports 0-100% per image, so when a directory is processed a
+    drop in the percentage marks the start of the next file. Other output
+    lines are kept for error messages.
+    """
+    
+    PERCENT_LINE = re.compile(r"^\s*(\d+(?:\.\d+)?)%\s*$")
+    
+    def __init__(
+        self,
+        total_files: int = 1,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+    ):
+        self.total_files = max(1, total_files)
+        self.progress_callback = progress_callback
+        self.progress = 0.0
+        self.output_tail: deque = deque(maxlen=20)
+        
+        self._files_done = 0
+        self._percent = 0.0
+        self._first_seen: Optional[Tuple[float, float]] = None
+        self._last_advance = time.monotonic()
+    
+    def feed(self, line: str) -> None:
+        """Process one line of binary output."""
+        match = self.PERCENT_LINE.match(line)
+        if match is None:
+            if line.strip():
+                self.output_tail.append(line.rstrip())
+            return
+        
+        percent = float(match.group(1))
+        if percent < self._percent:
+            self._files_done = min(self._files_done + 1, self.total_files - 1)
+        self._percent = percent
+        
+        now = time.monotonic()
+        progress = min(1.0, (self._files_done + percent / 100.0) / self.total_files)
+        if self._first_seen is None:
+            self._first_seen = (now, progress)
+        if progress <= self.progress:
+            return
+        
+        self.progress = progress
+        self._last_advance = now
+        if self.progress_callback:
+            self.progress_callback(progress, self._message())
+    
+    def idle_seconds(self) -> float:
+        """Seconds since progress last advanced (or since the run started)."""
+        return time.monotonic() - self._last_advance
+    
+    def eta_seconds(self) -> Optional[float]:
+        """Remaining time at the rate seen since the first progress line."""
+        if self._first_seen is None:
+            return None
+        first_time, first_progress = self._first_seen
+        elapsed = time.monotonic() - first_time
+        if elapsed <= 0 or self.progress <= first_progress:
+            return None
+        rate = (self.progress - first_progress) / elapsed
+        return (1.0 - self.progress) / rate
+    
+    def _message(self) -> str:
+        if self.total_files > 1:
+            message = f"Upscaling image {self._files_done + 1}/{self.total_files}... {self.progress:.0%}"
+        else:
+            message = f"Upscaling... {self.progress:.0%}"
+        eta = self.eta_seconds()
+        if eta is not None:
+            message += f" (about {eta:.0f}s left)"
+        return message
+
+
+class BaseUpscaler:
+    """
+    Common upscaling workflow shared by every inference engine.
+    
+    Engines subclass this and implement ``_run_pass``, which upscales one
+    file or a whole directory of files. Everything else (validation, batching,
+    array handling, progress reporting, pass timing) is engine-independent.
+    """
+    
+    # Name used to select the engine in create_upscaler()
+    ENGINE = ""
+    
+    # Files picked up when a directory is upscaled
+    IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+    
+    # Available models with their largest and all native scale factors, and
+    # their run time per megapixel relative to realesrgan-x4plus
+    MODELS = {
+        "realesrgan-x4plus": {"scale": 4, "scales": (4,), "cost": 1.0, "description": "Best quality for general photos"},
+        "realesrnet-x4plus": {"scale": 4, "scales": (4,), "cost": 1.0, "description": "Faster, slightly less detailed"},
+        "realesrgan-x4plus-anime": {"scale": 4, "scales": (4,), "cost": 0.3, "description": "Optimized for illustrations"},
+        "realesr-animevideov3": {"scale": 4, "scales": (2, 3, 4), "cost": 0.1, "description": "Fast anime/video model with native 2x, 3x and 4x"},
+    }
+    
+    # Most passes chained for scales beyond a model's native ones (4x4 = 16x)
+    MAX_PASSES = 2
+    
+    # Tile size for passes after the first, whose inputs are already upscaled
+    PASS_TILE_SIZE = 512
+    
+    def __init__(self, models_dir: Optional[str] = None):
+        """
+        Initialize the upscaler.
+        
+        Args:
+            models_dir: Directory to store binaries and model weights
+                (UPSCALER_MODELS_DIR, default: ``bin`` next to this module; auto-created)
+        """
+        if models_dir is None:
+            models_dir = os.environ.get("UPSCALER_MODELS_DIR") or os.path.join(os.path.dirname(__file__), "bin")
+        
+        self.models_dir = Path(models_dir)
+        self.models_dir.mkdir(parents=True, exist_ok=True)
+        
+        # Engine runs that failed, reported by the metrics endpoint
+        self.process_failures = 0
+        
+        # Called after every successful pass with (model, native scale,
+        # input megapixels, seconds), e.g. to learn run times
+        self.pass_observer: Optional[Callable[[str, int, float, float], None]] = None
+    
+    @property
+    def cost_profile(self) -> str:
+        """Engine and execution settings that pass timings depend on."""
+        return self.ENGINE
+    
+    def get_available_models(self) -> dict:
+        """Get list of available models."""
+        return self.MODELS.copy()
+    
+    def plan_scale(
+        self,
+        width: int,
+        height: int,
+        model: str,
+        scale: float = 4,
+        target_width: Optional[int] = None,
+        target_height: Optional[int] = None,
+        pass_models: Optional[Sequence[str]] = None,
+    ) -> ScalePlan:
+        """
+        Work out how to upscale a ``width`` x ``height`` input.
+        
+        The output size comes from ``target_width``/``target_height`` when
+        given (the aspect ratio is kept; with both, the output fits inside
+        them), otherwise from ``scale``. Scales beyond the model's largest
+        native scale are chained over up to ``MAX_PASSES`` passes. The fewest
+        passes, and then the smallest combined native scale, that reach it
+        are used, with smaller scales first because the early passes run on
+        the smaller images. The input is reduced first so the models only
+        produce the pixels that are needed.
+        
+        Args:
+            pass_models: Model for each pass, overriding ``model`` and fixing
+                the number of passes
+        
+        Raises:
+            ValueError: If a model is unknown or the output size is out of range
+        """
+        models = tuple(pass_models) if pass_models else (model,)
+        for name in models:
+            if name not in self.MODELS:
+                raise ValueError(f"Unknown model: {name}. Available: {list(self.MODELS.keys())}")
+        
+        if target_width is not None or target_height is not None:
+            if (target_width is not None and target_width <= 0) or (target_height is not None and target_height <= 0):
+                raise ValueError("Target width and height must be positive")
+            if target_width is not None and (target_height is None or target_width / width <= target_height / height):
+                ratio = target_width / width
+                output_size = (target_width, max(1, round(height * ratio)))
+            else:
+                ratio = target_height / height
+                output_size = (max(1, round(width * ratio)), target_height)
+        else:
+            ratio = float(scale)
+            output_size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        
+        longest = models if pass_models else models * self.MAX_PASSES
+        largest = math.prod(max(self.MODELS[name]["scales"]) for name in longest)
+        if not 1 <= ratio <= largest + 1e-9:
+            raise ValueError(f"Scale must be between 1 and {largest} for {'+'.join(models)}. Got: {ratio:.3g}")
+        
+        # Fewest passes first; within those, the least overshoot
+        for count in ([len(models)] if pass_models else range(1, self.MAX_PASSES + 1)):
+            pass_names = models if pass_models else models * count
+            options = [
+                combination for combination in itertools.product(*(self.MODELS[name]["scales"] for name in pass_names))
+                if math.prod(combination) >= ratio - 1e-9
+            ]
+            if options:
+                passes = min(options, key=lambda combination: (math.prod(combination), combination))
+                models = pass_names
+                break
+        if not pass_models:
+            passes = tuple(sorted(passes))
+        
+        model_scale = math.prod(passes)
+        pass_size = (
+            min(width, math.ceil(output_size[0] / model_scale)),
+            min(height, math.ceil(output_size[1] / model_scale)),
+        )
+        return ScalePlan((width, height), output_size, tuple(passes), pass_size, tuple(models))
+    
+    def _run_upscale(
+        self,
+        input_path: str,
+        output_path: str,
+        model: str,
+        scale: int,
+        output_format: Optional[str] = None,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> None:
+        """
+        Run a single upscale pass on the engine and report its timing.
+        
+        Input and output may be files or directories; with directories every
+        image in the input directory is upscaled into the output directory,
+        keeping its file name with the extension of ``output_format``.
+        ``progress_callback`` receives the fraction of this pass completed,
+        and the pass stops with ``UpscaleCancelled`` once ``cancel`` fires.
+        """
+        start = time.perf_counter()
+        self._run_pass(input_path, output_path, model, scale, output_format, progress_callback, cancel)
+        if self.pass_observer is None:
+            return
+        
+        seconds = time.perf_counter() - start
+        if os.path.isdir(input_path):
+            megapixels = sum(
+                _header_megapixels(entry) for entry in Path(input_path).iterdir()
+                if entry.suffix.lower() in self.IMAGE_EXTENSIONS
+            )
+        else:
+            megapixels = _header_megapixels(Path(input_path))
+        self._observe_pass(model, scale, megapixels, seconds)
+    
+    def _run_pass(
+        self,
+        input_path: str,
+        output_path: str,
+        model: str,
+        scale: int,
+        output_format: Optional[str],
+        progress_callback: Optional[Callable[[float, str], None]],
+        cancel: Optional[CancelToken],
+    ) -> None:
+        """Engine implementation of ``_run_upscale``."""
+        raise NotImplementedError
+    
+    def _observe_pass(self, model: str, scale: int, megapixels: float, seconds: float) -> None:
+        """Hand a timed pass to ``pass_observer``; a failing observer never fails the upscale."""
+        if self.pass_observer is None or megapixels <= 0:
+            return
+        try:
+            self.pass_observer(model, scale, megapixels, seconds)
+        except Exception as e:
+            print(f"[Upscaler] Could not record pass timing: {e}")
+    
+    def _upscale_arrays(
+        self,
+        images: List[np.ndarray],
+        model: str,
+        scale: int,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Upscale a list of 8-bit BGR(A) arrays, yielding results in order.
+        
+        The default implementation stages the arrays as uncompressed PNGs on
+        tmpfs and runs one ``_run_upscale`` pass over the directory. Engines
+        that can work on arrays directly override this.
+        """
+        staging_dir = _make_staging_dir("upscale_arrays_")
+        try:
+            in_dir = staging_dir / "in"
+            out_dir = staging_dir / "out"
+            in_dir.mkdir()
+            out_dir.mkdir()
+            
+            for index, image in enumerate(images):
+                cv2.imwrite(str(in_dir / f"{index:06d}.png"), image, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+            
+            self._run_upscale(str(in_dir), str(out_dir), model, scale, "png", progress_callback, cancel)
+            
+            for index in range(len(images)):
+                output_file = out_dir / f"{index:06d}.png"
+                output = cv2.imread(str(output_file), cv2.IMREAD_UNCHANGED)
+                if output is None:
+                    raise RuntimeError(f"Upscaling failed: no output for tile {index}")
+                output_file.unlink()
+                yield _normalize_image(output)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    
+    def upscale_tiled(
+        self,
+        input_path: str,
+        output_path: str,
+        scale: int = 4,
+        model: str = "realesrgan-x4plus",
+        tile_size: int = 512,
+        tile_overlap: int = 32,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> str:
+        """
+        Upscale a large image tile by tile with bounded memory.
+        
+        The input is split into overlapping tiles that are upscaled one row at
+        a time. Each tile is blended into a memory-mapped output buffer with
+        linear feathering across the overlap, so seams are invisible and peak
+        memory depends on the tile size rather than the image size.
+        
+        Args:
+            input_path: Path to input image
+            output_path: Path for output image
+            scale: Native scale factor of the model
+            model: Model name to use
+            tile_size: Tile edge length in input pixels
+            tile_overlap: Overlap between neighbouring tiles in input pixels
+            progress_callback: Optional callback for progress updates (progress, message)
+            cancel: Optional token that stops the upscale (see ``CancelToken``)
+            
+        Returns:
+            Path to the output file
+        """
+        if cancel:
+            cancel.start()
+        
+        if tile_overlap < 0 or tile_overlap >= tile_size:
+            raise ValueError(f"Tile overlap must be in [0, {tile_size}). Got: {tile_overlap}")
+        
+        image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise RuntimeError(f"Upscaling failed: could not decode {input_path}")
+        image = _normalize_image(image)
+        
+        # Output lives in a file-backed buffer next to the destination
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        buffer_fd, buffer_path = tempfile.mkstemp(suffix=".npy", dir=output_dir)
+        os.close(buffer_fd)
+        
+        try:
+            output = self._upscale_to_buffer(
+                image, buffer_path, model, scale, tile_size, tile_overlap, progress_callback, cancel
+            )
+            del image
+            if not cv2.imwrite(str(output_path), output):
+                raise RuntimeError(f"Upscaling failed: could not write {output_path}")
+            del output
+        finally:
+            if os.path.exists(buffer_path):
+                os.unlink(buffer_path)
+        
+        return output_path
+    
+    def _upscale_to_buffer(
+        self,
+        image: np.ndarray,
+        buffer_path: str,
+        model: str,
+        scale: int,
+        tile_size: int,
+        tile_overlap: int,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> np.ndarray:
+        """
+        Upscale an 8-bit BGR(A) array tile by tile into a memory-mapped
+        ``.npy`` file at ``buffer_path`` (see ``upscale_tiled``).
+        
+        ``image`` may itself be memory-mapped: only one row of tiles is read
+        from it at a time.
+        
+        Returns:
+            The output buffer
+        """
+        height, width, channels = image.shape
+        rows = _tile_spans(height, tile_size, tile_overlap)
+        cols = _tile_spans(width, tile_size, tile_overlap)
+        total_tiles = len(rows) * len(cols)
+        
+        output = np.lib.format.open_memmap(
+            buffer_path,
+            mode="w+",
+            dtype=np.uint8,
+            shape=(height * scale, width * scale, channels),
+        )
+        
+        done = 0
+        reported = 0.0
+        
+        def report(tiles_done: float) -> None:
+            # Engine progress arrives before a row is blended; never step backwards
+            nonlocal reported
+            if progress_callback and tiles_done > reported:
+                reported = tiles_done
+                progress_callback(tiles_done / total_tiles, f"Upscaling tile {int(tiles_done)}/{total_tiles}...")
+        
+        for row_index, (y0, y1) in enumerate(rows):
+            tiles = [np.ascontiguousarray(image[y0:y1, x0:x1]) for x0, x1 in cols]
+            
+            def on_row_progress(progress: float, message: str, done: int = done, count: int = len(tiles)) -> None:
+                report(done + progress * count)
+            
+            if cancel:
+                cancel.check()
+            row_outputs = self._upscale_arrays(tiles, model, scale, on_row_progress, cancel)
+            for col_index, tile_output in enumerate(row_outputs):
+                x0, x1 = cols[col_index]
+                oy0, oy1, ox0, ox1 = y0 * scale, y1 * scale, x0 * scale, x1 * scale
+                
+                if tile_output.shape[:2] != (oy1 - oy0, ox1 - ox0):
+                    raise RuntimeError(
+                        f"Upscaling failed: tile output is {tile_output.shape[1]}x{tile_output.shape[0]}, "
+                        f"expected {ox1 - ox0}x{oy1 - oy0}"
+                    )
+                if tile_output.shape[2] != channels:
+                    conversion = cv2.COLOR_BGR2BGRA if channels == 4 else cv2.COLOR_BGRA2BGR
+                    tile_output = cv2.cvtColor(tile_output, conversion)
+                
+                # Feather into the region already written by the left and top neighbours
+                blend_x = (cols[col_index - 1][1] - x0) * scale if col_index > 0 else 0
+                blend_y = (rows[row_index - 1][1] - y0) * scale if row_index > 0 else 0
+                
+                if blend_x == 0 and blend_y == 0:
+                    output[oy0:oy1, ox0:ox1] = tile_output
+                else:
+                    weight = np.outer(
+                        _feather_ramp(oy1 - oy0, blend_y),
+                        _feather_ramp(ox1 - ox0, blend_x),
+                    )[:, :, np.newaxis]
+                    region = output[oy0:oy1, ox0:ox1].astype(np.float32)
+                    region += (tile_output.astype(np.float32) - region) * weight
+                    output[oy0:oy1, ox0:ox1] = np.clip(region + 0.5, 0, 255).astype(np.uint8)
+                
+                done += 1
+                report(done)
+            
+            # Release this row's input tiles before the next one
+            del tiles
+        
+        output.flush()
+        return output
+    
+    def upscale(
+        self,
+        input_path: str,
+        output_path: str,
+        scale: float = 4,
+        model: str = "realesrgan-x4plus",
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: int = 32,
+        cancel: Optional[CancelToken] = None,
+        target_width: Optional[int] = None,
+        target_height: Optional[int] = None,
+        pass_models: Optional[Sequence[str]] = None,
+    ) -> str:
+        """
+        Upscale an image file.
+        
+        Scales the model supports natively run straight on the input; any
+        other scale or target size, including multi-pass scales such as 8x
+        and 16x, is planned with ``plan_scale``.
+        
+        Args:
+            input_path: Path to input image
+            output_path: Path for output image
+            scale: Scale factor, e.g. 1.5, 2 or 4 (ignored when a target size is given)
+            model: Model name to use
+            progress_callback: Optional callback for progress updates (progress, message)
+            tile_size: Process in tiles of this many input pixels (see ``upscale_tiled``);
+                None upscales the whole image in one pass
+            tile_overlap: Overlap between tiles in input pixels
+            cancel: Optional token that stops the upscale and carries its time limit
+            target_width: Output width in pixels (keeps the aspect ratio)
+            target_height: Output height in pixels (keeps the aspect ratio;
+                with ``target_width`` the output fits inside both)
+            pass_models: Optional model for each pass of a multi-pass upscale
+                (e.g. a photo model, then a faster one for the large second pass)
+            
+        Returns:
+            Path to the output file
+            
+        Raises:
+            UpscaleCancelled: If ``cancel`` fires (``UpscaleTimeout`` past its deadline)
+        """
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"Input file not found: {input_path}")
+        
+        if model not in self.MODELS:
+            raise ValueError(f"Unknown model: {model}. Available: {list(self.MODELS.keys())}")
+        
+        native = target_width is None and target_height is None and not pass_models
+        if native and scale in self.MODELS[model]["scales"]:
+            if cancel:
+                cancel.start()
+            return self._upscale_pass(
+                input_path, output_path, int(scale), model, progress_callback, tile_size, tile_overlap, cancel
+            )
+        
+        # Plan from the header; the input is decoded only if a pass needs it
+        image = None
+        size = _header_size(Path(input_path))
+        if size is None:
+            image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+            if image is None:
+                raise RuntimeError(f"Upscaling failed: could not decode {input_path}")
+            size = (image.shape[1], image.shape[0])
+        plan = self.plan_scale(size[0], size[1], model, scale, target_width, target_height, pass_models)
+        
+        if cancel:
+            cancel.start()
+        return self._upscale_planned(
+            input_path, output_path, plan, progress_callback, tile_size, tile_overlap, cancel, image
+        )
+    
+    def _upscale_planned(
+        self,
+        input_path: str,
+        output_path: str,
+        plan: ScalePlan,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        tile_size: Optional[int] = None,
+        tile_overlap: int = 32,
+        cancel: Optional[CancelToken] = None,
+        image: Optional[np.ndarray] = None,
+    ) -> str:
+        """
+        Carry out a ``ScalePlan`` for an image file.
+        
+        Reduced inputs, intermediates and overshooting outputs are staged on
+        tmpfs. ``image`` is the already decoded input, if the caller has it.
+        """
+        staging_dir = _make_staging_dir("upscale_scaled_")
+        try:
+            if len(plan.passes) > 1:
+                if image is None:
+                    image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+                    if image is None:
+                        raise RuntimeError(f"Upscaling failed: could not decode {input_path}")
+                self._upscale_chained(
+                    image, output_path, plan, staging_dir, progress_callback, tile_size, tile_overlap, cancel
+                )
+                return output_path
+            
+            source = input_path
+            if plan.resize_input:
+                if image is None:
+                    image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+                    if image is None:
+                        raise RuntimeError(f"Upscaling failed: could not decode {input_path}")
+                source = str(staging_dir / "input.png")
+                cv2.imwrite(source, _resize_to(image, plan.pass_size), [cv2.IMWRITE_PNG_COMPRESSION, 0])
+            del image
+            
+            destination = str(staging_dir / "output.png") if plan.resize_output else output_path
+            self._upscale_pass(
+                source, destination, plan.passes[0], plan.models[0], progress_callback, tile_size, tile_overlap, cancel
+            )
+            if plan.resize_output:
+                _resize_file(destination, output_path, plan.output_size)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        
+        return output_path
+    
+    def _upscale_chained(
+        self,
+        image: np.ndarray,
+        output_path: str,
+        plan: ScalePlan,
+        staging_dir: Path,
+        progress_callback: Optional[Callable[[float, str], None]],
+        tile_size: Optional[int],
+        tile_overlap: int,
+        cancel: Optional[CancelToken],
+    ) -> None:
+        """
+        Run a multi-pass plan.
+        
+        Each pass writes a memory-mapped intermediate into ``staging_dir``
+        that the next pass reads one row of tiles at a time, so no
+        intermediate is ever decoded, re-encoded or held in RAM as a whole.
+        Progress is weighted by the pixels each pass has to process.
+        """
+        image = _resize_to(_normalize_image(image), plan.pass_size)
+        
+        weights = plan.pass_megapixels
+        total = sum(weights)
+        previous_buffer = None
+        for index, (pass_model, pass_scale) in enumerate(zip(plan.models, plan.passes)):
+            def on_progress(
+                progress: float,
+                message: str,
+                offset: float = sum(weights[:index]),
+                weight: float = weights[index],
+                label: str = f"Pass {index + 1}/{len(plan.passes)} ({pass_scale}x)",
+            ) -> None:
+                if progress_callback:
+                    progress_callback((offset + progress * weight) / total, f"{label}: {message}")
+            
+            # Later passes run on upscaled intermediates, which are always tiled
+            pass_tile = tile_size or (max(image.shape[:2]) if index == 0 else self.PASS_TILE_SIZE)
+            pass_overlap = tile_overlap if pass_tile < max(image.shape[:2]) else 0
+            if pass_overlap >= pass_tile:
+                raise ValueError(f"Tile overlap must be in [0, {pass_tile}). Got: {tile_overlap}")
+            
+            buffer_path = staging_dir / f"pass{index}.npy"
+            image = self._upscale_to_buffer(
+                image, str(buffer_path), pass_model, pass_scale, pass_tile, pass_overlap, on_progress, cancel
+            )
+            if previous_buffer is not None:
+                previous_buffer.unlink()
+            previous_buffer = buffer_path
+        
+        if plan.resize_output:
+            resized = np.lib.format.open_memmap(
+                str(staging_dir / "resized.npy"),
+                mode="w+",
+                dtype=np.uint8,
+                shape=(plan.output_size[1], plan.output_size[0], image.shape[2]),
+            )
+            cv2.resize(image, plan.output_size, dst=resized, interpolation=cv2.INTER_AREA)
+            image = resized
+        
+        if not cv2.imwrite(str(output_path), image):
+            raise RuntimeError(f"Upscaling failed: could not write {output_path}")
+        
+        if progress_callback:
+            progress_callback(1.0, "Complete!")
+    
+    def _upscale_pass(
+        self,
+        input_path: str,
+        output_path: str,
+        scale: int,
+        model: str,
+        progress_callback: Optional[Callable[[float, str], None]],
+        tile_size: Optional[int],
+        tile_overlap: int,
+        cancel: Optional[CancelToken],
+    ) -> str:
+        """One upscale of a file at a native scale of the model, tiled if requested."""
+        if tile_size:
+            return self.upscale_tiled(
+                input_path,
+                output_path,
+                scale=scale,
+                model=model,
+                tile_size=tile_size,
+                tile_overlap=tile_overlap,
+                progress_callback=progress_callback,
+                cancel=cancel,
+            )
+        
+        if progress_callback:
+            progress_callback(0.0, f"Applying {scale}x upscaling...")
+        
+        self._run_upscale(input_path, output_path, model, scale, progress_callback=progress_callback, cancel=cancel)
+        
+        if progress_callback:
+            progress_callback(1.0, "Complete!")
+        
+        return output_path
+    
+    def upscale_batch(
+        self,
+        input_paths: List[str],
+        output_dir: str,
+        scale: float = 4,
+        model: str = "realesrgan-x4plus",
+        models: Optional[List[str]] = None,
+        output_format: str = "png",
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        target_width: Optional[int] = None,
+        target_height: Optional[int] = None,
+        max_output_pixels: Optional[int] = None,
+    ) -> List[BatchResult]:
+        """
+        Upscale many image files with one binary invocation per model.
+
+        Inputs are staged into a directory per model so the binary loads each
+        model once. Files that fail (or a group whose run fails) are retried
+        one at a time, so a single bad file only fails its own result. When
+        the scale is not native to a model, or a target size is given, each
+        file is planned with ``plan_scale`` and staged already reduced.
+
+        Args:
+            input_paths: Paths to input images
+            output_dir: Directory for output images (auto-created)
+            scale: Scale factor, e.g. 1.5, 2 or 4 (ignored when a target size is given)
+            model: Model used for every file unless ``models`` is given
+            models: Optional per-file model names, same length as ``input_paths``
+            output_format: Output image format (png, jpg or webp)
+            progress_callback: Optional callback for progress updates (progress, message)
+            cancel: Optional token that stops the whole batch
+            target_width: Output width of every file in pixels (see ``upscale``)
+            target_height: Output height of every file in pixels (see ``upscale``)
+            max_output_pixels: Fail files whose output would be larger than this
+
+        Returns:
+            One BatchResult per input, in input order
+
+        Raises:
+            UpscaleCancelled: If ``cancel`` fires
+        """
+        if cancel:
+            cancel.start()
+
+        if models is None:
+            models = [model] * len(input_paths)
+        if len(models) != len(input_paths):
+            raise ValueError("models must have one entry per input path")
+
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        results = [BatchResult(input_path=path, model=name) for path, name in zip(input_paths, models)]
+
+        # Group valid inputs by model
+        groups: Dict[str, List[int]] = {}
+        for index, result in enumerate(results):
+            if result.model not in self.MODELS:
+                result.error = f"Unknown model: {result.model}. Available: {list(self.MODELS.keys())}"
+            elif not os.path.exists(result.input_path):
+                result.error = f"Input file not found: {result.input_path}"
+            else:
+                groups.setdefault(result.model, []).append(index)
+
+        # Unique, stable output names even when inputs share a file name
+        used_names = set()
+        output_names = {}
+        for index, result in enumerate(results):
+            stem = Path(result.input_path).stem
+            name = f"{stem}.{output_format}"
+            suffix = 1
+            while name in used_names:
+                name = f"{stem}_{suffix}.{output_format}"
+                suffix += 1
+            used_names.add(name)
+            output_names[index] = output_dir / name
+
+        total = max(1, len(input_paths))
+        done = 0
+
+        for model_name, indices in groups.items():
+            if progress_callback:
+                progress_callback(done / total, f"Upscaling {len(indices)} image(s) with {model_name}...")
+
+            staging_dir = _make_staging_dir("upscale_batch_")
+            try:
+                in_dir = staging_dir / "in"
+                out_dir = staging_dir / "out"
+                in_dir.mkdir()
+                out_dir.mkdir()
+
+                # Stage inputs under index-based names so outputs map back unambiguously.
+                # Files needing a non-native scale are staged reduced to their pass size.
+                native = target_width is None and target_height is None and scale in self.MODELS[model_name]["scales"]
+                model_scale = int(scale) if native else None
+                staged: Dict[int, Path] = {}
+                plans: Dict[int, ScalePlan] = {}
+                for index in indices:
+                    source = Path(results[index].input_path)
+                    if native:
+                        staged[index] = in_dir / f"{index:06d}{source.suffix.lower()}"
+                        try:
+                            os.link(source, staged[index])
+                        except OSError:
+                            shutil.copyfile(source, staged[index])
+                        continue
+                    
+                    image = cv2.imread(str(source), cv2.IMREAD_UNCHANGED)
+                    if image is None:
+                        results[index].error = f"Upscaling failed: could not decode {source}"
+                        continue
+                    try:
+                        plan = self.plan_scale(image.shape[1], image.shape[0], model_name, scale, target_width, target_height)
+                    except ValueError as e:
+                        results[index].error = str(e)
+                        continue
+                    if max_output_pixels and plan.output_size[0] * plan.output_size[1] > max_output_pixels:
+                        results[index].error = (
+                            f"Output would be {plan.output_size[0]}x{plan.output_size[1]}, "
+                            f"over the limit of {max_output_pixels / 1_000_000:.0f} MP"
+                        )
+                        continue
+                    if len(plan.passes) > 1 or (model_scale is not None and plan.model_scale != model_scale):
+                        # One binary run covers one scale; others run alone below
+                        plans[index] = plan
+                        continue
+                    model_scale = plan.model_scale
+                    plans[index] = plan
+                    staged[index] = in_dir / f"{index:06d}.png"
+                    cv2.imwrite(str(staged[index]), _resize_to(image, plan.pass_size), [cv2.IMWRITE_PNG_COMPRESSION, 0])
+                    del image
+
+                def on_group_progress(progress: float, message: str, done: int = done, count: int = len(indices)) -> None:
+                    if progress_callback:
+                        progress_callback((done + progress * count) / total, message)
+                
+                if staged:
+                    try:
+                        self._run_upscale(str(in_dir), str(out_dir), model_name, model_scale, output_format, on_group_progress, cancel)
+                    except UpscaleCancelled:
+                        raise
+                    except RuntimeError:
+                        # Fall through to per-file retries below
+                        pass
+
+                for index in indices:
+                    if results[index].error is not None:
+                        continue
+                    produced = out_dir / f"{index:06d}.{output_format}"
+                    if index in staged and produced.exists():
+                        self._place_batch_output(produced, output_names[index], plans.get(index))
+                        results[index].output_path = str(output_names[index])
+                        continue
+
+                    # Run alone: files planned apart from the group, and retries that
+                    # isolate a failure and capture its error
+                    try:
+                        plan = plans.get(index)
+                        if plan is None:
+                            self._run_upscale(
+                                results[index].input_path,
+                                str(produced),
+                                model_name,
+                                int(scale),
+                                output_format,
+                                cancel=cancel,
+                            )
+                        else:
+                            self._upscale_planned(results[index].input_path, str(produced), plan, cancel=cancel)
+                        if not produced.exists():
+                            raise RuntimeError("Upscaling produced no output")
+                        shutil.move(str(produced), str(output_names[index]))
+                        results[index].output_path = str(output_names[index])
+                    except UpscaleCancelled:
+                        raise
+                    except Exception as e:
+                        results[index].error = str(e)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+
+            done += len(indices)
+
+        if progress_callback:
+            progress_callback(1.0, "Complete!")
+
+        return results
+
+    @staticmethod
+    def _place_batch_output(produced: Path, destination: Path, plan: Optional[ScalePlan]) -> None:
+        """Move a batch output into place, reducing it to its planned size if needed."""
+        if plan is not None and plan.resize_output:
+            _resize_file(str(produced), str(destination), plan.output_size)
+            produced.unlink()
+        else:
+            shutil.move(str(produced), str(destination))
+
+    def upscale_image(
+        self,
+        image: np.ndarray,
+        scale: float = 4,
+        model: str = "realesrgan-x4plus",
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+        target_width: Optional[int] = None,
+        target_height: Optional[int] = None,
+        pass_models: Optional[Sequence[str]] = None,
+        tile_overlap: int = 32,
+    ) -> np.ndarray:
+        """
+        Upscale an image array.
+        
+        Works on arrays end to end: intermediates (if the engine needs files
+        at all) are uncompressed and kept on tmpfs, and the result is
+        converted back to RGB in place. Passes after the first run tile by
+        tile on a memory-mapped intermediate, as in ``_upscale_chained``.
+        
+        Args:
+            image: Input image as numpy array (RGB, RGBA or grayscale uint8)
+            scale: Scale factor, e.g. 1.5, 2 or 4 (ignored when a target size is given)
+            model: Model name to use
+            progress_callback: Optional callback for progress updates
+            cancel: Optional token that stops the upscale
+            target_width: Output width in pixels (see ``upscale``)
+            target_height: Output height in pixels (see ``upscale``)
+            pass_models: Optional model for each pass (see ``upscale``)
+            tile_overlap: Overlap between the tiles of passes after the first
+            
+        Returns:
+            Upscaled image as numpy array (RGB or RGBA format)
+        """
+        if cancel:
+            cancel.start()
+        
+        plan = self.plan_scale(image.shape[1], image.shape[0], model, scale, target_width, target_height, pass_models)
+        
+        if image.ndim == 2:
+            bgr = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            bgr = cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
+        else:
+            bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        bgr = _resize_to(bgr, plan.pass_size)
+        
+        if progress_callback:
+            progress_callback(0.0, f"Applying {plan.scale:g}x upscaling...")
+        
+        output = bgr
+        weights = plan.pass_megapixels
+        staging_dir = _make_staging_dir("upscale_image_")
+        try:
+            previous_buffer = None
+            for index, (pass_model, pass_scale) in enumerate(zip(plan.models, plan.passes)):
+                def on_progress(progress: float, message: str, offset: float = sum(weights[:index]), weight: float = weights[index]) -> None:
+                    if progress_callback:
+                        progress_callback((offset + progress * weight) / sum(weights), message)
+                
+                if index == 0:
+                    output = next(iter(self._upscale_arrays([output], pass_model, pass_scale, on_progress, cancel)))
+                    continue
+                
+                # Later passes run on upscaled intermediates, which are always tiled
+                pass_overlap = tile_overlap if self.PASS_TILE_SIZE < max(output.shape[:2]) else 0
+                if pass_overlap >= self.PASS_TILE_SIZE:
+                    raise ValueError(f"Tile overlap must be in [0, {self.PASS_TILE_SIZE}). Got: {tile_overlap}")
+                buffer_path = staging_dir / f"pass{index}.npy"
+                output = self._upscale_to_buffer(
+                    output, str(buffer_path), pass_model, pass_scale, self.PASS_TILE_SIZE, pass_overlap, on_progress, cancel
+                )
+                if previous_buffer is not None:
+                    previous_buffer.unlink()
+                previous_buffer = buffer_path
+            del bgr
+            output = _resize_to(output, plan.output_size)
+            if isinstance(output, np.memmap):
+                # The result outlives the staging directory
+                output = np.array(output)
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        
+        # Reuse the output buffer instead of allocating a converted copy
+        if output.shape[2] == 4:
+            cv2.cvtColor(output, cv2.COLOR_BGRA2RGBA, dst=output)
+        else:
+            cv2.cvtColor(output, cv2.COLOR_BGR2RGB, dst=output)
+        
+        if progress_callback:
+            progress_callback(1.0, "Complete!")
+        
+        return output
+
+
+@dataclass
+class NcnnSettings:
+    """
+    Execution settings passed to the realesrgan-ncnn-vulkan binary.
+    
+    Empty values leave the binary's own default in place. Settings are
+    persisted as a JSON profile (written by ``python -m backend.autotune``)
+    and loaded when the upscaler starts.
+    """
+    
+    # -t: tile size in pixels; 0 lets the binary pick one from GPU memory
+    tile_size: int = 0
+    # -j: load:proc:save thread counts, e.g. "1:2:2" (proc may list one count per GPU)
+    threads: str = ""
+    # -g: GPU id, e.g. "0", "0,1" for several GPUs, or "-1" for CPU
+    gpu_id: str = ""
+    
+    THREADS_PATTERN = re.compile(r"^\d+:\d+(,\d+)*:\d+$")
+    GPU_PATTERN = re.compile(r"^-?\d+(,\d+)*$")
+    
+    def __post_init__(self):
+        self.tile_size = int(self.tile_size)
+        self.threads = str(self.threads or "").strip()
+        self.gpu_id = str(self.gpu_id if self.gpu_id is not None else "").strip()
+        if self.tile_size < 0 or 0 < self.tile_size < 32:
+            raise ValueError(f"Invalid tile size: {self.tile_size}. Use 0 (auto) or at least 32")
+        if self.threads and not self.THREADS_PATTERN.match(self.threads):
+            raise ValueError(f"Invalid thread counts: {self.threads!r}. Expected load:proc:save, e.g. 1:2:2")
+        if self.gpu_id and not self.GPU_PATTERN.match(self.gpu_id):
+            raise ValueError(f"Invalid GPU id: {self.gpu_id!r}. Expected e.g. 0, 0,1 or -1")
+    
+    def to_args(self) -> List[str]:
+        """Command-line flags for the binary."""
+        args = []
+        if self.tile_size:
+            args += ["-t", str(self.tile_size)]
+        if self.threads:
+            args += ["-j", self.threads]
+        if self.gpu_id:
+            args += ["-g", self.gpu_id]
+        return args
+    
+    @classmethod
+    def load(cls, path: Path) -> "NcnnSettings":
+        """Read a profile, ignoring keys that are not settings (tuning notes)."""
+        with open(path) as f:
+            data = json.load(f)
+        return cls(
+            tile_size=data.get("tile_size", 0),
+            threads=data.get("threads", ""),
+            gpu_id=data.get("gpu_id", ""),
+        )
+    
+    def save(self, path: Path, **extra) -> None:
+        """Atomically write the settings, plus any ``extra`` notes, as a profile."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({**asdict(self), **extra}, f, indent=2)
+            f.write("\n")
+        os.replace(tmp_path, path)
+
+
+class RealESRGANUpscaler(BaseUpscaler):
     """
     High-quality image upscaler using Real-ESRGAN NCNN Vulkan.
     
@@ -39,29 +1298,77 @@ class RealESRGANUpscaler:
         "darwin_x86_64": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesrgan-ncnn-vulkan-20220424-macos.zip",
     }
     
-    # Available models with their scale factors
-    MODELS = {
-        "realesrgan-x4plus": {"scale": 4, "description": "Best quality for general photos"},
-        "realesrnet-x4plus": {"scale": 4, "description": "Faster, slightly less detailed"},
-        "realesrgan-x4plus-anime": {"scale": 4, "description": "Optimized for illustrations"},
-    }
+    ENGINE = "ncnn"
     
-    def __init__(self, models_dir: Optional[str] = None):
+    PROFILE_NAME = "ncnn_profile.json"
+    
+    def __init__(
+        self,
+        models_dir: Optional[str] = None,
+        stall_timeout: Optional[float] = None,
+        settings: Optional[NcnnSettings] = None,
+    ):
         """
         Initialize the upscaler.
         
         Args:
             models_dir: Directory to store binary and models (auto-created if None)
+            stall_timeout: Kill a run whose progress has not advanced for this many
+                seconds (UPSCALER_STALL_TIMEOUT, default 120; 0 disables)
+            settings: Tile size, threads and device for the binary (None = load
+                the saved profile, then apply UPSCALER_NCNN_* overrides)
         """
-        if models_dir is None:
-            models_dir = os.path.join(os.path.dirname(__file__), "bin")
+        super().__init__(models_dir)
         
-        self.models_dir = Path(models_dir)
-        self.models_dir.mkdir(parents=True, exist_ok=True)
+        if stall_timeout is None:
+            stall_timeout = float(os.environ.get("UPSCALER_STALL_TIMEOUT", "120"))
+        self.stall_timeout = stall_timeout
+        
+        self.profile_path = Path(
+            os.environ.get("UPSCALER_NCNN_PROFILE") or self.models_dir / self.PROFILE_NAME
+        )
+        self.settings = settings if settings is not None else self._load_settings()
         
         self.binary_path = self._get_binary_path()
         self._ensure_binary_exists()
     
+    def _load_settings(self) -> NcnnSettings:
+        """Saved profile (if any) with UPSCALER_NCNN_TILE/THREADS/GPU overrides."""
+        settings = NcnnSettings()
+        if self.profile_path.exists():
+            try:
+                settings = NcnnSettings.load(self.profile_path)
+                print(f"[Upscaler] Loaded ncnn profile {self.profile_path}")
+            except (OSError, ValueError) as e:
+                print(f"[Upscaler] Ignoring invalid ncnn profile {self.profile_path}: {e}")
+        
+        overrides = {
+            "tile_size": os.environ.get("UPSCALER_NCNN_TILE"),
+            "threads": os.environ.get("UPSCALER_NCNN_THREADS"),
+            "gpu_id": os.environ.get("UPSCALER_NCNN_GPU"),
+        }
+        overrides = {key: value for key, value in overrides.items() if value is not None}
+        if overrides:
+            settings = NcnnSettings(**{**asdict(settings), **overrides})
+        return settings
+    
+    def save_settings(self, settings: Optional[NcnnSettings] = None, **extra) -> Path:
+        """
+        Persist execution settings as the profile loaded at startup.
+        
+        Args:
+            settings: Settings to save (default: the current ones), which also
+                become the current settings
+            **extra: Additional notes stored in the profile
+        
+        Returns:
+            Path of the written profile
+        """
+        if settings is not None:
+            self.settings = settings
+        self.settings.save(self.profile_path, **extra)
+        return self.profile_path
+    
     def _get_platform_key(self) -> str:
         """Get the platform key for binary download."""
         system = platform.system().lower()
@@ -81,10 +1388,25 @@ class RealESRGANUpscaler:
         return self.models_dir / binary_name
     
     def _ensure_binary_exists(self) -> None:
-        """Download and extract the binary if it doesn't exist."""
+        """
+        Download and extract the binary if it doesn't exist.
+        
+        Runs under a lock file in the models directory, so when several
+        worker processes start together one downloads and the others wait
+        and then find the binary in place. The binary is moved in last, so
+        its presence means the models next to it are complete.
+        """
         if self.binary_path.exists():
             return
         
+        with _exclusive(self.models_dir / ".setup.lock"):
+            if self.binary_path.exists():
+                # Another process finished the setup while we waited
+                return
+            self._download_binary()
+    
+    def _download_binary(self) -> None:
+        """Fetch and unpack the binary and models; caller holds the setup lock."""
         platform_key = self._get_platform_key()
         url = self.BINARY_URLS.get(platform_key)
         
@@ -113,20 +1435,27 @@ class RealESRGANUpscaler:
         
         print("\n[Upscaler] Extracting...")
         
-        # Extract the zip file
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            zip_ref.extractall(self.models_dir)
-        
-        # Find and move the binary to the expected location
-        extracted_dir = None
-        for item in self.models_dir.iterdir():
-            if item.is_dir() and "realesrgan" in item.name.lower():
-                extracted_dir = item
-                break
-        
-        if extracted_dir:
-            # Move contents to models_dir
-            for item in extracted_dir.iterdir():
+        # Extract next to the final location, away from names other processes check
+        extract_dir = Path(tempfile.mkdtemp(prefix=".extract-", dir=self.models_dir))
+        try:
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                zip_ref.extractall(extract_dir)
+            
+            # The release zips wrap everything in one realesrgan-* directory
+            source_dir = extract_dir
+            for item in extract_dir.iterdir():
+                if item.is_dir() and "realesrgan" in item.name.lower():
+                    source_dir = item
+                    break
+            
+            # Make binary executable before anyone can see it
+            binary = source_dir / self.binary_path.name
+            if binary.exists():
+                binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+            
+            # Move contents to models_dir, the binary last
+            items = sorted(source_dir.iterdir(), key=lambda item: item.name == self.binary_path.name)
+            for item in items:
                 dest = self.models_dir / item.name
                 if dest.exists():
                     if dest.is_dir():
@@ -134,29 +1463,36 @@ class RealESRGANUpscaler:
                     else:
                         dest.unlink()
                 shutil.move(str(item), str(dest))
-            extracted_dir.rmdir()
-        
-        # Make binary executable
-        if self.binary_path.exists():
-            self.binary_path.chmod(self.binary_path.stat().st_mode | stat.S_IEXEC)
-        
-        # Clean up zip
-        zip_path.unlink()
+        finally:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+            # Clean up zip
+            zip_path.unlink(missing_ok=True)
         
         print("[Upscaler] Setup complete!")
     
-    def get_available_models(self) -> dict:
-        """Get list of available models."""
-        return self.MODELS.copy()
+    @property
+    def cost_profile(self) -> str:
+        return " ".join([self.ENGINE, *self.settings.to_args()])
     
-    def _run_upscale(
+    def _run_pass(
         self,
         input_path: str,
         output_path: str,
         model: str,
         scale: int,
+        output_format: Optional[str] = None,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
     ) -> None:
-        """Run a single upscale pass."""
+        """
+        Run a single upscale pass with the binary.
+
+        Input and output may be files or directories; with directories the
+        binary processes every image in one invocation. The binary's output
+        is read as it runs, so its per-tile percentages reach
+        ``progress_callback`` live. The binary runs in its own process group,
+        which is killed when the run stalls, is cancelled or times out.
+        """
         cmd = [
             str(self.binary_path),
             "-i", str(input_path),
@@ -164,115 +1500,293 @@ class RealESRGANUpscaler:
             "-n", model,
             "-s", str(scale),
         ]
+        if output_format:
+            cmd += ["-f", output_format]
+        cmd += self.settings.to_args()
         
-        result = subprocess.run(
+        total_files = 1
+        if os.path.isdir(input_path):
+            total_files = sum(
+                1 for entry in Path(input_path).iterdir()
+                if entry.suffix.lower() in self.IMAGE_EXTENSIONS
+            )
+        monitor = _ProgressMonitor(total_files, progress_callback)
+        
+        if cancel:
+            cancel.check()
+        process = subprocess.Popen(
             cmd,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
             text=True,
+            bufsize=1,
             cwd=str(self.models_dir),
+            start_new_session=True,
         )
+        reader = threading.Thread(target=self._read_output, args=(process, monitor), daemon=True)
+        reader.start()
+        
+        stalled = False
+        stopped: Optional[UpscaleCancelled] = None
+        while True:
+            try:
+                process.wait(timeout=0.25)
+                break
+            except subprocess.TimeoutExpired:
+                pass
+            try:
+                if cancel:
+                    cancel.check()
+            except UpscaleCancelled as e:
+                stopped = e
+                self._kill(process)
+            else:
+                if self.stall_timeout > 0 and monitor.idle_seconds() > self.stall_timeout:
+                    stalled = True
+                    self._kill(process)
+        reader.join()
+        
+        if stopped is not None or stalled:
+            # Drop whatever the binary had written for a single-file run
+            if os.path.isfile(output_path):
+                os.unlink(output_path)
+        if stopped is not None:
+            raise stopped
+        if stalled:
+            self.process_failures += 1
+            raise RuntimeError(f"Upscaling stalled: no progress for {self.stall_timeout:.0f}s")
         
-        if result.returncode != 0:
-            error_msg = result.stderr or result.stdout or "Unknown error"
+        if process.returncode != 0:
+            self.process_failures += 1
+            error_msg = "\n".join(monitor.output_tail) or "Unknown error"
             raise RuntimeError(f"Upscaling failed: {error_msg}")
     
-    def upscale(
-        self,
-        input_path: str,
-        output_path: str,
-        scale: int = 4,
-        model: str = "realesrgan-x4plus",
-        progress_callback: Optional[Callable[[float, str], None]] = None,
-    ) -> str:
+    @staticmethod
+    def _kill(process: subprocess.Popen) -> None:
+        """Kill the binary and anything it spawned."""
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+    
+    @staticmethod
+    def _read_output(process: subprocess.Popen, monitor: _ProgressMonitor) -> None:
+        """Feed the binary's output to the monitor line by line until it exits."""
+        for line in process.stdout:
+            monitor.feed(line)
+        process.stdout.close()
+
+
+class OnnxUpscaler(BaseUpscaler):
+    """
+    In-process Real-ESRGAN upscaler using ONNX Runtime on the CPU.
+    
+    Model weights are loaded once per worker process and stay resident, so
+    only the first request for a model pays the load cost. Runs anywhere
+    ONNX Runtime does, including Linux hosts without a Vulkan GPU.
+    
+    Expects exported Real-ESRGAN weights at ``<models_dir>/onnx/<model>.onnx``
+    (``<model>-x<scale>.onnx`` for models with several native scales)
+    taking a float32 RGB NCHW tensor in [0, 1] and returning the upscaled
+    tensor in the same layout.
+    """
+    
+    ENGINE = "onnx"
+    
+    # Loaded sessions shared by every instance in this process, keyed by weights path
+    _sessions: Dict[str, object] = {}
+    _sessions_lock = threading.Lock()
+    
+    def __init__(self, models_dir: Optional[str] = None, num_threads: Optional[int] = None):
         """
-        Upscale an image file.
+        Initialize the upscaler.
         
         Args:
-            input_path: Path to input image
-            output_path: Path for output image
-            scale: Scale factor (4)
-            model: Model name to use
-            progress_callback: Optional callback for progress updates (progress, message)
-            
-        Returns:
-            Path to the output file
+            models_dir: Directory holding the ``onnx/`` weights folder (auto-created if None)
+            num_threads: ONNX Runtime intra-op threads (UPSCALER_ONNX_THREADS, default: runtime's choice)
         """
-        if not os.path.exists(input_path):
-            raise FileNotFoundError(f"Input file not found: {input_path}")
+        super().__init__(models_dir)
         
-        if model not in self.MODELS:
-            raise ValueError(f"Unknown model: {model}. Available: {list(self.MODELS.keys())}")
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError:
+            raise RuntimeError("The onnx engine requires onnxruntime: pip install onnxruntime")
         
-        if scale != 4:
-            raise ValueError(f"Scale must be 4. Got: {scale}")
+        if num_threads is None:
+            num_threads = int(os.environ.get("UPSCALER_ONNX_THREADS", "0"))
+        self.num_threads = num_threads
+        self.weights_dir = self.models_dir / "onnx"
+    
+    def _get_session(self, model: str):
+        """Return the resident inference session for a model, loading it on first use."""
+        weights_path = self.weights_dir / f"{model}.onnx"
+        key = str(weights_path)
         
-        try:
-            # Direct upscale (2x or 4x)
-            if progress_callback:
-                progress_callback(0.1, f"Applying {scale}x upscaling...")
-            
-            self._run_upscale(input_path, output_path, model, scale)
-            
+        session = self._sessions.get(key)
+        if session is not None:
+            return session
+        
+        with self._sessions_lock:
+            session = self._sessions.get(key)
+            if session is None:
+                if not weights_path.exists():
+                    raise FileNotFoundError(
+                        f"ONNX weights for {model} not found at {weights_path}"
+                    )
+                
+                import onnxruntime as ort
+                
+                options = ort.SessionOptions()
+                options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                if self.num_threads > 0:
+                    options.intra_op_num_threads = self.num_threads
+                
+                print(f"[Upscaler] Loading {model} into memory...")
+                session = ort.InferenceSession(
+                    key,
+                    sess_options=options,
+                    providers=["CPUExecutionProvider"],
+                )
+                self._sessions[key] = session
+        
+        return session
+    
+    def _infer(self, image: np.ndarray, model: str, scale: int) -> np.ndarray:
+        """
+        Upscale a BGR/BGRA/grayscale uint8 array in memory.
+        
+        Alpha is upscaled with bicubic interpolation, as the network only
+        handles color.
+        """
+        if len(self.MODELS[model]["scales"]) > 1:
+            session = self._get_session(f"{model}-x{scale}")
+        else:
+            session = self._get_session(model)
+        
+        alpha = None
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        elif image.shape[2] == 4:
+            alpha = image[:, :, 3]
+            image = image[:, :, :3]
+        
+        # HWC BGR uint8 -> NCHW RGB float32 in [0, 1]
+        tensor = image[:, :, ::-1].transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+        
+        input_name = session.get_inputs()[0].name
+        output = session.run(None, {input_name: tensor})[0]
+        
+        # NCHW RGB float32 -> HWC BGR uint8
+        output = np.clip(output[0], 0.0, 1.0).transpose(1, 2, 0)[:, :, ::-1]
+        output = np.ascontiguousarray((output * 255.0).round().astype(np.uint8))
+        
+        if alpha is not None:
+            alpha = cv2.resize(
+                alpha,
+                (output.shape[1], output.shape[0]),
+                interpolation=cv2.INTER_CUBIC,
+            )
+            output = np.dstack([output, alpha])
+        
+        return output
+    
+    def _upscale_arrays(
+        self,
+        images: List[np.ndarray],
+        model: str,
+        scale: int,
+        progress_callback: Optional[Callable[[float, str], None]] = None,
+        cancel: Optional[CancelToken] = None,
+    ) -> Iterator[np.ndarray]:
+        """Upscale arrays in memory, without staging files."""
+        for index, image in enumerate(images):
+            if cancel:
+                cancel.check()
+            start = time.perf_counter()
+            output = self._infer(image, model, scale)
+            self._observe_pass(model, scale, image.shape[0] * image.shape[1] / 1_000_000, time.perf_counter() - start)
             if progress_callback:
-                progress_callback(1.0, "Complete!")
-            
-            return output_path
-            
-        except subprocess.TimeoutExpired:
-            raise RuntimeError("Upscaling timed out")
+                progress_callback((index + 1) / len(images), f"Upscaled {index + 1}/{len(images)}")
+            yield output
     
-    def upscale_image(
+    def _upscale_file(self, input_path: str, output_path: str, model: str, scale: int) -> None:
+        """Upscale a single image file."""
+        image = cv2.imread(str(input_path), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise RuntimeError(f"Upscaling failed: could not decode {input_path}")
+        
+        output = self._infer(image, model, scale)
+        if not cv2.imwrite(str(output_path), output):
+            raise RuntimeError(f"Upscaling failed: could not write {output_path}")
+    
+    def _run_pass(
         self,
-        image: np.ndarray,
-        scale: int = 4,
-        model: str = "realesrgan-x4plus",
+        input_path: str,
+        output_path: str,
+        model: str,
+        scale: int,
+        output_format: Optional[str] = None,
         progress_callback: Optional[Callable[[float, str], None]] = None,
-    ) -> np.ndarray:
+        cancel: Optional[CancelToken] = None,
+    ) -> None:
         """
-        Upscale an image array.
+        Run a single upscale pass in-process.
         
-        Args:
-            image: Input image as numpy array (RGB format)
-            scale: Scale factor (2, 4, or 8)
-            model: Model name to use
-            progress_callback: Optional callback for progress updates
-            
-        Returns:
-            Upscaled image as numpy array (RGB format)
+        Inference cannot be interrupted mid-image, so cancellation takes
+        effect between images.
         """
-        # Create temporary files
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as input_file:
-            input_path = input_file.name
-        
-        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as output_file:
-            output_path = output_file.name
+        if cancel:
+            cancel.check()
+        if not os.path.isdir(input_path):
+            self._upscale_file(input_path, output_path, model, scale)
+            return
         
-        try:
-            # Save input image
-            pil_image = Image.fromarray(image)
-            pil_image.save(input_path, format="PNG")
-            
-            # Upscale
-            self.upscale(
-                input_path=input_path,
-                output_path=output_path,
-                scale=scale,
-                model=model,
-                progress_callback=progress_callback,
-            )
-            
-        finally:
-            # Clean up temp files
-            for path in [input_path, output_path]:
-                if os.path.exists(path):
-                    os.unlink(path)
+        # Same directory semantics as the ncnn binary: keep going past bad files
+        extension = output_format or "png"
+        entries = [
+            entry for entry in sorted(Path(input_path).iterdir())
+            if entry.suffix.lower() in self.IMAGE_EXTENSIONS
+        ]
+        for index, entry in enumerate(entries):
+            if cancel:
+                cancel.check()
+            if progress_callback and index:
+                progress_callback(index / len(entries), f"Upscaling image {index + 1}/{len(entries)}...")
+            try:
+                self._upscale_file(
+                    str(entry),
+                    str(Path(output_path) / f"{entry.stem}.{extension}"),
+                    model,
+                    scale,
+                )
+            except RuntimeError as e:
+                print(f"[Upscaler] {e}")
 
 
-def create_upscaler() -> RealESRGANUpscaler:
+def create_upscaler(engine: Optional[str] = None) -> BaseUpscaler:
     """
     Factory function to create an upscaler instance.
     
+    Args:
+        engine: Inference engine to use ("ncnn" or "onnx"). Defaults to the
+            UPSCALER_ENGINE environment variable, falling back to "ncnn".
+    
     Returns:
-        Configured RealESRGANUpscaler instance
+        Configured upscaler instance for the selected engine
     """
-    return RealESRGANUpscaler()
+    if engine is None:
+        engine = os.environ.get("UPSCALER_ENGINE", RealESRGANUpscaler.ENGINE)
+    engine = engine.strip().lower()
+    
+    if engine == RealESRGANUpscaler.ENGINE:
+        return RealESRGANUpscaler()
+    
+    if engine == OnnxUpscaler.ENGINE:
+        return OnnxUpscaler()
+    
+    raise ValueError(
+        f"Unknown engine: {engine}. Available: {[RealESRGANUpscaler.ENGINE, OnnxUpscaler.ENGINE]}"
+    )
@@ -0,0 +1,271 @@
+"""
+Cluster Worker
+Runs upscale passes for a coordinator (an API node started with
+UPSCALER_ENGINE=cluster): registers, long-polls for tasks, runs them on the
+local engine, uploads the results and heartbeats while it is alive.
+
+Usage (from the repository root):
+    python -m backend.worker --coordinator http://api-host:8000
+    python -m backend.worker --coordinator http://127.0.0.1:8000 --capacity 2 --name gpu-a
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import requests
+
+from backend.cluster import pack, unpack
+from backend.upscaler import BaseUpscaler, CancelToken, UpscaleCancelled, _make_staging_dir, create_upscaler
+
+
+class Worker:
+    """
+    Pulls tasks from a coordinator and runs up to ``capacity`` at a time.
+
+    Each slot is a thread that long-polls the coordinator. If the
+    coordinator forgets the worker (it restarted, or heartbeats were
+    missed), the worker registers again under a new id.
+    """
+
+    def __init__(
+        self,
+        coordinator_url: str,
+        upscaler: BaseUpscaler,
+        capacity: int = 1,
+        name: Optional[str] = None,
+        token: Optional[str] = None,
+        poll_seconds: float = 20,
+        heartbeat_interval: Optional[float] = None,
+    ):
+        """
+        Initialize the worker.
+
+        Args:
+            coordinator_url: Base URL of the API node
+            upscaler: Local engine that runs the passes
+            capacity: Tasks run at the same time
+            name: Shown in the coordinator's worker list (default: host name and pid)
+            token: Shared secret sent as X-Cluster-Token
+            poll_seconds: How long each claim request waits for work
+            heartbeat_interval: Seconds between heartbeats (default: what the coordinator asks for)
+        """
+        self.coordinator_url = coordinator_url.rstrip("/")
+        self.upscaler = upscaler
+        self.capacity = max(1, capacity)
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_seconds = poll_seconds
+        self.heartbeat_interval = heartbeat_interval
+
+        self.worker_id: Optional[str] = None
+        self._session = requests.Session()
+        if token:
+            self._session.headers["X-Cluster-Token"] = token
+        # Cancel tokens of the tasks running now, by task id
+        self._running: Dict[str, CancelToken] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run(self) -> None:
+        """Work until ``stop`` is called, then deregister."""
+        self._register()
+        threads = [threading.Thread(target=self._heartbeat_loop, name="heartbeat", daemon=True)]
+        threads += [
+            threading.Thread(target=self._slot_loop, name=f"slot-{index}", daemon=True)
+            for index in range(self.capacity)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self._stop.wait(0.5):
+                pass
+        finally:
+            with self._lock:
+                for token in self._running.values():
+                    token.cancel("Worker shutting down")
+            for thread in threads[1:]:
+                thread.join(timeout=self.poll_seconds + 5)
+            try:
+                self._request("DELETE", f"/cluster/workers/{self.worker_id}", timeout=5)
+            except requests.RequestException:
+                pass
+            print(f"[Worker] {self.name} stopped")
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", 30)
+        return self._session.request(method, f"{self.coordinator_url}{path}", **kwargs)
+
+    def _register(self) -> None:
+        """Register with the coordinator, retrying until it answers."""
+        while not self._stop.is_set():
+            try:
+                response = self._request("POST", "/cluster/workers", data={
+                    "name": self.name,
+                    "capacity": self.capacity,
+                    "engine": self.upscaler.ENGINE,
+                })
+                response.raise_for_status()
+            except requests.RequestException as e:
+                print(f"[Worker] Could not register with {self.coordinator_url}: {e}", file=sys.stderr)
+                self._stop.wait(2)
+                continue
+            registration = response.json()
+            with self._lock:
+                self.worker_id = registration["id"]
+            if self.heartbeat_interval is None:
+                self.heartbeat_interval = registration["heartbeat_interval"]
+            print(f"[Worker] {self.name} registered as {self.worker_id} ({self.capacity} slots)")
+            return
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                response = self._request("POST", f"/cluster/workers/{self.worker_id}/heartbeat", timeout=10)
+                if response.status_code == 404:
+                    self._register()
+                    continue
+                response.raise_for_status()
+            except requests.RequestException as e:
+                print(f"[Worker] Heartbeat failed: {e}", file=sys.stderr)
+                continue
+            with self._lock:
+                for task_id in response.json()["cancelled"]:
+                    if task_id in self._running:
+                        self._running[task_id].cancel("Cancelled by coordinator")
+
+    def _slot_loop(self) -> None:
+        while not self._stop.is_set():
+            worker_id = self.worker_id
+            try:
+                response = self._request(
+                    "POST",
+                    f"/cluster/workers/{worker_id}/claim",
+                    data={"wait": self.poll_seconds},
+                    timeout=self.poll_seconds + 30,
+                )
+            except requests.RequestException as e:
+                print(f"[Worker] Claim failed: {e}", file=sys.stderr)
+                self._stop.wait(2)
+                continue
+            if response.status_code == 204:
+                continue
+            if response.status_code == 404:
+                # Forgotten by the coordinator; the heartbeat thread registers again
+                self._stop.wait(1)
+                continue
+            if not response.ok:
+                print(f"[Worker] Claim failed: {response.status_code} {response.text}", file=sys.stderr)
+                self._stop.wait(2)
+                continue
+            self._process(worker_id, response.json())
+
+    def _process(self, worker_id: str, task: dict) -> None:
+        """Download, run and upload one task."""
+        task_id = task["id"]
+        params = {"worker_id": worker_id}
+        token = CancelToken()
+        with self._lock:
+            self._running[task_id] = token
+        staging_dir = _make_staging_dir("worker_")
+        last_report = [0.0]
+
+        def on_progress(progress: float, message: str) -> None:
+            now = time.monotonic()
+            if now - last_report[0] < 0.5:
+                return
+            last_report[0] = now
+            try:
+                response = self._request(
+                    "POST",
+                    f"/cluster/tasks/{task_id}/progress",
+                    data={**params, "progress": progress, "message": message},
+                    timeout=5,
+                )
+                if response.ok and not response.json()["wanted"]:
+                    token.cancel("Task was withdrawn")
+            except requests.RequestException:
+                pass
+
+        try:
+            archive_path = staging_dir / "input.zip"
+            with self._request("GET", f"/cluster/tasks/{task_id}/input", params=params, stream=True) as response:
+                response.raise_for_status()
+                with open(archive_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+            inputs: List[Path] = unpack(str(archive_path), str(staging_dir / "in"))
+            out_dir = staging_dir / "out"
+            out_dir.mkdir()
+
+            if task["output_name"]:
+                input_path, output_path = inputs[0], out_dir / task["output_name"]
+            else:
+                input_path, output_path = staging_dir / "in", out_dir
+            start = time.perf_counter()
+            self.upscaler._run_upscale(
+                str(input_path),
+                str(output_path),
+                task["model"],
+                task["scale"],
+                task["output_format"],
+                on_progress,
+                token,
+            )
+
+            result_path = staging_dir / "result.zip"
+            pack(str(out_dir), str(result_path))
+            with open(result_path, "rb") as f:
+                response = self._request("PUT", f"/cluster/tasks/{task_id}/result", params=params, data=f, timeout=300)
+            if response.status_code == 409:
+                print(f"[Worker] Result of {task_id} was no longer wanted")
+            else:
+                response.raise_for_status()
+                print(f"[Worker] Finished {task_id} ({task['megapixels']:.2f} MP in {time.perf_counter() - start:.2f}s)")
+        except UpscaleCancelled as e:
+            print(f"[Worker] Stopped {task_id}: {e}")
+        except Exception as e:
+            print(f"[Worker] Task {task_id} failed: {e}", file=sys.stderr)
+            try:
+                self._request("POST", f"/cluster/tasks/{task_id}/failure", data={**params, "error": str(e)}, timeout=10)
+            except requests.RequestException:
+                pass
+        finally:
+            with self._lock:
+                self._running.pop(task_id, None)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run upscale passes for a cluster coordinator")
+    parser.add_argument("--coordinator", default=os.environ.get("UPSCALER_COORDINATOR_URL"), help="Base URL of the API node (UPSCALER_COORDINATOR_URL)")
+    parser.add_argument("--capacity", type=int, default=1, help="Tasks run at the same time")
+    parser.add_argument("--name", default=None, help="Name shown by GET /cluster/workers (default: host-pid)")
+    parser.add_argument("--engine", default=None, help="Local engine: ncnn or onnx (default: UPSCALER_ENGINE or ncnn)")
+    parser.add_argument("--token", default=os.environ.get("UPSCALER_CLUSTER_TOKEN"), help="Shared secret (UPSCALER_CLUSTER_TOKEN)")
+    args = parser.parse_args(argv)
+    if not args.coordinator:
+        parser.error("--coordinator is required")
+
+    engine = args.engine or os.environ.get("UPSCALER_ENGINE") or "ncnn"
+    if engine.strip().lower() == "cluster":
+        parser.error("A worker needs a local engine (ncnn or onnx), not cluster")
+    worker = Worker(args.coordinator, create_upscaler(engine), capacity=args.capacity, name=args.name, token=args.token)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stop())
+    worker.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
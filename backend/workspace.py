@@ -0,0 +1,212 @@
+"""
+Request Workspaces
+Gives every request its own collision-free scratch directory and keeps the
+scratch area bounded: directories are deleted when their request is done,
+and a background sweeper removes anything past its TTL or over the disk quota.
+"""
+
+import asyncio
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
+from backend.locks import FileLock
+
+
+PROCESS_PREFIX = "proc-"
+
+
+class Workspace:
+    """
+    Manager for per-request scratch directories under a common root.
+
+    Directories handed out by ``create`` are *active* until ``release`` or
+    ``remove`` is called; the sweeper never touches active directories.
+
+    Every process works in its own subdirectory of ``base``, named after
+    its host and pid and guarded by a lock file it holds while alive, so
+    several workers (or replicas on shared storage) can share one root.
+    A process only sweeps its own entries, plus the subdirectories of
+    processes whose lock is no longer held.
+    """
+
+    def __init__(self, root: str, ttl: float = 7200, max_bytes: int = 0):
+        """
+        Initialize this process's workspace.
+
+        Args:
+            root: Directory shared by all processes' workspaces (auto-created)
+            ttl: Seconds after which inactive entries are swept
+            max_bytes: Disk quota for the whole shared root; 0 disables the quota
+        """
+        self.base = Path(root)
+        name = f"{PROCESS_PREFIX}{socket.gethostname()}-{os.getpid()}"
+        self.root = self.base / name
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._owner = FileLock(self.base / f"{name}.lock")
+        self._owner.acquire()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self._active: Set[Path] = set()
+        self._lock = threading.Lock()
+
+    def create(self, prefix: str = "req") -> Path:
+        """Create a new, unique scratch directory and mark it active."""
+        path = self.root / f"{prefix}_{uuid.uuid4().hex}"
+        path.mkdir()
+        with self._lock:
+            self._active.add(path)
+        return path
+
+    def release(self, path: Path) -> None:
+        """Mark a directory inactive; it stays on disk until swept."""
+        with self._lock:
+            self._active.discard(Path(path))
+        # Sweeping is based on mtime, so count the TTL from now
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def remove(self, path: Path) -> None:
+        """Delete a directory immediately."""
+        path = Path(path)
+        with self._lock:
+            self._active.discard(path)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def usage(self) -> Dict[str, int]:
+        """Entry count, active count and total bytes under the root."""
+        entries = self._scan()
+        with self._lock:
+            active = len(self._active)
+        return {
+            "entries": len(entries),
+            "active": active,
+            "bytes": sum(size for _, _, size in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+    def sweep(self) -> int:
+        """
+        Delete the workspaces of dead processes, then inactive entries past
+        their TTL, then the oldest inactive entries until the shared root
+        fits the quota.
+
+        Returns:
+            Number of entries removed
+        """
+        removed = self._sweep_orphans()
+        entries = self._scan()
+        with self._lock:
+            active = set(self._active)
+
+        now = time.time()
+        # Other live processes count against the quota, but only they sweep their entries
+        total = sum(size for _, _, size in entries) + self._foreign_bytes()
+
+        # Oldest first, so quota eviction drops the stalest entries
+        for mtime, path, size in sorted(entries, key=lambda entry: entry[0]):
+            if path in active:
+                continue
+            expired = now - mtime > self.ttl
+            over_quota = self.max_bytes > 0 and total > self.max_bytes
+            if not (expired or over_quota):
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+
+        return removed
+
+    async def run_sweeper(self, interval: float = 60) -> None:
+        """Sweep periodically until cancelled."""
+        while True:
+            try:
+                await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print(f"[Workspace] Sweep failed: {e}")
+            await asyncio.sleep(interval)
+
+    def close(self) -> None:
+        """Delete this process's workspace and give up its lock (on shutdown)."""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._owner.path.unlink(missing_ok=True)
+        self._owner.release()
+
+    def _sweep_orphans(self) -> int:
+        """Remove other processes' workspaces once their owner has exited."""
+        removed = 0
+        now = time.time()
+        for path in self.base.iterdir():
+            if path == self.root or path.name.endswith(".lock"):
+                continue
+            if not path.name.startswith(PROCESS_PREFIX):
+                # Left over from the single-process layout
+                try:
+                    expired = now - path.stat().st_mtime > self.ttl
+                except FileNotFoundError:
+                    continue
+                if not expired:
+                    continue
+                if path.is_dir():
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    path.unlink(missing_ok=True)
+                removed += 1
+                continue
+            owner = FileLock(self.base / f"{path.name}.lock")
+            if not owner.acquire(blocking=False):
+                continue
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+                owner.path.unlink(missing_ok=True)
+            finally:
+                owner.release()
+            removed += 1
+        return removed
+
+    def _foreign_bytes(self) -> int:
+        """Bytes under the shared root that belong to other processes."""
+        total = 0
+        for path in self.base.iterdir():
+            if path == self.root or path.name.endswith(".lock"):
+                continue
+            try:
+                total += _disk_usage(path)
+            except FileNotFoundError:
+                continue
+        return total
+
+    def _scan(self) -> List[Tuple[float, Path, int]]:
+        """List top-level entries as (mtime, path, size in bytes)."""
+        entries = []
+        for path in self.root.iterdir():
+            try:
+                entries.append((path.stat().st_mtime, path, _disk_usage(path)))
+            except FileNotFoundError:
+                continue
+        return entries
+
+
+def _disk_usage(path: Path) -> int:
+    """Total size of a file or directory tree."""
+    if not path.is_dir():
+        return path.stat().st_size
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                continue
+    return total
@@ -0,0 +1,459 @@
+"""
+Upscaler Benchmarks
+Measures single-image latency across input sizes, API throughput versus client
+concurrency, and staging/encoding overhead, using the fake Real-ESRGAN binary
+so runs are reproducible on machines without a GPU. Results are written as
+JSON and can be compared run-to-run.
+
+Usage (from the repository root):
+    python -m benchmarks.bench --output results.json
+    python -m benchmarks.bench --suites latency --sizes 256,512 --repeat 5
+    python -m benchmarks.bench --compare baseline.json results.json --threshold 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import requests
+
+from backend import config, memory
+from backend.encoding import EncodeOptions, encode_image
+from backend.upscaler import RealESRGANUpscaler, _make_staging_dir
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FAKE_BINARY = Path(__file__).resolve().parent / "fake_realesrgan.py"
+
+SUITES = ("latency", "throughput", "overhead")
+DEFAULT_SIZES = "256,512,1024,1920x1080,3840x2160"
+ENCODE_FORMATS = ("png", "jpg", "webp")
+MODEL = "realesrgan-x4plus"
+SCALE = 4
+
+
+def parse_size(text: str) -> Tuple[int, int]:
+    """Parse ``512`` or ``1920x1080`` into (width, height)."""
+    width, _, height = text.strip().lower().partition("x")
+    return int(width), int(height or width)
+
+
+def make_image(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Deterministic BGR test image: smooth gradients with a little texture."""
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    blue = 127 + 127 * np.sin(x / 37.0)
+    green = 255 * x / max(1, width - 1)
+    red = 255 * y / max(1, height - 1)
+    image = np.stack([blue, green, red], axis=-1) + rng.normal(0, 6, (height, width, 3))
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+
+def install_fake_binary(models_dir: Path) -> Path:
+    """Put a ``realesrgan-ncnn-vulkan`` wrapper around the fake engine in ``models_dir``."""
+    models_dir.mkdir(parents=True, exist_ok=True)
+    binary = models_dir / "realesrgan-ncnn-vulkan"
+    binary.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_BINARY}" "$@"\n')
+    binary.chmod(0o755)
+    return binary
+
+
+def summarize(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Distribution of a list of durations in seconds."""
+    if not samples:
+        return {"runs": 0, "min": None, "median": None, "mean": None, "p95": None, "max": None}
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))],
+        "max": ordered[-1],
+    }
+
+
+def _rusage_mb(who: int) -> float:
+    """Peak RSS from getrusage in MB (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _process_peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak RSS of another process in MB, where /proc is available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def bench_latency(upscaler: RealESRGANUpscaler, sizes: List[Tuple[int, int]], repeat: int, workdir: Path) -> List[dict]:
+    """Wall time of ``upscaler.upscale`` for one image at each size."""
+    results = []
+    for width, height in sizes:
+        input_path = workdir / f"latency_{width}x{height}.png"
+        output_path = workdir / "latency_output.png"
+        cv2.imwrite(str(input_path), make_image(width, height))
+        # Same tiling rule as the API, so latencies match what clients see
+        plan = upscaler.plan_scale(width, height, MODEL, SCALE)
+        tile_size = memory.tile_size_for(plan, "RGB", upscaler.ENGINE, config.MEMORY_BUDGET_BYTES)
+
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            upscaler.upscale(
+                str(input_path),
+                str(output_path),
+                scale=SCALE,
+                model=MODEL,
+                tile_size=tile_size,
+                tile_overlap=config.TILE_OVERLAP,
+            )
+            samples.append(time.perf_counter() - start)
+            output_path.unlink()
+        input_path.unlink()
+
+        results.append({
+            "size": f"{width}x{height}",
+            "megapixels": width * height / 1_000_000,
+            "tiled": tile_size is not None,
+            "seconds": summarize(samples),
+        })
+        print(f"[Bench] latency {width}x{height}: median {results[-1]['seconds']['median']:.3f}s", file=sys.stderr)
+    return results
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _stage_means(metrics_text: str) -> Dict[str, float]:
+    """Mean seconds per pipeline stage from the server's /metrics output."""
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for line in metrics_text.splitlines():
+        if not line.startswith("upscaler_stage_seconds_"):
+            continue
+        name, _, value = line.rpartition(" ")
+        stage = name.split('stage="', 1)[1].split('"', 1)[0]
+        if name.startswith("upscaler_stage_seconds_sum"):
+            sums[stage] = sums.get(stage, 0.0) + float(value)
+        elif name.startswith("upscaler_stage_seconds_count"):
+            counts[stage] = counts.get(stage, 0.0) + float(value)
+    return {stage: sums[stage] / counts[stage] for stage in sums if counts.get(stage)}
+
+
+def bench_throughput(
+    models_dir: Path,
+    workdir: Path,
+    size: Tuple[int, int],
+    levels: List[int],
+    requests_per_level: int,
+    server_workers: int,
+) -> Tuple[List[dict], Dict[str, float], Optional[float]]:
+    """
+    Requests per second through POST /upscale at each client concurrency.
+
+    Runs the FastAPI app under uvicorn in a subprocess with the result cache
+    disabled, so every request runs inference.
+
+    Returns:
+        Per-level results, mean seconds per pipeline stage, and server peak RSS in MB
+    """
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")])),
+        "UPSCALER_ENGINE": "ncnn",
+        "UPSCALER_MODELS_DIR": str(models_dir),
+        "UPSCALER_CACHE_DIR": str(workdir / "result_cache"),
+        "UPSCALER_CACHE_MAX_BYTES": "0",
+        "UPSCALER_MAX_CONCURRENT_JOBS": str(server_workers),
+        "UPSCALER_MAX_QUEUED_JOBS": str(max(levels) * 2),
+        # Every benchmark request comes from the same address
+        "UPSCALER_MAX_JOBS_PER_CLIENT": "0",
+        "UPSCALER_MAX_QUEUED_PER_CLIENT": "0",
+    })
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=str(workdir),
+        env=env,
+    )
+
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                requests.get(f"{base_url}/", timeout=1).raise_for_status()
+                break
+            except requests.RequestException:
+                if server.poll() is not None or time.time() > deadline:
+                    raise RuntimeError("Benchmark server did not start")
+                time.sleep(0.2)
+
+        _, payload = cv2.imencode(".png", make_image(*size))
+        payload = payload.tobytes()
+
+        def send(_) -> Tuple[int, float]:
+            start = time.perf_counter()
+            response = requests.post(
+                f"{base_url}/upscale",
+                files={"file": ("bench.png", payload, "image/png")},
+                data={"model": MODEL},
+                timeout=600,
+            )
+            return response.status_code, time.perf_counter() - start
+
+        results = []
+        for level in levels:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                outcomes = list(pool.map(send, range(requests_per_level)))
+            wall = time.perf_counter() - start
+
+            latencies = [seconds for status, seconds in outcomes if status == 200]
+            results.append({
+                "concurrency": level,
+                "requests": requests_per_level,
+                "succeeded": len(latencies),
+                "rejected": sum(1 for status, _ in outcomes if status == 503),
+                "failed": sum(1 for status, _ in outcomes if status not in (200, 503)),
+                "wall_seconds": wall,
+                "throughput_rps": len(latencies) / wall if wall > 0 else 0.0,
+                "seconds": summarize(latencies),
+            })
+            print(f"[Bench] throughput c={level}: {results[-1]['throughput_rps']:.2f} req/s", file=sys.stderr)
+
+        stages = _stage_means(requests.get(f"{base_url}/metrics", timeout=10).text)
+        peak_rss = _process_peak_rss_mb(server.pid)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    return results, stages, peak_rss
+
+
+def bench_overhead(sizes: List[Tuple[int, int]], repeat: int, workdir: Path) -> List[dict]:
+    """
+    Cost of the steps around inference for an upscaled output at each size:
+    staging the lossless intermediate on disk and encoding each output format.
+    """
+    staging_dir = _make_staging_dir("bench_")
+    results = []
+    try:
+        for width, height in sizes:
+            output = cv2.resize(make_image(width, height), (width * SCALE, height * SCALE), interpolation=cv2.INTER_CUBIC)
+            raw_path = staging_dir / "raw.png"
+
+            writes, reads = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                cv2.imwrite(str(raw_path), output, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+                writes.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                cv2.imread(str(raw_path), cv2.IMREAD_UNCHANGED)
+                reads.append(time.perf_counter() - start)
+
+            encodes = {}
+            for fmt in ENCODE_FORMATS:
+                dest = workdir / f"encoded.{fmt}"
+                samples, size = [], 0
+                for _ in range(repeat):
+                    # An explicit level so PNG is really encoded, not passed through
+                    encoded = encode_image(str(raw_path), str(dest), EncodeOptions(format=fmt, png_compression=6))
+                    samples.append(encoded.seconds)
+                    size = encoded.size
+                dest.unlink()
+                encodes[fmt] = {"bytes": size, "seconds": summarize(samples)}
+
+            raw_path.unlink()
+            del output
+            results.append({
+                "size": f"{width}x{height}",
+                "output_megapixels": width * height * SCALE * SCALE / 1_000_000,
+                "staging_write": summarize(writes),
+                "staging_read": summarize(reads),
+                "encode": encodes,
+            })
+            print(f"[Bench] overhead {width}x{height}: staging write {results[-1]['staging_write']['median']:.3f}s", file=sys.stderr)
+    finally:
+        staging_dir.rmdir()
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=str(REPO_ROOT), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> dict:
+    """Run the selected suites and return the JSON-serializable report."""
+    os.environ["FAKE_REALESRGAN_DELAY"] = str(args.delay)
+    os.environ["FAKE_REALESRGAN_SECONDS_PER_MP"] = str(args.seconds_per_mp)
+
+    sizes = [parse_size(size) for size in args.sizes.split(",")]
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "settings": {
+                "suites": args.suites,
+                "sizes": args.sizes,
+                "repeat": args.repeat,
+                "delay": args.delay,
+                "seconds_per_mp": args.seconds_per_mp,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "throughput_size": args.throughput_size,
+                "server_workers": args.server_workers,
+            },
+        },
+        "results": {},
+        "peak_rss_mb": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="upscaler_bench_") as tmp:
+        workdir = Path(tmp)
+        models_dir = workdir / "bin"
+        install_fake_binary(models_dir)
+
+        if "latency" in args.suites:
+            upscaler = RealESRGANUpscaler(models_dir=str(models_dir))
+            report["results"]["latency"] = bench_latency(upscaler, sizes, args.repeat, workdir)
+
+        if "overhead" in args.suites:
+            report["results"]["overhead"] = bench_overhead(sizes, args.repeat, workdir)
+
+        if "throughput" in args.suites:
+            levels = [int(level) for level in args.concurrency.split(",")]
+            results, stages, server_rss = bench_throughput(
+                models_dir,
+                workdir,
+                parse_size(args.throughput_size),
+                levels,
+                args.requests,
+                args.server_workers,
+            )
+            report["results"]["throughput"] = results
+            report["results"]["stage_mean_seconds"] = stages
+            report["peak_rss_mb"]["server"] = server_rss
+
+    report["peak_rss_mb"]["benchmark"] = _rusage_mb(resource.RUSAGE_SELF)
+    # Largest finished child: a fake engine run, or the API server
+    report["peak_rss_mb"]["children"] = _rusage_mb(resource.RUSAGE_CHILDREN)
+    return report
+
+
+def flatten(report: dict) -> Dict[str, Tuple[float, bool]]:
+    """Comparable headline numbers as {name: (value, higher_is_better)}."""
+    results = report.get("results", {})
+    flat: Dict[str, Tuple[float, bool]] = {}
+    for entry in results.get("latency", []):
+        flat[f"latency/{entry['size']}/median_s"] = (entry["seconds"]["median"], False)
+    for entry in results.get("throughput", []):
+        flat[f"throughput/c{entry['concurrency']}/rps"] = (entry["throughput_rps"], True)
+        flat[f"throughput/c{entry['concurrency']}/p95_s"] = (entry["seconds"]["p95"], False)
+    for entry in results.get("overhead", []):
+        flat[f"overhead/{entry['size']}/staging_write_s"] = (entry["staging_write"]["median"], False)
+        flat[f"overhead/{entry['size']}/staging_read_s"] = (entry["staging_read"]["median"], False)
+        for fmt, encoded in entry["encode"].items():
+            flat[f"overhead/{entry['size']}/encode_{fmt}_s"] = (encoded["seconds"]["median"], False)
+    for name, value in report.get("peak_rss_mb", {}).items():
+        flat[f"peak_rss_mb/{name}"] = (value, False)
+    return {name: value for name, value in flat.items() if value[0] is not None}
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> int:
+    """
+    Print the change of every shared headline number.
+
+    Returns:
+        Number of regressions worse than ``threshold`` percent
+    """
+    old, new = flatten(baseline), flatten(current)
+    regressions = 0
+    print(f"{'metric':<44} {'baseline':>12} {'current':>12} {'change':>9}")
+    for name in sorted(set(old) & set(new)):
+        (before, higher_is_better), (after, _) = old[name], new[name]
+        change = (after - before) / before * 100 if before else 0.0
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > threshold:
+            regressions += 1
+            flag = "  REGRESSION"
+        print(f"{name:<44} {before:>12.4f} {after:>12.4f} {change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the upscaler against a fake Real-ESRGAN binary")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"Comma-separated subset of {', '.join(SUITES)}")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Input sizes for latency and overhead (e.g. 512,1920x1080)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size")
+    parser.add_argument("--delay", type=float, default=0.05, help="Fake engine seconds per invocation")
+    parser.add_argument("--seconds-per-mp", type=float, default=0.2, help="Fake engine seconds per input megapixel")
+    parser.add_argument("--concurrency", default="1,2,4,8", help="Client concurrency levels for the throughput suite")
+    parser.add_argument("--requests", type=int, default=16, help="Requests per concurrency level")
+    parser.add_argument("--throughput-size", default="512", help="Input size for the throughput suite")
+    parser.add_argument("--server-workers", type=int, default=2, help="UPSCALER_MAX_CONCURRENT_JOBS for the API server")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="Compare two JSON reports")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change counted as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        return 1 if compare(baseline, current, args.threshold) else 0
+
+    args.suites = [suite.strip() for suite in args.suites.split(",") if suite.strip()]
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f"Unknown suites: {sorted(unknown)}. Available: {list(SUITES)}")
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"[Bench] Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
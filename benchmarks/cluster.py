@@ -0,0 +1,160 @@
+"""
+Local Cluster Run
+Starts a coordinator and several workers on this machine, all using the fake
+Real-ESRGAN binary, sends upscale requests through the coordinator and
+reports how the work was spread. One worker can be made slower to check that
+placement follows throughput, and one can be killed mid-run to check that
+its tasks are re-queued.
+
+Usage (from the repository root):
+    python -m benchmarks.cluster
+    python -m benchmarks.cluster --workers 3 --requests 24 --slow-factor 4 --kill-after 2
+"""
+
+import argparse
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional
+
+import cv2
+import requests
+
+from benchmarks.bench import REPO_ROOT, _free_port, install_fake_binary, make_image, parse_size
+
+
+def _wait_until(check, timeout: float, what: str) -> None:
+    deadline = time.time() + timeout
+    while not check():
+        if time.time() > deadline:
+            raise RuntimeError(f"Timed out waiting for {what}")
+        time.sleep(0.2)
+
+
+def run(args: argparse.Namespace) -> dict:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    processes: List[subprocess.Popen] = []
+
+    with tempfile.TemporaryDirectory(prefix="upscaler_cluster_") as tmp:
+        workdir = Path(tmp)
+        models_dir = workdir / "bin"
+        install_fake_binary(models_dir)
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")])),
+            "UPSCALER_MODELS_DIR": str(models_dir),
+            "UPSCALER_CACHE_MAX_BYTES": "0",
+            "UPSCALER_WORKSPACE_DIR": str(workdir / "workspace"),
+            "FAKE_REALESRGAN_DELAY": str(args.delay),
+            "FAKE_REALESRGAN_SECONDS_PER_MP": "0",
+            # Read by the coordinator and, as --token's default, by the workers
+            "UPSCALER_CLUSTER_TOKEN": secrets.token_hex(16),
+        })
+
+        try:
+            coordinator_env = dict(env, **{
+                "UPSCALER_ENGINE": "cluster",
+                "UPSCALER_MAX_CONCURRENT_JOBS": str(args.workers * args.capacity),
+                "UPSCALER_MAX_QUEUED_JOBS": str(args.requests),
+                "UPSCALER_MAX_JOBS_PER_CLIENT": "0",
+                "UPSCALER_MAX_QUEUED_PER_CLIENT": "0",
+                "UPSCALER_CLUSTER_HEARTBEAT_TIMEOUT": "3",
+            })
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+                cwd=str(workdir),
+                env=coordinator_env,
+            ))
+            _wait_until(lambda: _online(base_url), 60, "the coordinator")
+
+            for index in range(args.workers):
+                worker_env = dict(env, UPSCALER_ENGINE="ncnn")
+                if index == args.workers - 1 and args.slow_factor > 1:
+                    worker_env["FAKE_REALESRGAN_DELAY"] = str(args.delay * args.slow_factor)
+                processes.append(subprocess.Popen(
+                    [sys.executable, "-m", "backend.worker", "--coordinator", base_url,
+                     "--capacity", str(args.capacity), "--name", f"worker-{index}"],
+                    cwd=str(REPO_ROOT),
+                    env=worker_env,
+                ))
+            _wait_until(lambda: len(_workers(base_url, env["UPSCALER_CLUSTER_TOKEN"])["workers"]) == args.workers, 60, "the workers")
+
+            _, payload = cv2.imencode(".png", make_image(*parse_size(args.size)))
+            payload = payload.tobytes()
+
+            def send(index: int) -> int:
+                response = requests.post(
+                    f"{base_url}/upscale",
+                    files={"file": (f"cluster_{index}.png", payload, "image/png")},
+                    timeout=600,
+                )
+                return response.status_code
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.workers * args.capacity * 2) as pool:
+                futures = [pool.submit(send, index) for index in range(args.requests)]
+                if args.kill_after is not None:
+                    time.sleep(args.kill_after)
+                    # The first worker disappears without deregistering
+                    processes[1].kill()
+                    print("[Cluster] Killed worker-0", file=sys.stderr)
+                statuses = [future.result() for future in futures]
+            wall = time.perf_counter() - start
+
+            return {
+                "requests": args.requests,
+                "succeeded": statuses.count(200),
+                "failed": len(statuses) - statuses.count(200),
+                "wall_seconds": wall,
+                "throughput_rps": statuses.count(200) / wall if wall > 0 else 0.0,
+                "workers": _workers(base_url, env["UPSCALER_CLUSTER_TOKEN"])["workers"],
+            }
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+
+def _online(base_url: str) -> bool:
+    try:
+        return requests.get(f"{base_url}/", timeout=1).ok
+    except requests.RequestException:
+        return False
+
+
+def _workers(base_url: str, token: str) -> dict:
+    try:
+        return requests.get(f"{base_url}/cluster/workers", headers={"X-Cluster-Token": token}, timeout=5).json()
+    except requests.RequestException:
+        return {"workers": []}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a coordinator and fake-engine workers locally")
+    parser.add_argument("--workers", type=int, default=3, help="Worker processes to start")
+    parser.add_argument("--capacity", type=int, default=1, help="Slots per worker")
+    parser.add_argument("--requests", type=int, default=12, help="Upscale requests to send")
+    parser.add_argument("--size", default="256", help="Input size of each request")
+    parser.add_argument("--delay", type=float, default=0.5, help="Fake engine seconds per pass")
+    parser.add_argument("--slow-factor", type=float, default=1.0, help="Make the last worker this many times slower")
+    parser.add_argument("--kill-after", type=float, default=None, help="Kill the first worker this many seconds in")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    return 0 if report["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Fake realesrgan-ncnn-vulkan
+Deterministic stand-in for the Real-ESRGAN binary so the upscaler can be
+exercised and benchmarked on machines without a Vulkan GPU. Accepts the same
+command line, resizes with bicubic interpolation and simulates inference time.
+
+Environment:
+    FAKE_REALESRGAN_DELAY: Fixed seconds per invocation (default 0)
+    FAKE_REALESRGAN_SECONDS_PER_MP: Extra seconds per input megapixel (default 0)
+    FAKE_REALESRGAN_FAIL: Exit with an error without writing output when set to 1
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-i", dest="input", required=True)
+    parser.add_argument("-o", dest="output", required=True)
+    parser.add_argument("-s", dest="scale", type=int, default=4)
+    parser.add_argument("-n", dest="model", default="realesr-animevideov3")
+    parser.add_argument("-f", dest="format", default=None)
+    # Accepted for compatibility, no effect on the output
+    parser.add_argument("-t", dest="tile_size", default="0")
+    parser.add_argument("-j", dest="threads", default="1:2:2")
+    parser.add_argument("-g", dest="gpu_id", default="auto")
+    parser.add_argument("-m", dest="model_path", default="models")
+    parser.add_argument("-x", dest="tta", action="store_true")
+    parser.add_argument("-v", dest="verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def _simulate(pixels: int) -> None:
+    """Sleep for the configured inference time, reporting progress like the real binary."""
+    delay = float(os.environ.get("FAKE_REALESRGAN_DELAY", "0"))
+    delay += float(os.environ.get("FAKE_REALESRGAN_SECONDS_PER_MP", "0")) * pixels / 1_000_000
+    steps = 4
+    for step in range(steps):
+        print(f"{step * 100 / steps:.2f}%", file=sys.stderr, flush=True)
+        time.sleep(delay / steps)
+    print("100.00%", file=sys.stderr, flush=True)
+
+
+def _upscale_file(input_path: str, output_path: str, scale: int) -> bool:
+    image = cv2.imread(input_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        print(f"decode image {input_path} failed", file=sys.stderr)
+        return False
+
+    height, width = image.shape[:2]
+    _simulate(height * width)
+    output = cv2.resize(image, (width * scale, height * scale), interpolation=cv2.INTER_CUBIC)
+    if not cv2.imwrite(output_path, output):
+        print(f"encode image {output_path} failed", file=sys.stderr)
+        return False
+    return True
+
+
+def main(argv=None) -> int:
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+
+    if os.environ.get("FAKE_REALESRGAN_FAIL") == "1":
+        print("vkCreateInstance failed -9", file=sys.stderr)
+        return 255
+
+    if not os.path.isdir(args.input):
+        return 0 if _upscale_file(args.input, args.output, args.scale) else 255
+
+    # Directory mode: keep going past bad files, like the real binary
+    extension = args.format or "png"
+    os.makedirs(args.output, exist_ok=True)
+    for name in sorted(os.listdir(args.input)):
+        if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        stem = os.path.splitext(name)[0]
+        _upscale_file(
+            os.path.join(args.input, name),
+            os.path.join(args.output, f"{stem}.{extension}"),
+            args.scale,
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,57 @@
-import { useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { Header } from './components/Header';
 import { UploadZone } from './components/UploadZone';
 import { SettingsPanel } from './components/SettingsPanel';
 import { LiquidButton } from './components/LiquidButton';
 import { ComparisonView } from './components/ComparisonView';
-import type { UpscaleState } from './types';
+import type { JobStatus, UpscaleResult, UpscaleState } from './types';
 import { AlertCircle } from 'lucide-react';
 import { motion, AnimatePresence } from 'framer-motion';
 
+const API_URL = 'http://localhost:8000';
+
+// Resolves once the job reaches a terminal state, reporting progress on the way
+const waitForJob = (jobId: string, onProgress: (job: JobStatus) => void): Promise<JobStatus> =>
+  new Promise((resolve, reject) => {
+    const events = new EventSource(`${API_URL}/jobs/${jobId}/events`);
+    const handle = (e: MessageEvent) => {
+      const job: JobStatus = JSON.parse(e.data);
+      onProgress(job);
+      if (job.status === 'completed' || job.status === 'failed' || job.status === 'cancelled') {
+        events.close();
+        resolve(job);
+      }
+    };
+    events.addEventListener('queued', handle);
+    events.addEventListener('running', handle);
+    events.addEventListener('completed', handle);
+    events.addEventListener('failed', handle);
+    events.addEventListener('cancelled', handle);
+    events.onerror = () => {
+      events.close();
+      reject(new Error('Lost connection to the upscale job'));
+    };
+  });
+
 function App() {
   const [file, setFile] = useState<File | null>(null);
   const [previewUrl, setPreviewUrl] = useState<string | null>(null);
-  const [processedUrl, setProcessedUrl] = useState<string | null>(null);
+  const [result, setResult] = useState<UpscaleResult | null>(null);
   const [status, setStatus] = useState<UpscaleState>('idle');
   const [error, setError] = useState<string | null>(null);
+  const [progress, setProgress] = useState<number>(0);
+  const activeJob = useRef<string | null>(null);
+
+  // Closing the tab cancels the running job so the server stops working on it
+  useEffect(() => {
+    const cancelActiveJob = () => {
+      if (activeJob.current) {
+        fetch(`${API_URL}/jobs/${activeJob.current}`, { method: 'DELETE', keepalive: true });
+      }
+    };
+    window.addEventListener('pagehide', cancelActiveJob);
+    return () => window.removeEventListener('pagehide', cancelActiveJob);
+  }, []);
 
   // Settings
   const [model, setModel] = useState('realesrgan-x4plus');
@@ -22,7 +60,7 @@ function App() {
   const handleFileSelect = (selectedFile: File) => {
     setFile(selectedFile);
     setPreviewUrl(URL.createObjectURL(selectedFile));
-    setProcessedUrl(null);
+    setResult(null);
     setStatus('idle');
     setError(null);
   };
@@ -32,6 +70,7 @@ function App() {
 
     setStatus('processing');
     setError(null);
+    setProgress(0);
 
     const formData = new FormData();
     formData.append('file', file);
@@ -42,7 +81,7 @@ function App() {
     try {
       // Note: In development, we need to proxy or use CORS. 
       // Backend is at http://localhost:8000
-      const response = await fetch('http://localhost:8000/upscale', {
+      const response = await fetch(`${API_URL}/jobs`, {
         method: 'POST',
         body: formData,
       });
@@ -52,9 +91,31 @@ function App() {
         throw new Error(JSON.parse(errText).detail || 'Upscaling failed');
       }
 
-      const blob = await response.blob();
-      const url = URL.createObjectURL(blob);
-      setProcessedUrl(url);
+      const submitted: JobStatus = await response.json();
+      activeJob.current = submitted.id;
+      const job = await waitForJob(submitted.id, (update) => setProgress(update.progress)).finally(() => {
+        activeJob.current = null;
+      });
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Upscaling failed');
+      }
+      if (job.status === 'cancelled') {
+        throw new Error('Upscaling was cancelled');
+      }
+
+      // The viewer loads only the visible tiles; the full file is fetched
+      // when the user downloads it
+      const tilesUrl = `${API_URL}/results/${job.id}/tiles`;
+      const layout = await fetch(tilesUrl);
+      if (!layout.ok) {
+        throw new Error('Could not load the upscaled image');
+      }
+
+      setResult({
+        downloadUrl: `${API_URL}/jobs/${job.id}/result`,
+        tilesUrl,
+        pyramid: await layout.json(),
+      });
       setStatus('completed');
     } catch (err: any) {
       console.error(err);
@@ -66,7 +127,7 @@ function App() {
   const handleReset = () => {
     setFile(null);
     setPreviewUrl(null);
-    setProcessedUrl(null);
+    setResult(null);
     setStatus('idle');
     setError(null);
   };
@@ -109,15 +170,17 @@ function App() {
 
                 {status !== 'completed' && (
                   <LiquidButton onClick={handleUpscale} isLoading={status === 'processing'}>
-                    {status === 'processing' ? 'Enhancing Image...' : 'Upscale Image 4x'}
+                    {status === 'processing'
+                      ? `Enhancing Image... ${Math.round(progress * 100)}%`
+                      : 'Upscale Image 4x'}
                   </LiquidButton>
                 )}
 
                 {status === 'completed' && (
                   <div className="flex gap-4">
-                    {processedUrl && (
+                    {result && (
                       <a
-                        href={processedUrl}
+                        href={result.downloadUrl}
                         download={`upscaled_${Date.now()}.${format}`}
                         className="bg-neon-cyan/20 border border-neon-cyan/50 text-neon-cyan hover:bg-neon-cyan hover:text-black transition-all px-6 py-3 rounded uppercase font-heading tracking-widest text-sm font-bold flex items-center gap-2"
                       >
@@ -135,8 +198,8 @@ function App() {
               </div>
 
               {/* Results View */}
-              {status === 'completed' && processedUrl && previewUrl ? (
-                <ComparisonView originalUrl={previewUrl} processedUrl={processedUrl} />
+              {status === 'completed' && result && previewUrl ? (
+                <ComparisonView originalUrl={previewUrl} pyramid={result.pyramid} tilesUrl={result.tilesUrl} />
               ) : (
                 // Just show preview if not done
                 <div className="border border-white/10 rounded-lg p-4 bg-obsidian-surface/50 flex justify-center">
@@ -1,12 +1,100 @@
-import React from 'react';
-import { ReactCompareSlider, ReactCompareSliderImage } from 'react-compare-slider';
+import React, { useCallback, useEffect, useRef, useState } from 'react';
+import { ReactCompareSlider } from 'react-compare-slider';
+import type { TilePyramid } from '../types';
+import { TileLayer, type Size, type Viewport } from './TileLayer';
 
 interface ComparisonViewProps {
     originalUrl: string;
-    processedUrl: string;
+    pyramid: TilePyramid;
+    tilesUrl: string;
 }
 
-export const ComparisonView: React.FC<ComparisonViewProps> = ({ originalUrl, processedUrl }) => {
+// Deepest zoom, in screen pixels per upscaled pixel
+const MAX_ZOOM = 4;
+
+const fitZoomFor = (pyramid: TilePyramid, size: Size): number =>
+    Math.min(size.width / pyramid.width, size.height / pyramid.height) || 1;
+
+// Centre the image on an axis where it is smaller than the view, otherwise keep the view inside it
+const clampView = (view: Viewport, pyramid: TilePyramid, size: Size): Viewport => {
+    const zoom = Math.min(MAX_ZOOM, Math.max(fitZoomFor(pyramid, size), view.zoom));
+    const clampAxis = (offset: number, extent: number, visible: number) =>
+        extent <= visible ? -(visible - extent) / 2 : Math.min(extent - visible, Math.max(0, offset));
+    return {
+        zoom,
+        x: clampAxis(view.x, pyramid.width, size.width / zoom),
+        y: clampAxis(view.y, pyramid.height, size.height / zoom),
+    };
+};
+
+export const ComparisonView: React.FC<ComparisonViewProps> = ({ originalUrl, pyramid, tilesUrl }) => {
+    const containerRef = useRef<HTMLDivElement>(null);
+    const dragFrom = useRef<{ x: number; y: number } | null>(null);
+    const [size, setSize] = useState<Size>({ width: 0, height: 0 });
+    const [view, setView] = useState<Viewport>({ zoom: 0, x: 0, y: 0 });
+
+    // Track the view size, refitting the image when it changes
+    useEffect(() => {
+        const container = containerRef.current;
+        if (!container) return;
+        const observer = new ResizeObserver(([entry]) => {
+            const next = { width: entry.contentRect.width, height: entry.contentRect.height };
+            setSize(next);
+            setView(clampView({ zoom: 0, x: 0, y: 0 }, pyramid, next));
+        });
+        observer.observe(container);
+        return () => observer.disconnect();
+    }, [pyramid]);
+
+    // Zoom around the cursor. Registered by hand because React's wheel listener is passive.
+    useEffect(() => {
+        const container = containerRef.current;
+        if (!container) return;
+        const onWheel = (e: WheelEvent) => {
+            e.preventDefault();
+            const bounds = container.getBoundingClientRect();
+            const cx = e.clientX - bounds.left;
+            const cy = e.clientY - bounds.top;
+            setView((current) => {
+                const zoom = current.zoom * Math.exp(-e.deltaY * 0.002);
+                return clampView({
+                    zoom,
+                    x: current.x + cx / current.zoom - cx / zoom,
+                    y: current.y + cy / current.zoom - cy / zoom,
+                }, pyramid, size);
+            });
+        };
+        container.addEventListener('wheel', onWheel, { passive: false });
+        return () => container.removeEventListener('wheel', onWheel);
+    }, [pyramid, size]);
+
+    const onPointerDown = useCallback((e: React.PointerEvent<HTMLDivElement>) => {
+        // The slider handle moves the divider, not the image
+        if ((e.target as HTMLElement).closest('[data-rcs="handle-container"]')) return;
+        dragFrom.current = { x: e.clientX, y: e.clientY };
+        e.currentTarget.setPointerCapture(e.pointerId);
+    }, []);
+
+    const onPointerMove = useCallback((e: React.PointerEvent<HTMLDivElement>) => {
+        const from = dragFrom.current;
+        if (!from) return;
+        const dx = e.clientX - from.x;
+        const dy = e.clientY - from.y;
+        dragFrom.current = { x: e.clientX, y: e.clientY };
+        setView((current) => clampView({
+            zoom: current.zoom,
+            x: current.x - dx / current.zoom,
+            y: current.y - dy / current.zoom,
+        }, pyramid, size));
+    }, [pyramid, size]);
+
+    const onPointerUp = useCallback(() => {
+        dragFrom.current = null;
+    }, []);
+
+    const fitZoom = fitZoomFor(pyramid, size);
+    const ready = size.width > 0 && view.zoom > 0;
+
     return (
         <div className="border border-white/10 rounded-3xl overflow-hidden shadow-[0_20px_50px_rgba(0,0,0,0.5)] mt-6 relative group">
             <div className="absolute top-4 left-4 z-10 bg-black/60 backdrop-blur-sm px-3 py-1 rounded text-xs font-heading font-bold uppercase tracking-wider text-white border border-white/10">
@@ -15,13 +103,49 @@ export const ComparisonView: React.FC<ComparisonViewProps> = ({ originalUrl, pro
             <div className="absolute top-4 right-4 z-10 bg-neon-cyan/80 backdrop-blur-sm px-3 py-1 rounded text-xs font-heading font-bold uppercase tracking-wider text-black">
                 Upscaled 4x
             </div>
+            {ready && (
+                <div className="absolute bottom-4 right-4 z-10 bg-black/60 backdrop-blur-sm px-3 py-1 rounded text-xs font-heading font-bold uppercase tracking-wider text-white border border-white/10 pointer-events-none">
+                    {Math.round(view.zoom * 100)}%
+                </div>
+            )}
 
-            <ReactCompareSlider
-                itemOne={<ReactCompareSliderImage src={originalUrl} alt="Original" />}
-                itemTwo={<ReactCompareSliderImage src={processedUrl} alt="Processed" />}
-                className="h-[600px] w-full bg-[#050510]"
-                style={{ objectFit: 'contain' }}
-            />
+            <div
+                ref={containerRef}
+                className="h-[600px] w-full bg-[#050510] cursor-grab active:cursor-grabbing touch-none"
+                onPointerDown={onPointerDown}
+                onPointerMove={onPointerMove}
+                onPointerUp={onPointerUp}
+                onPointerCancel={onPointerUp}
+                onDoubleClick={() => setView(clampView({ zoom: 0, x: 0, y: 0 }, pyramid, size))}
+            >
+                {ready && (
+                    <ReactCompareSlider
+                        onlyHandleDraggable
+                        className="h-full w-full"
+                        itemOne={
+                            <div className="relative h-full w-full overflow-hidden">
+                                <img
+                                    src={originalUrl}
+                                    alt="Original"
+                                    draggable={false}
+                                    className="absolute max-w-none select-none"
+                                    style={{
+                                        left: -view.x * view.zoom,
+                                        top: -view.y * view.zoom,
+                                        width: pyramid.width * view.zoom,
+                                        height: pyramid.height * view.zoom,
+                                    }}
+                                />
+                            </div>
+                        }
+                        itemTwo={
+                            <div className="relative h-full w-full">
+                                <TileLayer pyramid={pyramid} tilesUrl={tilesUrl} view={view} size={size} fitZoom={fitZoom} />
+                            </div>
+                        }
+                    />
+                )}
+            </div>
         </div>
     );
 };
@@ -0,0 +1,84 @@
+import React from 'react';
+import type { TilePyramid } from '../types';
+
+// What part of the image is on screen: `zoom` screen pixels per image pixel,
+// and (x, y) the image coordinate at the top-left corner of the view
+export interface Viewport {
+    zoom: number;
+    x: number;
+    y: number;
+}
+
+export interface Size {
+    width: number;
+    height: number;
+}
+
+interface TileLayerProps {
+    pyramid: TilePyramid;
+    tilesUrl: string;
+    view: Viewport;
+    size: Size;
+    fitZoom: number;
+}
+
+// Sharpest level needed at `zoom`: the first one with at least one tile pixel per device pixel
+const levelFor = (pyramid: TilePyramid, zoom: number): number => {
+    const wanted = pyramid.max_level + Math.ceil(Math.log2(zoom * window.devicePixelRatio));
+    return Math.min(pyramid.max_level, Math.max(0, wanted));
+};
+
+const visibleTiles = (pyramid: TilePyramid, tilesUrl: string, level: number, view: Viewport, size: Size) => {
+    const factor = 2 ** (pyramid.max_level - level);
+    const levelWidth = Math.ceil(pyramid.width / factor);
+    const levelHeight = Math.ceil(pyramid.height / factor);
+    // Level pixels per image pixel on each axis (levels round up)
+    const sx = levelWidth / pyramid.width;
+    const sy = levelHeight / pyramid.height;
+    const ts = pyramid.tile_size;
+
+    const left = Math.max(0, view.x) * sx;
+    const top = Math.max(0, view.y) * sy;
+    const right = Math.min(pyramid.width, view.x + size.width / view.zoom) * sx;
+    const bottom = Math.min(pyramid.height, view.y + size.height / view.zoom) * sy;
+
+    const tiles = [];
+    for (let row = Math.floor(top / ts); row < Math.ceil(bottom / ts); row++) {
+        for (let col = Math.floor(left / ts); col < Math.ceil(right / ts); col++) {
+            const x0 = Math.floor((col * ts / sx - view.x) * view.zoom);
+            const y0 = Math.floor((row * ts / sy - view.y) * view.zoom);
+            const x1 = Math.ceil((Math.min(levelWidth, (col + 1) * ts) / sx - view.x) * view.zoom);
+            const y1 = Math.ceil((Math.min(levelHeight, (row + 1) * ts) / sy - view.y) * view.zoom);
+            tiles.push({
+                key: `${level}/${col}_${row}`,
+                src: `${tilesUrl}/${level}/${col}_${row}`,
+                style: { left: x0, top: y0, width: x1 - x0, height: y1 - y0 },
+            });
+        }
+    }
+    return tiles;
+};
+
+// Draws only the tiles of a deep-zoom pyramid that are inside the view. The
+// level that fits the whole image is always drawn underneath, so zooming
+// shows a blurry image at once while the sharper tiles load.
+export const TileLayer: React.FC<TileLayerProps> = ({ pyramid, tilesUrl, view, size, fitZoom }) => {
+    const baseLevel = levelFor(pyramid, fitZoom);
+    const detailLevel = levelFor(pyramid, view.zoom);
+    const levels = detailLevel > baseLevel ? [baseLevel, detailLevel] : [baseLevel];
+
+    return (
+        <div className="absolute inset-0 overflow-hidden">
+            {levels.flatMap((level) => visibleTiles(pyramid, tilesUrl, level, view, size)).map((tile) => (
+                <img
+                    key={tile.key}
+                    src={tile.src}
+                    alt=""
+                    draggable={false}
+                    className="absolute max-w-none select-none"
+                    style={tile.style}
+                />
+            ))}
+        </div>
+    );
+};
@@ -1,8 +1,27 @@
 export type UpscaleState = 'idle' | 'uploading' | 'processing' | 'completed' | 'error';
 
-export interface UpscaleResponse {
-    url: string; // Blob URL or path
-    originalUrl: string;
+export interface JobStatus {
+    id: string;
+    status: 'queued' | 'running' | 'completed' | 'failed' | 'cancelled';
+    progress: number; // 0..1
+    message: string;
+    error: string | null;
+    eta_seconds: number | null;
+}
+
+// Deep-zoom layout from GET /results/{id}/tiles
+export interface TilePyramid {
+    width: number;
+    height: number;
+    tile_size: number;
+    max_level: number; // full resolution; each level below halves it
+    format: string;
+}
+
+export interface UpscaleResult {
+    downloadUrl: string;
+    tilesUrl: string; // tiles are at `${tilesUrl}/${level}/${x}_${y}`
+    pyramid: TilePyramid;
 }
 
 // Design Tokens (Obsidian Chrome)
@@ -0,0 +1,244 @@
+import threading
+import time
+
+import pytest
+
+from backend.executor import InferenceExecutor, QueueFullError, Ticket
+from backend.locks import HostBudget
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the executor")
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def gate():
+    """Event the blocking test jobs wait on."""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+@pytest.fixture
+def make_executor(gate):
+    """Build executors that are shut down once the test's blocked jobs are let go."""
+    executors = []
+
+    def make(**kwargs):
+        executor = InferenceExecutor(**kwargs)
+        executors.append(executor)
+        return executor
+
+    yield make
+    # Workers stuck on the gate would keep shutdown from returning
+    gate.set()
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def budget(tmp_path):
+    return HostBudget(str(tmp_path / "memory"), capacity=100, poll_interval=0.01)
+
+
+def submit_until_full(executor, gate, ticket, running, limit=200):
+    """Submit blocking jobs until one is rejected, letting workers start up to ``running`` of them."""
+    accepted = 0
+    for _ in range(limit):
+        try:
+            executor.submit(gate.wait, ticket=ticket)
+        except QueueFullError:
+            break
+        accepted += 1
+        wait_until(lambda: executor.in_flight == min(accepted, running))
+    return accepted
+
+
+def run_in_order(executor, gate, tickets, pause=0.0):
+    """
+    Queue one job per ticket behind a job that holds the only worker, then
+    let them all run. Returns the ticket indexes in the order they ran.
+    """
+    order = []
+    executor.submit(gate.wait)
+    wait_until(lambda: executor.in_flight == 1)
+    futures = []
+    for index, ticket in enumerate(tickets):
+        futures.append(executor.submit(order.append, index, ticket=ticket))
+        time.sleep(pause)
+    gate.set()
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_shortest_job_runs_first(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=8, aging=0)
+    order = run_in_order(executor, gate, [Ticket(cost=5), Ticket(cost=1), Ticket(cost=3)])
+
+    assert order == [1, 2, 0]
+
+
+def test_equal_costs_run_in_arrival_order(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=8, aging=0)
+    order = run_in_order(executor, gate, [Ticket(cost=2)] * 4)
+
+    assert order == [0, 1, 2, 3]
+
+
+def test_aging_lets_a_long_wait_beat_a_cheaper_job(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=8, aging=100)
+    # The large job waits 0.2 s longer, which forgives 20 s of its cost
+    order = run_in_order(executor, gate, [Ticket(cost=10), Ticket(cost=1)], pause=0.2)
+
+    assert order == [0, 1]
+
+
+def test_priority_lane_goes_first(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=8, aging=0)
+    order = run_in_order(executor, gate, [Ticket(cost=1), Ticket(cost=100, priority=True)])
+
+    assert order == [1, 0]
+
+
+def test_capped_client_waits_while_others_run(make_executor, gate):
+    executor = make_executor(max_concurrent=2, max_queued=8, max_per_client=1)
+    first = executor.submit(gate.wait, ticket=Ticket(client="a"))
+    wait_until(lambda: executor.in_flight == 1)
+    second = executor.submit(gate.wait, ticket=Ticket(client="a"))
+    other = executor.submit(gate.wait, ticket=Ticket(client="b"))
+
+    # The idle worker skips a's second job for b's
+    wait_until(lambda: executor.in_flight == 2)
+    assert other.running()
+    assert not second.running()
+
+    gate.set()
+    for future in (first, second, other):
+        future.result(timeout=5)
+
+
+def test_capped_client_cannot_grow_queue_past_bound(make_executor, gate):
+    executor = make_executor(max_concurrent=4, max_queued=8, max_per_client=3)
+    accepted = submit_until_full(executor, gate, Ticket(client="a"), running=3)
+
+    # Three run; the rest wait behind the client cap and count against the queue
+    assert accepted == 3 + 8
+    assert executor.is_full
+    with pytest.raises(QueueFullError):
+        executor.submit(gate.wait, ticket=Ticket(client="b"))
+
+
+def test_per_client_queue_limit_leaves_room_for_others(make_executor, gate):
+    executor = make_executor(max_concurrent=2, max_queued=8, max_per_client=1, max_queued_per_client=2)
+    accepted = submit_until_full(executor, gate, Ticket(client="a"), running=1)
+
+    assert accepted == 1 + 2
+    assert executor.is_full_for("a")
+    assert not executor.is_full_for("b")
+    executor.submit(gate.wait, ticket=Ticket(client="b"))
+    wait_until(lambda: executor.in_flight == 2)
+
+
+def test_idle_workers_take_queued_jobs(make_executor, gate):
+    executor = make_executor(max_concurrent=2, max_queued=1)
+    accepted = submit_until_full(executor, gate, Ticket(), running=2)
+
+    assert accepted == 2 + 1
+    assert executor.queued == 1
+
+
+def test_no_queue_rejects_once_workers_are_busy(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=0)
+    executor.submit(gate.wait)
+    wait_until(lambda: executor.in_flight == 1)
+
+    assert executor.is_full
+    with pytest.raises(QueueFullError):
+        executor.submit(gate.wait)
+
+
+def test_predicted_wait_rejects_beyond_max_wait(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=8, max_wait=30, retry_after=1)
+    executor.submit(gate.wait, ticket=Ticket(cost=60))
+    wait_until(lambda: executor.in_flight == 1)
+
+    with pytest.raises(QueueFullError) as excinfo:
+        executor.submit(gate.wait, ticket=Ticket(cost=1))
+    assert excinfo.value.retry_after >= 29
+
+
+def test_cancelled_job_leaves_the_queue(make_executor, gate):
+    executor = make_executor(max_concurrent=1, max_queued=1)
+    executor.submit(gate.wait)
+    wait_until(lambda: executor.in_flight == 1)
+    queued = executor.submit(gate.wait)
+    assert executor.is_full
+
+    queued.cancel()
+    assert executor.queued == 0
+    assert not executor.is_full
+
+
+def test_memory_blocked_job_counts_as_waiting(make_executor, gate, budget):
+    # Another process's job holds most of the budget
+    held = budget.try_acquire(80)
+    executor = make_executor(max_concurrent=2, max_queued=1, memory=budget)
+
+    blocked = executor.submit(lambda: "done", ticket=Ticket(memory=50))
+    # Both workers are idle, but neither can start the job
+    wait_until(lambda: executor.is_full)
+    assert executor.in_flight == 0
+    with pytest.raises(QueueFullError):
+        executor.submit(gate.wait)
+
+    budget.release(held)
+    assert blocked.result(timeout=5) == "done"
+    wait_until(lambda: budget.in_use() == 0)
+    assert not executor.is_full
+
+
+def test_small_jobs_pass_a_job_that_does_not_fit(make_executor, budget):
+    held = budget.try_acquire(80)
+    executor = make_executor(max_concurrent=1, max_queued=4, memory=budget)
+
+    large = executor.submit(lambda: "large", ticket=Ticket(cost=1, memory=50))
+    small = executor.submit(lambda: "small", ticket=Ticket(cost=2, memory=10))
+
+    assert small.result(timeout=5) == "small"
+    assert not large.done()
+    budget.release(held)
+    assert large.result(timeout=5) == "large"
+
+
+def test_stale_job_holds_back_the_jobs_behind_it(make_executor, budget, monkeypatch):
+    monkeypatch.setattr(InferenceExecutor, "MEMORY_PATIENCE", 0.05)
+    held = budget.try_acquire(80)
+    executor = make_executor(max_concurrent=1, max_queued=4, memory=budget)
+
+    large = executor.submit(lambda: "large", ticket=Ticket(cost=1, memory=50))
+    # Passed over for longer than its patience
+    time.sleep(0.2)
+    # Past its patience, the large job now blocks smaller ones that would fit
+    small = executor.submit(lambda: "small", ticket=Ticket(cost=2, memory=10))
+    time.sleep(0.2)
+    assert not small.done()
+
+    budget.release(held)
+    assert large.result(timeout=5) == "large"
+    assert small.result(timeout=5) == "small"
+
+
+def test_reservation_is_held_while_running_and_released_after(make_executor, gate, budget):
+    executor = make_executor(max_concurrent=1, max_queued=4, memory=budget)
+    running = executor.submit(gate.wait, ticket=Ticket(memory=60))
+    wait_until(lambda: executor.in_flight == 1)
+
+    assert budget.in_use() == 60
+    gate.set()
+    running.result(timeout=5)
+    wait_until(lambda: budget.in_use() == 0)
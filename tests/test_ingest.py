@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import io
+
+import pytest
+from PIL import Image
+from starlette.requests import Request
+
+from backend.ingest import (
+    MAX_FIELD_BYTES,
+    MAX_FORM_PARTS,
+    PROBE_BYTES,
+    UploadRejected,
+    UploadSink,
+    check_content_length,
+    read_form,
+)
+
+BOUNDARY = "upload-boundary"
+
+
+def encode_form(*parts):
+    """Multipart body of ``(name, value)`` fields and ``(name, filename, data)`` files, in order."""
+    body = b""
+    for part in parts:
+        if len(part) == 2:
+            name, value = part
+            body += f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+            body += value.encode() + b"\r\n"
+        else:
+            name, filename, data = part
+            body += (
+                f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode()
+            body += data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+def make_request(body, content_length=True, chunk_size=64 * 1024):
+    """Request whose body arrives in ``chunk_size`` pieces; ``request.sent`` counts the bytes read."""
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    sent = {"bytes": 0}
+
+    async def receive():
+        if not chunks:
+            return {"type": "http.disconnect"}
+        chunk = chunks.pop(0)
+        sent["bytes"] += len(chunk)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": headers}, receive)
+    request.sent = sent
+    return request
+
+
+def png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def read(tmp_path):
+    """Read a request's form, streaming its file into ``tmp_path``."""
+    def read(request, max_bytes=1024 * 1024, max_pixels=1_000_000):
+        def open_upload(filename):
+            return UploadSink(str(tmp_path / f"input_{filename}"), max_bytes=max_bytes, max_pixels=max_pixels)
+
+        return asyncio.run(read_form(request, open_upload, max_bytes))
+
+    return read
+
+
+def test_reads_fields_and_file(read, tmp_path):
+    data = png(64, 32)
+    form = read(make_request(encode_form(("model", "m"), ("scale", "2x"), ("file", "a.png", data))))
+
+    assert form.fields == {"model": "m", "scale": "2x"}
+    assert form.filename == "a.png"
+    assert form.upload.path == str(tmp_path / "input_a.png")
+    assert (form.upload.width, form.upload.height, form.upload.format) == (64, 32, "PNG")
+    assert form.upload.size == len(data)
+    assert form.upload.sha256 == hashlib.sha256(data).hexdigest()
+
+
+def test_fields_after_the_file_are_read(read):
+    form = read(make_request(encode_form(("file", "a.png", png(8, 8)), ("model", "m"))))
+
+    assert form.fields == {"model": "m"}
+    assert form.upload.width == 8
+
+
+def test_declared_oversized_body_is_refused_before_reading():
+    request = make_request(encode_form(("file", "a.png", b"x" * (4 * 1024 * 1024))))
+
+    with pytest.raises(UploadRejected) as excinfo:
+        check_content_length(request, 1024 * 1024)
+    assert excinfo.value.status_code == 413
+    assert request.sent["bytes"] == 0
+
+
+def test_chunked_oversized_body_is_cut_off(read, tmp_path):
+    body = encode_form(("file", "a.png", b"x" * (4 * 1024 * 1024)))
+    request = make_request(body, content_length=False)
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(request)
+    assert excinfo.value.status_code == 413
+    assert request.sent["bytes"] < len(body)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_over_the_byte_limit_is_deleted(read, tmp_path):
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(encode_form(("file", "a.png", b"x" * 300_000))), max_bytes=200_000)
+    assert excinfo.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_second_file_part_is_refused(read, tmp_path):
+    body = encode_form(("file", "a.png", png(8, 8)), ("file", "b.png", png(8, 8)))
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(body))
+    assert excinfo.value.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_in_an_unexpected_field_is_refused(read, tmp_path):
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(encode_form(("other", "a.png", png(8, 8)))))
+    assert excinfo.value.status_code == 400
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_field_over_the_field_limit_is_refused(read):
+    body = encode_form(("model", "m" * (MAX_FIELD_BYTES + 1)), ("file", "a.png", png(8, 8)))
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(body))
+    assert excinfo.value.status_code == 413
+
+
+def test_field_after_the_file_over_the_field_limit_deletes_the_file(read, tmp_path):
+    body = encode_form(("file", "a.png", png(8, 8)), ("model", "m" * (MAX_FIELD_BYTES + 1)))
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(body))
+    assert excinfo.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_too_many_parts_are_refused(read):
+    fields = [(f"f{index}", "x") for index in range(MAX_FORM_PARTS + 1)]
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(encode_form(*fields, ("file", "a.png", png(8, 8)))))
+    assert excinfo.value.status_code == 400
+
+
+def test_too_many_pixels_are_refused_once_the_header_arrives(read, tmp_path):
+    # An uncompressed 16 MP image: its header shows its size long before its pixels arrive
+    buffer = io.BytesIO()
+    Image.new("L", (4000, 4000)).save(buffer, "BMP")
+    body = encode_form(("file", "a.bmp", buffer.getvalue()))
+    request = make_request(body)
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(request, max_bytes=32 * 1024 * 1024, max_pixels=4_000_000)
+    assert excinfo.value.status_code == 413
+    assert PROBE_BYTES <= request.sent["bytes"] < PROBE_BYTES + 1024 * 1024
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_file_that_is_not_an_image_is_deleted(read, tmp_path):
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(encode_form(("file", "a.txt", b"hello"))))
+    assert excinfo.value.status_code == 415
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_form_without_a_file_is_refused(read):
+    with pytest.raises(UploadRejected) as excinfo:
+        read(make_request(encode_form(("model", "m"))))
+    assert excinfo.value.status_code == 400
+
+
+def test_body_that_is_not_a_form_is_refused(read):
+    request = make_request(b"hello")
+    request.scope["headers"] = [(b"content-type", b"text/plain")]
+
+    with pytest.raises(UploadRejected) as excinfo:
+        read(request)
+    assert excinfo.value.status_code == 400